@@ -0,0 +1,558 @@
+"""
+Offline benchmarks of the chunker, `summarize_transcript`, the digest emails, the digest bot, the knowledge
+retrieval of vedic-astrology-llm, the local embeddings and the passage search of youtube-summarizer-llm, against
+fixture transcripts, a fake OpenAI API with deterministic responses, fake YouTube feeds and an SMTP sink. Run from
+02-applications:
+
+    python -m benchmarks --output baseline.json
+    python -m benchmarks --baseline baseline.json --max-regression 0.2  # exits with 1 on a regression
+
+Every benchmark reports its throughput, the p50/p95 latency of its calls and the peak memory allocated by one more
+call, traced on its own so that tracing does not slow down the timed calls. The latency of the fake LLM, transcript
+and feed calls is set with the --*-latency options, so runs are only comparable with the same options.
+"""
+import argparse
+import contextlib
+import importlib.util
+import io
+import json
+import logging
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Optional
+
+import yaml
+
+APPLICATIONS = Path(__file__).parent.parent
+sys.path.insert(0, APPLICATIONS.as_posix())
+sys.path.insert(0, (APPLICATIONS / "youtube-summarizer-llm").as_posix())
+sys.path.insert(0, (APPLICATIONS / "youtube-digest-bot" / "src").as_posix())
+sys.path.insert(0, (APPLICATIONS / "vedic-astrology-llm").as_posix())
+
+from benchmarks import fixtures  # noqa: E402
+from benchmarks.servers import serve_feeds  # noqa: E402
+from benchmarks.servers import serve_llm  # noqa: E402
+from benchmarks.servers import SMTPSink  # noqa: E402
+from common.chunking import chunk_text  # noqa: E402
+from common.chunking import count_tokens  # noqa: E402
+from common.chunking import join_captions  # noqa: E402
+from common.transcripts import set_transcript_service  # noqa: E402
+
+SUITES = ("chunker", "summarize", "email", "digest", "retrieval", "embeddings", "search")
+CHUNKER_WORDS = (2000, 10000, 40000)
+SUMMARIZE_WORDS = (2000, 10000)
+# passages of the synthetic indexes of the top-k benchmark, and their dimensions (of text-embedding-3-small)
+TOPK_PASSAGES = (1000, 10000, 50000)
+TOPK_DIMENSIONS = 1536
+# token sizes of the transcript chunks of the embedding benchmarks, mixed so that batches need padding
+EMBEDDING_CHUNK_TOKENS = (32, 128, 256)
+# synthetic corpus of the search benchmarks: passages per video, captions and topic words per passage, topic words
+# per video out of a vocabulary of Zipf distributed words, channels, dimensions of the vectors (those of the fake
+# embeddings) and videos added per batch
+SEARCH_PASSAGES_PER_VIDEO = 5
+SEARCH_CAPTIONS_PER_PASSAGE = 8
+SEARCH_TOPIC_WORDS = (10, 30)
+SEARCH_VOCABULARY = 100_000
+SEARCH_CHANNELS = 100
+SEARCH_DIMENSIONS = 256
+SEARCH_BATCH_VIDEOS = 1000
+# lower is better for these metrics, higher for the throughput
+LATENCY_METRICS = ("p95_ms", "peak_memory_mb")
+# options that change the results, runs are only comparable with the same values
+COMPARABLE_OPTIONS = (
+    "calls",
+    "concurrency",
+    "max_workers",
+    "channels",
+    "subscribers",
+    "llm_latency",
+    "llm_tokens_per_second",
+    "transcript_latency",
+    "feed_latency",
+    "recipients",
+    "smtp_connections",
+    "smtp_latency",
+    "top_k",
+    "embedding_model",
+    "embedding_docs",
+    "search_videos",
+)
+
+
+def _percentile(values: list[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def measure(
+    name: str, call: Callable[[int], object], calls: int, concurrency: int, units: float, unit: str, params: dict
+) -> dict:
+    """Time `calls` calls of `call(i)` on `concurrency` threads, each doing `units` units of work (e.g. tokens)."""
+    # warm up imports, connection pools and caches of the tokenizer
+    call(-1)
+    latencies = []
+
+    def timed(i: int):
+        t0 = time.perf_counter()
+        call(i)
+        latencies.append(time.perf_counter() - t0)
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(timed, range(calls)))
+    seconds = time.perf_counter() - t0
+
+    tracemalloc.start()
+    try:
+        call(calls)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {
+        "benchmark": name,
+        "params": params,
+        "calls": calls,
+        "concurrency": concurrency,
+        "seconds": seconds,
+        "throughput": units * calls / seconds,
+        "unit": f"{unit}/s",
+        "p50_ms": _percentile(latencies, 0.5) * 1000,
+        "p95_ms": _percentile(latencies, 0.95) * 1000,
+        "peak_memory_mb": peak / 1024**2,
+    }
+
+
+def bench_chunker(args: argparse.Namespace) -> list[dict]:
+    results = []
+    for words in CHUNKER_WORDS:
+        text, boundaries = join_captions([caption["text"] for caption in fixtures.captions(words)])
+        params = {"words": words, "chunk_tokens": 500, "overlap_tokens": 50}
+
+        def call(i: int, text: str = text, boundaries: list[int] = boundaries):
+            chunk_text(text, 500, overlap_tokens=50, boundaries=boundaries)
+
+        results.append(measure(f"chunker.{words}w", call, args.calls, 1, count_tokens(text), "tokens", params))
+    return results
+
+
+def bench_summarize(args: argparse.Namespace, llm_url: str) -> list[dict]:
+    # imported here, as the summarizer configures logging and chroma on import
+    from common.llm import ChatLLM
+    from functions import MAX_TOKENS
+    from functions import summarize_transcript
+    from functions import SUMMARIZE_MODES
+
+    llm = ChatLLM("gpt-3.5-turbo", api_key="benchmark", base_url=llm_url, max_tokens=MAX_TOKENS, cache=False)
+    results = []
+    for mode in SUMMARIZE_MODES:
+        for words in SUMMARIZE_WORDS:
+            text = fixtures.transcript(words)
+            params = {"mode": mode, "words": words, "max_workers": args.max_workers}
+
+            def call(i: int, text: str = text, mode: str = mode):
+                link = f"https://www.youtube.com/watch?v=benchmark{i}"
+                summarize_transcript(link, text, mode, args.max_workers, llm=llm)
+
+            name = f"summarize.{mode}.{words}w"
+            results.append(measure(name, call, args.calls, args.concurrency, 1, "videos", params))
+    return results
+
+
+def bench_email(args: argparse.Namespace, sink: SMTPSink) -> list[dict]:
+    from email_sender import EmailSender
+
+    template_path = APPLICATIONS / "youtube-digest-bot" / "templates" / "email_template.html"
+    summaries = [
+        {
+            "title": video["title"],
+            "channel_name": "Benchmark channel",
+            "link": f"https://www.youtube.com/watch?v=benchmark{i}",
+            "summary": fixtures.transcript(150, i),
+            "has_transcript": True,
+        }
+        for i, video in enumerate(fixtures.load_transcripts() * 3)
+    ]
+    digests = [{"recipient": f"user{i}@localhost", "summaries": summaries} for i in range(args.recipients)]
+    results = []
+    # a new SMTP session per message, a single long-lived session, and the pool of sessions
+    for name, connections, per_message in (
+        ("email.session_per_message", 1, True),
+        ("email.session", 1, False),
+        ("email.pool", args.smtp_connections, False),
+    ):
+        sender = EmailSender(
+            "localhost", sink.port, "benchmark", "benchmark", starttls=False, max_connections=connections
+        )
+
+        def call(i: int, sender: EmailSender = sender, per_message: bool = per_message):
+            with contextlib.redirect_stdout(io.StringIO()):
+                if per_message:
+                    for digest in digests:
+                        sent = sender.send_digests([digest], "Digest {date}", template_path)
+                        sender.close()
+                else:
+                    sent = sender.send_digests(digests, "Digest {date}", template_path)
+            if not all(sent):
+                raise RuntimeError(f"{name}: not all digests were sent")
+
+        params = {"recipients": args.recipients, "videos": len(summaries), "smtp_connections": connections}
+        try:
+            results.append(measure(name, call, args.calls, 1, args.recipients, "messages", params))
+        finally:
+            sender.close()
+    return results
+
+
+def bench_digest(args: argparse.Namespace, llm_url: str, feed_url: str, sink: SMTPSink) -> list[dict]:
+    workdir = Path(tempfile.mkdtemp(prefix="digest-benchmark-"))
+    with open(APPLICATIONS / "youtube-digest-bot" / "config.yml") as f:
+        config = yaml.safe_load(f)
+    channels = [f"UCbenchmark{i:02d}" for i in range(args.channels)]
+    config["channels"] = channels
+    config["email"].update({"smtp_server": "localhost", "smtp_port": sink.port, "starttls": False})
+    num_videos = args.channels * fixtures.FEED_VIDEOS
+    config["limits"]["max_videos_per_day"] = num_videos
+    with open(workdir / "config.yml", "w") as f:
+        yaml.safe_dump(config, f)
+    # subscribers of two neighbouring channels each, so that their channel lists overlap
+    config["subscribers"] = [
+        {
+            "email": f"user{i}@localhost",
+            "channels": sorted({channels[i % len(channels)], channels[(i + 1) % len(channels)]}),
+        }
+        for i in range(args.subscribers)
+    ]
+    with open(workdir / "subscribers.yml", "w") as f:
+        yaml.safe_dump(config, f)
+    os.environ.update(
+        {
+            "YOUTUBE_FEED_URL": feed_url,
+            "OPENAI_BASE_URL": llm_url,
+            "OPENAI_API_KEY": "benchmark",
+            "YT_API_KEY": "benchmark",
+            "EMAIL_USER": "benchmark@localhost",
+            "EMAIL_PASS": "benchmark",
+            "RECIPIENT_EMAIL": "digest@localhost",
+        }
+    )
+    # imported after setting the environment, which the digest bot partly reads on import
+    import digest
+
+    results = []
+    argv, sys.argv = sys.argv, ["digest.py"]
+    try:
+        for name, config_file, recipients in (
+            ("digest.main", "config.yml", 1),
+            ("digest.subscribers", "subscribers.yml", args.subscribers),
+        ):
+            os.environ["DIGEST_CONFIG"] = str(workdir / config_file)
+
+            def call(i: int, name: str = name, recipients: int = recipients):
+                # a new data directory per run, so that every run sees all videos as new
+                os.environ["DIGEST_DATA_PATH"] = str(workdir / f"{name}-data{i}")
+                sent = len(sink.messages)
+                output = io.StringIO()
+                try:
+                    with contextlib.redirect_stdout(output):
+                        digest.main()
+                except SystemExit:
+                    raise RuntimeError(f"The digest run failed:\n{output.getvalue()}")
+                if len(sink.messages) != sent + recipients:
+                    raise RuntimeError(f"The digests were not sent:\n{output.getvalue()}")
+
+            params = {"channels": args.channels, "videos": num_videos, "subscribers": recipients}
+            # runs one at a time, as they share the environment and stdout
+            results.append(measure(name, call, args.digest_runs, 1, num_videos, "videos", params))
+    finally:
+        sys.argv = argv
+    return results
+
+
+def bench_retrieval(args: argparse.Namespace, llm_url: str) -> list[dict]:
+    workdir = Path(tempfile.mkdtemp(prefix="retrieval-benchmark-"))
+    # a fresh embedding cache, read by common.embeddings on import
+    os.environ["EMBEDDING_CACHE_PATH"] = str(workdir / "embeddings.sqlite3")
+    import numpy as np
+    from common.embeddings import OpenAIEmbeddings
+    from src.retrieval import get_index
+    from src.retrieval import KnowledgeIndex
+    from src.retrieval import load_knowledge
+
+    questions = [f"What does {title} mean in a chart?" for title in load_knowledge()]
+    uncached = OpenAIEmbeddings(api_key="benchmark", base_url=llm_url, cache=False)
+    cached = OpenAIEmbeddings(api_key="benchmark", base_url=llm_url)
+    index = get_index(path=workdir / "index", embeddings=uncached)
+    results = []
+
+    def build(i: int):
+        get_index(path=workdir / f"index{i}", embeddings=uncached)
+
+    params = {"passages": len(index.passages)}
+    results.append(measure("retrieval.build", build, args.calls, 1, len(index.passages), "passages", params))
+    # the cached searches only embed the questions of the warm-up
+    cached.embed(questions)
+    for name, embeddings in (("retrieval.search", uncached), ("retrieval.search_cached", cached)):
+        searcher = KnowledgeIndex(index.vectors, index.passages, embeddings)
+
+        def search(i: int, searcher: KnowledgeIndex = searcher):
+            searcher.search(questions[i % len(questions)], k=args.top_k)
+
+        params = {"passages": len(index.passages), "k": args.top_k}
+        results.append(measure(name, search, args.calls * 10, 1, 1, "queries", params))
+    # the vectorized top k alone, on synthetic memory-mapped indexes of increasing size
+    rng = np.random.default_rng(0)
+    for passages in TOPK_PASSAGES:
+        vectors = rng.standard_normal((passages, TOPK_DIMENSIONS), dtype=np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        np.save(workdir / f"topk{passages}.npy", vectors)
+        synthetic = KnowledgeIndex(np.load(workdir / f"topk{passages}.npy", mmap_mode="r"), [{}] * passages, uncached)
+        queries = rng.standard_normal((16, TOPK_DIMENSIONS), dtype=np.float32)
+
+        def topk(i: int, synthetic: KnowledgeIndex = synthetic, queries: np.ndarray = queries):
+            synthetic.search_vector(queries[i % len(queries)], k=args.top_k)
+
+        params = {"passages": passages, "dimensions": TOPK_DIMENSIONS, "k": args.top_k}
+        results.append(measure(f"retrieval.topk.{passages}", topk, args.calls * 10, 1, 1, "queries", params))
+        (workdir / f"topk{passages}.npy").unlink()
+    return results
+
+
+def bench_embeddings(args: argparse.Namespace) -> list[dict]:
+    if importlib.util.find_spec("sentence_transformers") is None:
+        print("⚠️  Skipping the embedding benchmarks, they need sentence-transformers")
+        return []
+    from common.embeddings import LocalEmbeddings
+
+    sizes = [EMBEDDING_CHUNK_TOKENS[i % len(EMBEDDING_CHUNK_TOKENS)] for i in range(args.embedding_docs)]
+    # numbered, as the few fixture videos repeat and the embeddings skip duplicate texts
+    docs = [f"{i}. {chunk_text(fixtures.transcript(tokens, i), tokens)[0]}" for i, tokens in enumerate(sizes)]
+    unsorted = LocalEmbeddings(args.embedding_model, cache=False)
+    results = []
+
+    def embed_unsorted(i: int):
+        # fixed-size batches in the order of the documents, as without length sorting
+        for start in range(0, len(docs), 32):
+            unsorted.encoder.encode(docs[start : start + 32], batch_size=32, show_progress_bar=False)
+
+    params = {"model": args.embedding_model, "docs": len(docs)}
+    results.append(measure("embeddings.unsorted", embed_unsorted, args.embedding_runs, 1, len(docs), "docs", params))
+    for name, embeddings in (
+        ("embeddings.sorted", unsorted),
+        ("embeddings.int8", LocalEmbeddings(args.embedding_model, quantize=True, cache=False)),
+        ("embeddings.cached", LocalEmbeddings(args.embedding_model)),
+    ):
+
+        def embed(i: int, embeddings: LocalEmbeddings = embeddings):
+            embeddings.embed(docs)
+
+        params = {"model": args.embedding_model, "docs": len(docs), "batch_tokens": embeddings.batch_tokens}
+        results.append(measure(name, embed, args.embedding_runs, 1, len(docs), "docs", params))
+    return results
+
+
+def bench_search(args: argparse.Namespace, llm_url: str) -> list[dict]:
+    if importlib.util.find_spec("chromadb") is None:
+        print("⚠️  Skipping the search benchmarks, they need chromadb")
+        return []
+    workdir = Path(tempfile.mkdtemp(prefix="search-benchmark-"))
+    os.environ["EMBEDDING_CACHE_PATH"] = str(workdir / "embeddings.sqlite3")
+    import chromadb
+    import numpy as np
+    from common.embeddings import OpenAIEmbeddings
+    from common.search_index import SearchIndex
+    from passages import PASSAGE_METADATA
+    from passages import PassageIndex
+    from passages import search_filter
+
+    client = chromadb.PersistentClient(path=str(workdir / "chroma"))
+    index = PassageIndex(
+        client.create_collection("benchmark_passages", metadata={"hnsw:space": "cosine"}),
+        SearchIndex(workdir / "search.sqlite3", PASSAGE_METADATA),
+        OpenAIEmbeddings(api_key="benchmark", base_url=llm_url),
+    )
+    # passages of random fixture captions, with the everyday words of all videos, and of topic words that set the
+    # videos apart, with random vectors, as the cost of a semantic search only depends on the size of the index
+    captions = [caption["text"] for caption in fixtures.captions(5000)]
+    rng = np.random.default_rng(0)
+    topics = {}
+    t0 = time.perf_counter()
+    for start in range(0, args.search_videos, SEARCH_BATCH_VIDEOS):
+        ids, texts, metadatas = [], [], []
+        for video in range(start, min(start + SEARCH_BATCH_VIDEOS, args.search_videos)):
+            topics[video] = [f"topic{rank}" for rank in rng.zipf(1.2, SEARCH_TOPIC_WORDS[1]) % SEARCH_VOCABULARY]
+            for part in range(SEARCH_PASSAGES_PER_VIDEO):
+                picks = rng.integers(len(captions), size=SEARCH_CAPTIONS_PER_PASSAGE)
+                topic_words = rng.choice(topics[video], SEARCH_TOPIC_WORDS[0], replace=False)
+                ids.append(f"video{video}_transcript_{part}")
+                texts.append(" ".join([captions[i] for i in picks] + list(topic_words)))
+                metadatas.append(
+                    {
+                        "video_id": f"video{video}",
+                        "type": "transcript",
+                        "part": part,
+                        "channel_id": f"UC{video % SEARCH_CHANNELS}",
+                        "published": 1_700_000_000 + video * 3600,
+                    }
+                )
+        vectors = rng.standard_normal((len(ids), SEARCH_DIMENSIONS), dtype=np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        index.collection.add(ids=ids, documents=texts, metadatas=metadatas, embeddings=vectors)
+        index.search_index.upsert(ids, texts, metadatas, vectors)
+    passages = args.search_videos * SEARCH_PASSAGES_PER_VIDEO
+    print(f"Indexed {passages} passages of {args.search_videos} videos in {time.perf_counter() - t0:.1f}s")
+
+    # the query embeddings come from the embedding cache, so that the searches time the indexes
+    queries = [
+        " ".join(captions[i].split()[:6] + list(rng.choice(topics[int(video)], 2, replace=False)))
+        for i, video in enumerate(rng.integers(args.search_videos, size=32))
+    ]
+    index.embeddings.embed(queries)
+    # few passages match a channel and the latest tenth of the videos, searched exactly, and many the latest half,
+    # taken from the nearest neighbours
+    selective = search_filter("UC1", since=1_700_000_000 + args.search_videos * 3600 * 9 // 10)
+    broad = search_filter(since=1_700_000_000 + args.search_videos * 3600 // 2)
+    results = []
+    for name, mode, where in (
+        ("search.semantic", "semantic", None),
+        ("search.keyword", "keyword", None),
+        ("search.hybrid", "hybrid", None),
+        ("search.hybrid_channel", "hybrid", selective),
+        ("search.hybrid_recent", "hybrid", broad),
+    ):
+
+        def search(i: int, mode: str = mode, where: Optional[dict] = where):
+            index.search(queries[i % len(queries)], k=args.top_k, mode=mode, where=where)
+
+        params = {"videos": args.search_videos, "passages": passages, "k": args.top_k}
+        results.append(measure(name, search, args.calls * 10, 1, 1, "queries", params))
+    return results
+
+
+def compare(results: list[dict], baseline: list[dict], max_regression: float) -> list[str]:
+    """Benchmarks whose throughput, p95 latency or peak memory is worse than the baseline by over `max_regression`."""
+    baseline = {result["benchmark"]: result for result in baseline}
+    regressions = []
+    for result in results:
+        base = baseline.get(result["benchmark"])
+        if base is None:
+            continue
+        if result["throughput"] < base["throughput"] * (1 - max_regression):
+            change = result["throughput"] / base["throughput"] - 1
+            regressions.append(f"{result['benchmark']}: throughput {change:+.0%}")
+        for metric in LATENCY_METRICS:
+            if result[metric] > base[metric] * (1 + max_regression):
+                regressions.append(f"{result['benchmark']}: {metric} {result[metric] / base[metric] - 1:+.0%}")
+    return regressions
+
+
+def report(results: list[dict], baseline: Optional[list[dict]] = None) -> str:
+    baseline = {result["benchmark"]: result for result in baseline or []}
+    lines = [
+        f"{'benchmark':<30} {'calls':>5} {'conc':>4} {'throughput':>22} {'p50 ms':>9} {'p95 ms':>9} {'peak MB':>8}"
+        + (f" {'vs baseline':>12}" if baseline else "")
+    ]
+    for result in results:
+        line = (
+            f"{result['benchmark']:<30} {result['calls']:>5} {result['concurrency']:>4}"
+            f" {result['throughput']:>12.1f} {result['unit']:<9} {result['p50_ms']:>9.1f} {result['p95_ms']:>9.1f}"
+            f" {result['peak_memory_mb']:>8.1f}"
+        )
+        if result["benchmark"] in baseline:
+            line += f" {result['throughput'] / baseline[result['benchmark']]['throughput'] - 1:>+12.0%}"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def main(args: argparse.Namespace) -> int:
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+    llm_server = serve_llm(args.llm_latency, args.llm_tokens_per_second)
+    llm_url = f"http://localhost:{llm_server.server_address[1]}/v1"
+    set_transcript_service(fixtures.FixtureTranscriptService(args.transcript_latency))
+    print(
+        f"Fake LLM latency {args.llm_latency}s + {args.llm_tokens_per_second} tokens/s, transcript latency"
+        f" {args.transcript_latency}s, feed latency {args.feed_latency}s, SMTP latency {args.smtp_latency}s"
+    )
+
+    results = []
+    if "chunker" in args.suite:
+        results += bench_chunker(args)
+    if "summarize" in args.suite:
+        results += bench_summarize(args, llm_url)
+    sink = SMTPSink(args.smtp_latency)
+    if "email" in args.suite:
+        results += bench_email(args, sink)
+    if "digest" in args.suite:
+        feed_server = serve_feeds(args.feed_latency)
+        feed_url = f"http://localhost:{feed_server.server_address[1]}/feeds/videos.xml?channel_id={{channel_id}}"
+        results += bench_digest(args, llm_url, feed_url, sink)
+    if "retrieval" in args.suite:
+        results += bench_retrieval(args, llm_url)
+    if "embeddings" in args.suite:
+        results += bench_embeddings(args)
+    if "search" in args.suite:
+        results += bench_search(args, llm_url)
+
+    baseline = None
+    options = {key: value for key, value in vars(args).items() if key in COMPARABLE_OPTIONS}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline_run = json.load(f)
+        baseline = baseline_run["results"]
+        baseline_options = {key: baseline_run["options"].get(key) for key in options}
+        if baseline_options != options:
+            print(f"⚠️  The baseline was run with other options: {baseline_options}")
+    print(report(results, baseline))
+    if args.output:
+        run = {
+            "created_at": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "options": {key: value for key, value in vars(args).items() if key not in ("output", "baseline")},
+            "results": results,
+        }
+        with open(args.output, "w") as f:
+            json.dump(run, f, indent=2)
+    if baseline is not None:
+        regressions = compare(results, baseline, args.max_regression)
+        for regression in regressions:
+            print(f"❌ Regression {regression}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline benchmarks of the applications")
+    parser.add_argument("--suite", nargs="+", choices=SUITES, default=list(SUITES), help="Benchmarks to run")
+    parser.add_argument("--calls", type=int, default=10, help="Timed calls of the chunker and summarize benchmarks")
+    parser.add_argument("--concurrency", type=int, default=2, help="Concurrent summarize_transcript calls")
+    parser.add_argument("--max-workers", type=int, default=4, help="LLM calls in flight per summary")
+    parser.add_argument("--digest-runs", type=int, default=3, help="Timed runs of the digest bot")
+    parser.add_argument("--channels", type=int, default=2, help="Channels of the digest, with 6 videos each")
+    parser.add_argument("--subscribers", type=int, default=20, help="Subscribers of the multi-tenant digest")
+    parser.add_argument("--top-k", type=int, default=4, help="Passages per query of the retrieval benchmarks")
+    parser.add_argument(
+        "--embedding-model",
+        default="sentence-transformers/all-MiniLM-L6-v2",
+        help="Model of the local embedding benchmarks",
+    )
+    parser.add_argument("--embedding-docs", type=int, default=200, help="Transcript chunks per embedding run")
+    parser.add_argument("--embedding-runs", type=int, default=2, help="Timed runs of the embedding benchmarks")
+    parser.add_argument("--search-videos", type=int, default=20000, help="Videos of the synthetic search corpus")
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="Seconds until a fake completion starts")
+    parser.add_argument("--llm-tokens-per-second", type=float, default=500, help="Fake completion tokens per second")
+    parser.add_argument("--transcript-latency", type=float, default=0.02, help="Seconds per fixture transcript fetch")
+    parser.add_argument("--feed-latency", type=float, default=0.01, help="Seconds per fixture feed fetch")
+    parser.add_argument("--recipients", type=int, default=50, help="Recipients of the email benchmarks")
+    parser.add_argument("--smtp-connections", type=int, default=4, help="SMTP sessions of the pooled email benchmark")
+    parser.add_argument("--smtp-latency", type=float, default=0.002, help="Seconds per SMTP command of the sink")
+    parser.add_argument("--output", default=None, help="JSON file to write the results to")
+    parser.add_argument("--baseline", default=None, help="JSON results of an earlier run to compare with")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="Tolerated regression against the baseline")
+    parser.add_argument("--verbose", action="store_true", help="Log the INFO messages of the applications")
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,88 @@
+"""
+Fixture transcripts and YouTube channel feed of the benchmarks.
+
+transcripts.json holds a few videos with their captions in the raw format of youtube-transcript-api, longer
+transcripts repeat them. feed.xml is a channel feed in the format of youtube.com/feeds/videos.xml, whose video ids
+"<channel_id>-<n>" map to fixture video n.
+"""
+import functools
+import json
+import string
+import time
+import zlib
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Optional, Sequence
+
+FIXTURES = Path(__file__).parent
+# entries of feed.xml
+FEED_VIDEOS = 6
+
+
+@functools.lru_cache(maxsize=None)
+def load_transcripts() -> list[dict]:
+    """The fixture videos, with their title and captions."""
+    with open(FIXTURES / "transcripts.json") as f:
+        return json.load(f)
+
+
+@functools.lru_cache(maxsize=None)
+def _feed_template() -> string.Template:
+    with open(FIXTURES / "feed.xml") as f:
+        return string.Template(f.read())
+
+
+def captions(num_words: int, seed: int = 0) -> list[dict]:
+    """Captions of `num_words` words, the fixture videos one after another from video `seed` on."""
+    videos = load_transcripts()
+    result, words, offset, i = [], 0, 0.0, seed
+    while words < num_words:
+        for caption in videos[i % len(videos)]["captions"]:
+            if words >= num_words:
+                break
+            result.append({**caption, "start": round(caption["start"] + offset, 2)})
+            words += len(caption["text"].split())
+        offset = result[-1]["start"] + result[-1]["duration"]
+        i += 1
+    return result
+
+
+def transcript(num_words: int, seed: int = 0) -> str:
+    return " ".join(caption["text"] for caption in captions(num_words, seed))
+
+
+def render_feed(channel_id: str, now: Optional[datetime] = None) -> str:
+    """The feed of a channel, with its videos published an hour apart up to `now`."""
+    now = now or datetime.now(timezone.utc)
+    published = {
+        f"published_{i}": (now - timedelta(hours=i)).isoformat(timespec="seconds") for i in range(FEED_VIDEOS)
+    }
+    return _feed_template().substitute(channel_id=channel_id, **published)
+
+
+def video_index(video_id: str) -> int:
+    """Fixture video of a video id, by its "-<n>" suffix or else its hash."""
+    suffix = video_id.rpartition("-")[2]
+    return int(suffix) if suffix.isdigit() else zlib.crc32(video_id.encode())
+
+
+class FixtureTranscriptService:
+    """
+    Stand-in for `common.transcripts.TranscriptService` that answers with the captions of the fixture videos after
+    `latency` seconds, or with `num_words` words of captions when set.
+    """
+
+    def __init__(self, latency: float = 0.0, num_words: Optional[int] = None):
+        self.latency = latency
+        self.num_words = num_words
+
+    def fetch(self, video_id: str, languages: Sequence[str] = ("en",), any_language: bool = False) -> list[dict]:
+        time.sleep(self.latency)
+        index = video_index(video_id)
+        if self.num_words:
+            return captions(self.num_words, index)
+        videos = load_transcripts()
+        return videos[index % len(videos)]["captions"]
+
+    def is_available(self, video_id: str) -> bool:
+        return True
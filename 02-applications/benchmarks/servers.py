@@ -0,0 +1,153 @@
+"""Local stand-ins for the OpenAI API, the YouTube feeds and an SMTP server, each in a background thread."""
+import hashlib
+import json
+import socketserver
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from typing import Optional
+
+from benchmarks.fixtures import render_feed
+from utils.fake_openai_server import default_responder
+from utils.fake_openai_server import FakeOpenAI
+from utils.fake_openai_server import serve
+
+
+def llm_responder(body: dict) -> str:
+    """
+    Deterministic answers to the structured output requests of the summarizer (`SummaryResponse`,
+    `WaitingResponse`) and the digest bot, derived from the hash of the prompt.
+    """
+    if body.get("tool_choice"):
+        name = body["tool_choice"]["function"]["name"]
+    elif body.get("response_format", {}).get("type") == "json_schema":
+        name = body["response_format"]["json_schema"]["name"]
+    else:
+        name = None
+    digest = hashlib.sha256(json.dumps(body["messages"]).encode()).hexdigest()
+    if name == "SummaryResponse":
+        points = [f"📌 Point {i} of {digest[:8]}. Reference: {digest[i : i + 16]}" for i in range(10)]
+        return json.dumps({"summary": points})
+    if name == "WaitingResponse":
+        return json.dumps({"message": "waiting"})
+    return default_responder(body)
+
+
+def serve_llm(latency: float = 0.0, tokens_per_second: Optional[float] = None) -> ThreadingHTTPServer:
+    """Fake OpenAI API answering with `llm_responder`, its base URL is http://localhost:<port>/v1"""
+    return serve(0, FakeOpenAI(llm_responder, latency=latency, tokens_per_second=tokens_per_second))
+
+
+def _make_feed_handler(latency: float) -> type:
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            url = urllib.parse.urlparse(self.path)
+            channel_id = urllib.parse.parse_qs(url.query).get("channel_id", [None])[0]
+            if url.path != "/feeds/videos.xml" or not channel_id:
+                self.send_error(404)
+                return
+            time.sleep(latency)
+            body = render_feed(channel_id).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/atom+xml; charset=UTF-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *a):
+            pass
+
+    return Handler
+
+
+def serve_feeds(latency: float = 0.0) -> ThreadingHTTPServer:
+    """
+    Channel feeds of the fixture feed for any channel id, after `latency` seconds. Its feed URL is
+    http://localhost:<port>/feeds/videos.xml?channel_id={channel_id}
+    """
+    server = ThreadingHTTPServer(("localhost", 0), _make_feed_handler(latency))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+    def _reply(self, line: str):
+        # a network round trip per command
+        time.sleep(self.server.sink.latency)
+        self.wfile.write(f"{line}\r\n".encode())
+
+    def handle(self):
+        sink: SMTPSink = self.server.sink
+        self._reply("220 localhost SMTP sink")
+        recipients = []
+        while line := self.rfile.readline():
+            command, _, argument = line.decode().rstrip("\r\n").partition(" ")
+            command = command.upper()
+            if command == "EHLO":
+                self._reply("250-localhost")
+                self._reply("250-AUTH PLAIN")
+                self._reply("250 SIZE 52428800")
+            elif command == "HELO":
+                self._reply("250 localhost")
+            elif command == "AUTH":
+                # any credentials are accepted, smtplib sends them as initial response of AUTH PLAIN
+                mechanism, _, credentials = argument.partition(" ")
+                if mechanism.upper() != "PLAIN" or not credentials:
+                    self._reply("504 5.5.4 Only AUTH PLAIN with initial response is supported")
+                    continue
+                self._reply("235 2.7.0 Authentication successful")
+            elif command == "MAIL":
+                recipients = []
+                self._reply("250 OK")
+            elif command == "RCPT":
+                recipients.append(argument.partition(":")[2].strip("<> "))
+                self._reply("250 OK")
+            elif command == "DATA":
+                self._reply("354 End data with <CR><LF>.<CR><LF>")
+                data = []
+                while (data_line := self.rfile.readline()) not in (b".\r\n", b""):
+                    # undo the dot-stuffing of lines starting with a dot
+                    data.append(data_line[1:] if data_line.startswith(b"..") else data_line)
+                sink.add(recipients, b"".join(data))
+                self._reply("250 OK: queued")
+            elif command in ("RSET", "NOOP"):
+                self._reply("250 OK")
+            elif command == "STARTTLS":
+                self._reply("454 4.7.0 TLS not available")
+            elif command == "QUIT":
+                self._reply("221 Bye")
+                return
+            else:
+                self._reply("502 5.5.2 Command not implemented")
+
+
+class SMTPSink:
+    """
+    SMTP server on localhost that accepts every message and keeps it in memory, answering each command after
+    `latency` seconds. Plain text only, no STARTTLS.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.messages: list[dict] = []
+        self._lock = threading.Lock()
+        self._server = socketserver.ThreadingTCPServer(("localhost", 0), _SMTPHandler)
+        self._server.daemon_threads = True
+        self._server.sink = self
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    @property
+    def port(self) -> int:
+        return self._server.server_address[1]
+
+    def add(self, recipients: list[str], data: bytes):
+        with self._lock:
+            self.messages.append({"recipients": recipients, "bytes": len(data), "data": data})
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
@@ -0,0 +1,167 @@
+import bisect
+import functools
+import importlib.util
+import logging
+import re
+from typing import Optional
+
+from common import telemetry
+
+if importlib.util.find_spec("tiktoken") is not None:
+    import tiktoken
+else:
+    tiktoken = None
+
+
+logger = logging.getLogger(__name__)
+MODEL_CONTEXT_TOKENS = {
+    "gpt-3.5-turbo": 16385,
+    "gpt-4": 8192,
+    "gpt-4-turbo": 128000,
+    "gpt-4o": 128000,
+    "gpt-4o-mini": 128000,
+}
+DEFAULT_CONTEXT_TOKENS = 4096
+# sentence ends and line breaks, the boundary is the start of the next sentence
+_SENTENCE_BOUNDARY_RE = re.compile(r"(?<=[.!?…])\s+|\n+")
+# without tiktoken, approximate the BPE tokens by words split into pieces of at most 4 characters and
+# punctuation, this overestimates the real token count a little so that chunks never overflow
+_APPROX_TOKEN_RE = re.compile(r"\w{1,4}|[^\w\s]")
+
+
+class Tokenizer:
+    """Tokenizer of a model, using tiktoken when installed and an approximation otherwise."""
+
+    def __init__(self, model: str):
+        self.model = model
+        self.encoding = None
+        if tiktoken is not None:
+            try:
+                self.encoding = tiktoken.encoding_for_model(model)
+            except KeyError:
+                self.encoding = tiktoken.get_encoding("cl100k_base")
+            except Exception as e:
+                logger.warning(f"Unable to load the tiktoken encoding, approximating token counts: {e}")
+
+    def count(self, text: str) -> int:
+        if self.encoding is not None:
+            return len(self.encoding.encode(text, disallowed_special=()))
+        return sum(1 for _ in _APPROX_TOKEN_RE.finditer(text))
+
+    def token_offsets(self, text: str) -> list[int]:
+        """Character offset of the start of every token in the text."""
+        if self.encoding is not None:
+            tokens = self.encoding.encode(text, disallowed_special=())
+            return self.encoding.decode_with_offsets(tokens)[1]
+        return [m.start() for m in _APPROX_TOKEN_RE.finditer(text)]
+
+
+def get_tokenizer(model: str = "gpt-3.5-turbo") -> Tokenizer:
+    # the model is passed positionally, so that get_tokenizer() and get_tokenizer("gpt-3.5-turbo") share a cache entry
+    return _get_tokenizer(model)
+
+
+@functools.lru_cache(maxsize=None)
+def _get_tokenizer(model: str) -> Tokenizer:
+    return Tokenizer(model)
+
+
+def count_tokens(text: str, model: str = "gpt-3.5-turbo") -> int:
+    return get_tokenizer(model).count(text)
+
+
+def get_chunk_budget(model: str, prompt: str = "", max_tokens: int = 0, margin: int = 64) -> int:
+    """Number of tokens left for a chunk in the context window of the model, after the prompt and the reply."""
+    context_tokens = MODEL_CONTEXT_TOKENS.get(model, DEFAULT_CONTEXT_TOKENS)
+    return context_tokens - count_tokens(prompt, model) - max_tokens - margin
+
+
+def join_captions(captions: list[str]) -> tuple[str, list[int]]:
+    """Join caption texts with spaces, returning the text and the character offset where every caption starts."""
+    boundaries, offset = [], 0
+    for caption in captions:
+        boundaries.append(offset)
+        offset += len(caption) + 1
+    return " ".join(captions), boundaries
+
+
+def chunk_text(
+    text: str,
+    max_tokens: int,
+    model: str = "gpt-3.5-turbo",
+    overlap_tokens: int = 0,
+    boundaries: Optional[list[int]] = None,
+) -> list[str]:
+    """
+    Split the text into chunks of at most `max_tokens` tokens, with `overlap_tokens` tokens of overlap.
+
+    Chunks end at the last boundary that fits, given as character offsets (e.g. caption starts from
+    `join_captions`) or sentence ends by default, then at a word boundary and only then mid-word.
+    The text is tokenized once and chunks are sliced from the token offsets.
+    """
+    if overlap_tokens >= max_tokens:
+        raise ValueError(f"overlap_tokens ({overlap_tokens}) must be smaller than max_tokens ({max_tokens})")
+    with telemetry.span("chunking", max_tokens=max_tokens, overlap_tokens=overlap_tokens) as span:
+        chunks = _chunk_text(text, max_tokens, model, overlap_tokens, boundaries)
+        span.set(chunks=len(chunks))
+        return chunks
+
+
+def _chunk_text(
+    text: str, max_tokens: int, model: str, overlap_tokens: int, boundaries: Optional[list[int]]
+) -> list[str]:
+    offsets = get_tokenizer(model).token_offsets(text)
+    num_tokens = len(offsets)
+    if boundaries is None:
+        boundaries = [m.end() for m in _SENTENCE_BOUNDARY_RE.finditer(text)]
+    # token index of every boundary, a boundary inside a token moves to the next token
+    boundary_tokens = sorted({bisect.bisect_left(offsets, b) for b in boundaries})
+
+    chunks, start = [], 0
+    while start < num_tokens:
+        end = start + max_tokens
+        if end >= num_tokens:
+            chunks.append(text[offsets[start] :].strip())
+            break
+        end = _find_chunk_end(text, offsets, boundary_tokens, start, end)
+        chunks.append(text[offsets[start] : offsets[end]].strip())
+        start = max(end - overlap_tokens, start + 1)
+        if overlap_tokens:
+            start = _find_word_start(text, offsets, start, end)
+    return [c for c in chunks if c]
+
+
+def truncate_text(
+    text: str, max_tokens: int, model: str = "gpt-3.5-turbo", boundaries: Optional[list[int]] = None
+) -> str:
+    """First chunk of `chunk_text`, i.e. the text cut at the last boundary within `max_tokens` tokens."""
+    offsets = get_tokenizer(model).token_offsets(text)
+    if len(offsets) <= max_tokens:
+        return text
+    if boundaries is None:
+        boundaries = [m.end() for m in _SENTENCE_BOUNDARY_RE.finditer(text, 0, offsets[max_tokens])]
+    boundary_tokens = sorted({bisect.bisect_left(offsets, b) for b in boundaries})
+    return text[: offsets[_find_chunk_end(text, offsets, boundary_tokens, 0, max_tokens)]].strip()
+
+
+def _is_word_start(text: str, offsets: list[int], i: int) -> bool:
+    return text[offsets[i]].isspace() or text[offsets[i] - 1].isspace()
+
+
+def _find_chunk_end(text: str, offsets: list[int], boundary_tokens: list[int], start: int, end: int) -> int:
+    # chunks are at least half full, otherwise a boundary is not worth the extra round-trip
+    min_end = start + (end - start) // 2
+    i = bisect.bisect_right(boundary_tokens, end) - 1
+    if i >= 0 and boundary_tokens[i] > min_end:
+        return boundary_tokens[i]
+    for j in range(end, min_end, -1):
+        if _is_word_start(text, offsets, j):
+            return j
+    return end
+
+
+def _find_word_start(text: str, offsets: list[int], start: int, end: int) -> int:
+    for j in range(start, end):
+        if _is_word_start(text, offsets, j):
+            return j
+    return start
@@ -0,0 +1,325 @@
+import functools
+import hashlib
+import importlib.util
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Optional, Union
+
+import numpy as np
+
+from common import telemetry
+from common.chunking import count_tokens
+from common.chunking import truncate_text
+from common.llm import DEADLINE
+from common.llm import get_client
+from common.llm import get_scheduler
+
+logger = logging.getLogger(__name__)
+# "openai" or "local" (sentence-transformers on the CPU), and the model of the provider, by default
+# text-embedding-3-small or all-MiniLM-L6-v2
+EMBEDDING_PROVIDER = os.environ.get("EMBEDDING_PROVIDER", "openai")
+EMBEDDING_MODEL = os.environ.get("EMBEDDING_MODEL") or None
+# set EMBEDDING_CACHE_PATH to an empty string to keep the embedding cache in memory only
+EMBEDDING_CACHE_PATH = os.environ.get(
+    "EMBEDDING_CACHE_PATH", str(Path.home() / ".cache" / "llm-playground" / "embeddings.sqlite3")
+)
+# inputs and tokens per request, the API allows 2048 inputs and 300k tokens
+EMBEDDING_BATCH_SIZE = int(os.environ.get("EMBEDDING_BATCH_SIZE", 256))
+EMBEDDING_BATCH_TOKENS = int(os.environ.get("EMBEDDING_BATCH_TOKENS", 100_000))
+# longer inputs are cut to the context of the embedding models
+MAX_INPUT_TOKENS = 8191
+# padded tokens per batch of the local model, and int8 weights for its linear layers
+LOCAL_BATCH_TOKENS = int(os.environ.get("EMBEDDING_LOCAL_BATCH_TOKENS", 4096))
+EMBEDDING_QUANTIZE = os.environ.get("EMBEDDING_QUANTIZE", "false").lower() in ("1", "true", "yes")
+# SQLite limits the number of variables of a query
+_SQL_BATCH = 500
+
+# the embedding cache and the embedding models are shared by all threads
+_registry_lock = threading.RLock()
+_embedding_cache: Optional["EmbeddingCache"] = None
+_embeddings: dict[tuple, "Embeddings"] = {}
+
+
+class EmbeddingCache:
+    """
+    Content-addressed text -> embedding cache, stored as float32 vectors in SQLite. Embeddings are deterministic, so
+    entries never expire. Set `path` to None to only keep them in memory.
+    """
+
+    def __init__(self, path: Optional[Union[str, Path]] = EMBEDDING_CACHE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._memory: dict[str, bytes] = {}
+        self.hits = 0
+        self.misses = 0
+        self._db = None
+        if path:
+            path = Path(path).expanduser()
+            path.parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(str(path), check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB, created_at REAL)"
+            )
+
+    @staticmethod
+    def make_key(model: str, text: str) -> str:
+        return hashlib.sha256(f"{model}\0{text}".encode()).hexdigest()
+
+    def get_many(self, keys: list[str]) -> dict[str, np.ndarray]:
+        """The cached vectors of the keys that are in the cache."""
+        found = {}
+        with self._lock:
+            if self._db is None:
+                found = {key: self._memory[key] for key in keys if key in self._memory}
+            else:
+                unique = list(dict.fromkeys(keys))
+                for i in range(0, len(unique), _SQL_BATCH):
+                    batch = unique[i : i + _SQL_BATCH]
+                    rows = self._db.execute(
+                        f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(batch))})", batch
+                    )
+                    found.update(rows)
+            self.hits += sum(1 for key in keys if key in found)
+            self.misses += sum(1 for key in keys if key not in found)
+        return {key: np.frombuffer(vector, dtype=np.float32) for key, vector in found.items()}
+
+    def set_many(self, items: dict[str, np.ndarray]):
+        rows = [(key, np.asarray(vector, dtype=np.float32).tobytes(), time.time()) for key, vector in items.items()]
+        with self._lock:
+            if self._db is None:
+                self._memory.update((key, vector) for key, vector, _ in rows)
+            else:
+                self._db.executemany("INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?)", rows)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / max(self.hits + self.misses, 1)}
+
+
+def get_embedding_cache() -> EmbeddingCache:
+    """Get the process-wide embedding cache, configured with EMBEDDING_CACHE_PATH."""
+    global _embedding_cache
+    with _registry_lock:
+        if _embedding_cache is None:
+            _embedding_cache = EmbeddingCache()
+        return _embedding_cache
+
+
+class Embeddings:
+    """
+    Embedding model of a provider. embeddings.embed(texts) returns a float32 matrix with a row per text, the texts
+    are looked up in the embedding cache and only the missing ones are embedded, by `_embed` of the provider.
+    """
+
+    provider = ""
+    default_model = ""
+
+    def __init__(self, model: Optional[str] = None, cache: bool = True):
+        self.model = model or self.default_model
+        self.cache = cache
+        self.usage = {"calls": 0, "texts": 0, "prompt_tokens": 0}
+        self._usage_lock = threading.Lock()
+
+    @property
+    def cache_model(self) -> str:
+        """Name of the model in the cache keys, which covers every setting that changes the vectors."""
+        return self.model
+
+    def _embed(self, texts: list[str]) -> list[np.ndarray]:
+        raise NotImplementedError
+
+    def _record_usage(self, texts: int, tokens: int):
+        with self._usage_lock:
+            self.usage["calls"] += 1
+            self.usage["texts"] += texts
+            self.usage["prompt_tokens"] += tokens
+
+    def embed(self, texts: list[str]) -> np.ndarray:
+        """Embed the texts, a row per text."""
+        with telemetry.span("embeddings", provider=self.provider, model=self.model, texts=len(texts)) as span:
+            keys = [EmbeddingCache.make_key(self.cache_model, text) for text in texts]
+            vectors = get_embedding_cache().get_many(keys) if self.cache else {}
+            missing = {key: text for key, text in zip(keys, texts) if key not in vectors}
+            span.set(cached=sum(1 for key in keys if key in vectors))
+            computed = dict(zip(missing, self._embed(list(missing.values())))) if missing else {}
+            if computed and self.cache:
+                get_embedding_cache().set_many(computed)
+            vectors.update(computed)
+            return np.stack([vectors[key] for key in keys]) if texts else np.empty((0, 0), dtype=np.float32)
+
+    def embed_query(self, text: str) -> np.ndarray:
+        return self.embed([text])[0]
+
+
+class OpenAIEmbeddings(Embeddings):
+    """
+    OpenAI embedding model, running on the shared clients and rate limits of `common.llm`. Texts are embedded in
+    batches of at most `batch_size` texts and `batch_tokens` tokens per request.
+    """
+
+    provider = "openai"
+    default_model = "text-embedding-3-small"
+
+    def __init__(
+        self,
+        model: Optional[str] = None,
+        api_key: Optional[str] = None,
+        base_url: Optional[str] = None,
+        batch_size: int = EMBEDDING_BATCH_SIZE,
+        batch_tokens: int = EMBEDDING_BATCH_TOKENS,
+        cache: bool = True,
+        deadline: Optional[float] = DEADLINE,
+    ):
+        super().__init__(model, cache)
+        self.batch_size = batch_size
+        self.batch_tokens = batch_tokens
+        self.deadline = deadline
+        self.scheduler = get_scheduler(self.model, api_key, base_url)
+        self.client_kws = {"api_key": api_key, "base_url": base_url}
+
+    def _batches(self, texts: list[str]) -> list[tuple[list[str], int]]:
+        batches, batch, tokens = [], [], 0
+        for text in texts:
+            text_tokens = count_tokens(text)
+            if text_tokens > MAX_INPUT_TOKENS:
+                text, text_tokens = truncate_text(text, MAX_INPUT_TOKENS), MAX_INPUT_TOKENS
+            if batch and (len(batch) >= self.batch_size or tokens + text_tokens > self.batch_tokens):
+                batches.append((batch, tokens))
+                batch, tokens = [], 0
+            batch.append(text)
+            tokens += text_tokens
+        if batch:
+            batches.append((batch, tokens))
+        return batches
+
+    def _create(self, texts: list[str], tokens: int) -> list[np.ndarray]:
+        def create(timeout: Optional[float]):
+            kws = {"timeout": timeout} if timeout is not None else {}
+            raw = get_client(**self.client_kws).embeddings.with_raw_response.create(
+                model=self.model, input=texts, **kws
+            )
+            self.scheduler.update(raw.headers)
+            return raw.parse()
+
+        response = self.scheduler.run(create, tokens, self.deadline)
+        self._record_usage(len(texts), response.usage.prompt_tokens if response.usage else 0)
+        return [np.asarray(item.embedding, dtype=np.float32) for item in sorted(response.data, key=lambda d: d.index)]
+
+    def _embed(self, texts: list[str]) -> list[np.ndarray]:
+        batches = self._batches(texts)
+        telemetry.current_span().set(batches=len(batches))
+        return [vector for batch, tokens in batches for vector in self._create(batch, tokens)]
+
+
+class LocalEmbeddings(Embeddings):
+    """
+    sentence-transformers model on the CPU, loaded on first use. Needs sentence-transformers (and torch).
+
+    The texts are sorted by their token length and packed into batches of at most `batch_tokens` padded tokens: a
+    batch is padded to its longest text, so similar lengths waste little compute on padding, short texts go in large
+    batches and long ones in small batches. With `quantize` the linear layers run with int8 weights (dynamic
+    quantization), faster on CPU for a small loss of accuracy.
+    """
+
+    provider = "local"
+    default_model = "sentence-transformers/all-MiniLM-L6-v2"
+
+    def __init__(
+        self,
+        model: Optional[str] = None,
+        batch_tokens: int = LOCAL_BATCH_TOKENS,
+        max_batch_size: int = 256,
+        quantize: bool = EMBEDDING_QUANTIZE,
+        normalize: bool = True,
+        device: str = "cpu",
+        cache: bool = True,
+    ):
+        super().__init__(model, cache)
+        self.batch_tokens = batch_tokens
+        self.max_batch_size = max_batch_size
+        self.quantize = quantize
+        self.normalize = normalize
+        self.device = device
+        # one batch at a time, torch already runs a batch on all cores
+        self._lock = threading.Lock()
+
+    @property
+    def cache_model(self) -> str:
+        return f"{self.model}{':int8' if self.quantize else ''}{'' if self.normalize else ':unnormalized'}"
+
+    @functools.cached_property
+    def encoder(self):
+        if importlib.util.find_spec("sentence_transformers") is None:
+            raise ImportError("The local embedding provider needs sentence-transformers")
+        # imported here as torch takes seconds to import
+        import torch
+        from sentence_transformers import SentenceTransformer
+
+        logger.info(f"Loading local embedding model '{self.model}'{' with int8 weights' if self.quantize else ''}")
+        encoder = SentenceTransformer(self.model, device=self.device)
+        if self.quantize:
+            encoder = torch.ao.quantization.quantize_dynamic(encoder, {torch.nn.Linear}, dtype=torch.qint8)
+        return encoder
+
+    def _lengths(self, texts: list[str]) -> list[int]:
+        tokens = self.encoder.tokenizer(texts, truncation=True, max_length=self.encoder.max_seq_length)["input_ids"]
+        return [len(ids) for ids in tokens]
+
+    def batches(self, lengths: list[int]) -> list[list[int]]:
+        """Indices of the texts per batch, by length, with at most `batch_tokens` tokens after padding."""
+        batches, batch = [], []
+        for i in sorted(range(len(lengths)), key=lengths.__getitem__):
+            # sorted by length, so the text is the longest of its batch
+            if batch and ((len(batch) + 1) * lengths[i] > self.batch_tokens or len(batch) >= self.max_batch_size):
+                batches.append(batch)
+                batch = []
+            batch.append(i)
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def _embed(self, texts: list[str]) -> list[np.ndarray]:
+        vectors = [None] * len(texts)
+        with self._lock:
+            lengths = self._lengths(texts)
+            batches = self.batches(lengths)
+            telemetry.current_span().set(batches=len(batches))
+            for batch in batches:
+                output = self.encoder.encode(
+                    [texts[i] for i in batch],
+                    batch_size=len(batch),
+                    convert_to_numpy=True,
+                    normalize_embeddings=self.normalize,
+                    show_progress_bar=False,
+                )
+                for i, vector in zip(batch, output):
+                    vectors[i] = vector.astype(np.float32)
+        self._record_usage(len(texts), sum(lengths))
+        return vectors
+
+
+PROVIDERS: dict[str, type[Embeddings]] = {"openai": OpenAIEmbeddings, "local": LocalEmbeddings}
+
+
+def get_embeddings(model: Optional[str] = None, provider: str = EMBEDDING_PROVIDER, **kws) -> Embeddings:
+    """
+    Get the shared embedding model of a provider, by default of the EMBEDDING_PROVIDER and EMBEDDING_MODEL environment
+    variables, e.g. get_embeddings("text-embedding-3-small") or get_embeddings(provider="local", quantize=True).
+    EMBEDDING_MODEL only applies to EMBEDDING_PROVIDER, other providers default to their own model.
+    """
+    if provider not in PROVIDERS:
+        raise ValueError(f"Invalid embedding provider: {provider}, expected one of {', '.join(PROVIDERS)}")
+    if model is None and provider == EMBEDDING_PROVIDER:
+        model = EMBEDDING_MODEL
+    key = (provider, model, json.dumps(kws, sort_keys=True, default=str))
+    with _registry_lock:
+        if key not in _embeddings:
+            logger.info(f"Loading {provider} embedding model '{model or PROVIDERS[provider].default_model}'")
+            _embeddings[key] = PROVIDERS[provider](model, **kws)
+        return _embeddings[key]
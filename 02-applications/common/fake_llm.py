@@ -0,0 +1,95 @@
+import hashlib
+import threading
+import time
+from typing import Callable, Iterator, Union
+
+from common.chunking import count_tokens, get_tokenizer
+from common.prompts import prompt_text
+
+
+class FakeLLM:
+    """
+    Deterministic stand-in for the callables returned by `common.llm.get_llm`, for benchmarks.
+
+    Each call sleeps `latency` seconds, plus `seconds_per_prompt_token` for every prompt token that is not served
+    from the prompt cache and `seconds_per_token` for every completion token, and returns `responder(prompt)`.
+    Prompts are plain text or chat messages, which are passed to the responder as text.
+
+    The prompt cache works like the one of the OpenAI API: prompts are hashed in blocks of `cache_block_tokens`
+    tokens, and the leading blocks of a prompt that were seen before are cached once they add up to
+    `min_cached_tokens`. Calls and token usage are counted and the instance is safe to share between threads.
+    """
+
+    def __init__(
+        self,
+        responder: Callable[[str], str],
+        latency: float = 0.5,
+        seconds_per_token: float = 0.0,
+        seconds_per_prompt_token: float = 0.0,
+        min_cached_tokens: int = 1024,
+        cache_block_tokens: int = 128,
+    ):
+        self.responder = responder
+        self.latency = latency
+        self.seconds_per_token = seconds_per_token
+        self.seconds_per_prompt_token = seconds_per_prompt_token
+        self.min_cached_tokens = min_cached_tokens
+        self.cache_block_tokens = cache_block_tokens
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            # same counters as `common.llm.ChatLLM.usage`
+            self.usage = {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "cached_tokens": 0}
+            self._cached_blocks = set()
+
+    def _prompt(self, prompt: Union[str, list[dict]]) -> str:
+        return prompt if isinstance(prompt, str) else prompt_text(prompt)
+
+    def _cached_tokens(self, prompt: str) -> int:
+        offsets = get_tokenizer().token_offsets(prompt)
+        block_hash, cached, hit = hashlib.sha256(), 0, True
+        for start in range(0, len(offsets) - self.cache_block_tokens + 1, self.cache_block_tokens):
+            end = offsets[start + self.cache_block_tokens] if start + self.cache_block_tokens < len(offsets) else None
+            block_hash.update(prompt[offsets[start] : end].encode())
+            key = block_hash.hexdigest()
+            with self._lock:
+                hit = hit and key in self._cached_blocks
+                self._cached_blocks.add(key)
+            if hit:
+                cached += self.cache_block_tokens
+        return cached if cached >= self.min_cached_tokens else 0
+
+    def _sleep_prompt(self, prompt: str) -> tuple[int, int]:
+        prompt_tokens = count_tokens(prompt)
+        cached_tokens = self._cached_tokens(prompt)
+        time.sleep(self.latency + self.seconds_per_prompt_token * (prompt_tokens - cached_tokens))
+        return prompt_tokens, cached_tokens
+
+    def _record(self, prompt_tokens: int, cached_tokens: int, completion_tokens: int):
+        with self._lock:
+            self.usage["calls"] += 1
+            self.usage["prompt_tokens"] += prompt_tokens
+            self.usage["cached_tokens"] += cached_tokens
+            self.usage["completion_tokens"] += completion_tokens
+
+    def stream(self, prompt: Union[str, list[dict]]) -> Iterator[str]:
+        """Same as calling the fake LLM, yielding the response token by token like the streaming API."""
+        prompt = self._prompt(prompt)
+        response = self.responder(prompt)
+        offsets = [0] + get_tokenizer().token_offsets(response)[1:] + [len(response)]
+        prompt_tokens, cached_tokens = self._sleep_prompt(prompt)
+        for start, end in zip(offsets[:-1], offsets[1:]):
+            time.sleep(self.seconds_per_token)
+            yield response[start:end]
+        self._record(prompt_tokens, cached_tokens, len(offsets) - 1)
+
+    def __call__(self, prompt: Union[str, list[dict]]) -> str:
+        prompt = self._prompt(prompt)
+        response = self.responder(prompt)
+        completion_tokens = count_tokens(response)
+        prompt_tokens, cached_tokens = self._sleep_prompt(prompt)
+        time.sleep(self.seconds_per_token * completion_tokens)
+        self._record(prompt_tokens, cached_tokens, completion_tokens)
+        return response
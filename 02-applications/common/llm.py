@@ -1,19 +1,783 @@
+import asyncio
+import functools
+import hashlib
+import json
 import logging
 import os
+import random
+import re
+import sqlite3
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from pathlib import Path
+from typing import Awaitable, Callable, Iterator, Optional, TypeVar, Union
 
 import dotenv
-from openai import OpenAI
-from langchain_community.llms import AzureOpenAI
+import httpx
+from openai import APIConnectionError, APIStatusError, AsyncOpenAI, DefaultAsyncHttpxClient, DefaultHttpxClient, OpenAI
+from pydantic import BaseModel, ValidationError
+
+from common import telemetry
+from common.chunking import count_tokens
 
 dotenv.load_dotenv()
 
 
 logger = logging.getLogger(__name__)
+MAX_CONNECTIONS = int(os.environ.get("LLM_MAX_CONNECTIONS", 100))
+MAX_KEEPALIVE_CONNECTIONS = int(os.environ.get("LLM_MAX_KEEPALIVE_CONNECTIONS", 20))
+# set LLM_CACHE_PATH to an empty string to keep the completion cache in memory only
+CACHE_PATH = os.environ.get("LLM_CACHE_PATH", str(Path.home() / ".cache" / "llm-playground" / "completions.sqlite3"))
+CACHE_TTL = float(os.environ.get("LLM_CACHE_TTL", 30 * 24 * 3600))
+CACHE_MAX_DISK_BYTES = int(os.environ.get("LLM_CACHE_MAX_DISK_BYTES", 256 * 1024**2))
+CACHE_MAX_MEMORY_ENTRIES = int(os.environ.get("LLM_CACHE_MAX_MEMORY_ENTRIES", 1024))
+# client-side rate limits, 0 until learned from the rate limit headers of the responses
+REQUESTS_PER_MINUTE = int(os.environ.get("LLM_REQUESTS_PER_MINUTE", 0))
+TOKENS_PER_MINUTE = int(os.environ.get("LLM_TOKENS_PER_MINUTE", 0))
+MAX_RETRIES = int(os.environ.get("LLM_MAX_RETRIES", 6))
+# seconds a call may take including its retries, 0 for no deadline
+DEADLINE = float(os.environ.get("LLM_DEADLINE", 300))
+# status codes worth retrying: request timeout, conflict, rate limit and server errors
+RETRY_STATUS_CODES = {408, 409, 429}
+_DURATION_RE = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+# models with native JSON schema response formats (structured outputs), others get a forced function call
+JSON_SCHEMA_MODELS = ("gpt-4o", "gpt-4.1", "gpt-5", "o1", "o3", "o4")
+_CODE_FENCE_RE = re.compile(r"^```[a-zA-Z]*\s*|\s*```$")
+T = TypeVar("T")
+M = TypeVar("M", bound=BaseModel)
+
+# process-wide registries, so that all callers share the same pooled HTTP connections
+_registry_lock = threading.RLock()
+_clients: dict[tuple, OpenAI] = {}
+# async clients are bound to the event loop they were created in
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, dict[tuple, AsyncOpenAI]]" = (
+    weakref.WeakKeyDictionary()
+)
+_llms: dict[tuple, object] = {}
+_completion_cache: Optional["CompletionCache"] = None
+_schedulers: dict[tuple, "RateLimitScheduler"] = {}
+
+
+def get_client(
+    api_key: Optional[str] = None,
+    base_url: Optional[str] = None,
+    max_connections: int = MAX_CONNECTIONS,
+    max_keepalive_connections: int = MAX_KEEPALIVE_CONNECTIONS,
+) -> OpenAI:
+    """Get the shared OpenAI client for the given settings, creating it with a pooled transport on first use."""
+    key = (api_key, base_url, max_connections, max_keepalive_connections)
+    limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_keepalive_connections)
+    with _registry_lock:
+        if key not in _clients:
+            logger.info(f"Creating OpenAI client with max {max_connections} connections")
+            _clients[key] = OpenAI(
+                api_key=api_key,
+                base_url=base_url,
+                # retried by the RateLimitScheduler
+                max_retries=0,
+                http_client=DefaultHttpxClient(limits=limits),
+            )
+        return _clients[key]
+
+
+def get_async_client(
+    api_key: Optional[str] = None,
+    base_url: Optional[str] = None,
+    max_connections: int = MAX_CONNECTIONS,
+    max_keepalive_connections: int = MAX_KEEPALIVE_CONNECTIONS,
+) -> AsyncOpenAI:
+    """Same as `get_client`, for the running event loop. Must be called from a coroutine."""
+    loop = asyncio.get_running_loop()
+    key = (api_key, base_url, max_connections, max_keepalive_connections)
+    limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_keepalive_connections)
+    with _registry_lock:
+        clients = _async_clients.setdefault(loop, {})
+        if key not in clients:
+            logger.info(f"Creating AsyncOpenAI client with max {max_connections} connections")
+            clients[key] = AsyncOpenAI(
+                api_key=api_key,
+                base_url=base_url,
+                # retried by the RateLimitScheduler
+                max_retries=0,
+                http_client=DefaultAsyncHttpxClient(limits=limits),
+            )
+        return clients[key]
+
+
+class CompletionCache:
+    """
+    Content-addressed prompt -> completion cache with an in-memory LRU tier and an on-disk SQLite tier.
+
+    Entries expire after `ttl` seconds. The disk tier evicts the least recently used entries once it holds more
+    than `max_disk_bytes` of completions. Set `path` to None to only use the memory tier.
+    """
+
+    def __init__(
+        self,
+        path: Optional[Union[str, Path]] = CACHE_PATH,
+        max_memory_entries: int = CACHE_MAX_MEMORY_ENTRIES,
+        max_disk_bytes: int = CACHE_MAX_DISK_BYTES,
+        ttl: float = CACHE_TTL,
+        evict_every: int = 100,
+    ):
+        self.path = path
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_bytes = max_disk_bytes
+        self.ttl = ttl
+        self.evict_every = evict_every
+        self._lock = threading.Lock()
+        self._memory: OrderedDict[str, tuple[str, float]] = OrderedDict()
+        self._sets_since_eviction = 0
+        self.hits = {"memory": 0, "disk": 0}
+        self.misses = 0
+        self._db = None
+        if path:
+            path = Path(path).expanduser()
+            path.parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(str(path), check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS completions"
+                " (key TEXT PRIMARY KEY, value TEXT, created_at REAL, accessed_at REAL, size INTEGER)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS completions_accessed_at ON completions (accessed_at)")
+
+    @staticmethod
+    def make_key(model: str, messages: list[dict], params: dict) -> str:
+        payload = json.dumps({"model": model, "messages": messages, "params": params}, sort_keys=True)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            if key in self._memory:
+                value, created_at = self._memory[key]
+                if now - created_at < self.ttl:
+                    self._memory.move_to_end(key)
+                    self.hits["memory"] += 1
+                    return value
+                del self._memory[key]
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT value, created_at FROM completions WHERE key = ? AND created_at > ?", (key, now - self.ttl)
+                ).fetchone()
+                if row is not None:
+                    self._db.execute("UPDATE completions SET accessed_at = ? WHERE key = ?", (now, key))
+                    self._set_memory(key, row[0], row[1])
+                    self.hits["disk"] += 1
+                    return row[0]
+            self.misses += 1
+        return None
+
+    def set(self, key: str, value: str):
+        now = time.time()
+        with self._lock:
+            self._set_memory(key, value, now)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO completions VALUES (?, ?, ?, ?, ?)",
+                    (key, value, now, now, len(value.encode())),
+                )
+                self._sets_since_eviction += 1
+                if self._sets_since_eviction >= self.evict_every:
+                    self._evict(now)
+
+    def delete(self, key: str):
+        with self._lock:
+            self._memory.pop(key, None)
+            if self._db is not None:
+                self._db.execute("DELETE FROM completions WHERE key = ?", (key,))
+
+    def stats(self) -> dict:
+        with self._lock:
+            hits = sum(self.hits.values())
+            return {
+                "hits": hits,
+                "memory_hits": self.hits["memory"],
+                "disk_hits": self.hits["disk"],
+                "misses": self.misses,
+                "hit_rate": hits / max(hits + self.misses, 1),
+                "memory_entries": len(self._memory),
+            }
+
+    def _set_memory(self, key: str, value: str, created_at: float):
+        self._memory[key] = (value, created_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    def _evict(self, now: float):
+        # drop expired entries, then the least recently used entries above the size limit
+        self._sets_since_eviction = 0
+        self._db.execute("DELETE FROM completions WHERE created_at <= ?", (now - self.ttl,))
+        self._db.execute(
+            "DELETE FROM completions WHERE key IN (SELECT key FROM"
+            " (SELECT key, SUM(size) OVER (ORDER BY accessed_at DESC) AS total FROM completions) WHERE total > ?)",
+            (self.max_disk_bytes,),
+        )
+
+
+def get_completion_cache() -> CompletionCache:
+    """Get the process-wide completion cache, configured with the LLM_CACHE_* environment variables."""
+    global _completion_cache
+    with _registry_lock:
+        if _completion_cache is None:
+            _completion_cache = CompletionCache()
+        return _completion_cache
+
+
+class DeadlineExceeded(TimeoutError):
+    pass
+
+
+def _parse_duration(value: str) -> float:
+    # durations of the rate limit headers, e.g. "1s", "6m0s" or "20ms"
+    units = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+    return sum(float(amount) * units[unit] for amount, unit in _DURATION_RE.findall(value))
+
+
+class _TokenBucket:
+    """Bucket of `per_minute` units refilling continuously, reservations go into debt that later callers wait out."""
+
+    def __init__(self, per_minute: int = 0):
+        self.per_minute = per_minute
+        self.level = float(per_minute)
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now: float):
+        if self.per_minute:
+            self.level = min(self.per_minute, self.level + (now - self.updated_at) * self.per_minute / 60)
+        self.updated_at = now
+
+    def reserve(self, amount: float, now: float) -> float:
+        """Take `amount` units, returning the seconds to wait until they are available."""
+        if not self.per_minute:
+            return 0.0
+        self._refill(now)
+        self.level -= min(amount, self.per_minute)
+        return max(0.0, -self.level * 60 / self.per_minute)
+
+    def sync(self, limit: Optional[int], remaining: Optional[int], now: float):
+        """Adopt the limit and remaining units reported by the server."""
+        self._refill(now)
+        if limit and limit != self.per_minute:
+            self.level = self.level if self.per_minute else float(limit)
+            self.per_minute = limit
+        if remaining is not None and self.per_minute:
+            self.level = min(self.level, remaining)
+
+
+class RateLimitScheduler:
+    """
+    Client-side rate limiter and retry policy for the calls of one model, shared by all threads and event loops.
+
+    Calls wait for token buckets of requests and tokens per minute, which adopt the limits reported by the
+    x-ratelimit-* response headers. Rate limited calls pause all callers until retry-after, other transient errors
+    are retried with exponential backoff and full jitter, and no call goes past its deadline.
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: int = REQUESTS_PER_MINUTE,
+        tokens_per_minute: int = TOKENS_PER_MINUTE,
+        max_retries: int = MAX_RETRIES,
+        base_delay: float = 1.0,
+        max_delay: float = 60.0,
+    ):
+        self.requests = _TokenBucket(requests_per_minute)
+        self.tokens = _TokenBucket(tokens_per_minute)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._lock = threading.Lock()
+        self._paused_until = 0.0
+        self.stats = {"calls": 0, "retries": 0, "rate_limited": 0, "waited_seconds": 0.0}
+
+    def reserve(self, tokens: int) -> float:
+        """Reserve a request of `tokens` tokens, returning the seconds to wait before sending it."""
+        with self._lock:
+            now = time.monotonic()
+            wait = max(self.requests.reserve(1, now), self.tokens.reserve(tokens, now), self._paused_until - now)
+            self.stats["waited_seconds"] += wait
+            return wait
+
+    def update(self, headers: httpx.Headers):
+        """Sync the buckets with the rate limit headers of a response."""
+
+        def header(name: str) -> Optional[int]:
+            value = headers.get(name)
+            return int(value) if value and value.isdigit() else None
+
+        with self._lock:
+            now = time.monotonic()
+            self.requests.sync(header("x-ratelimit-limit-requests"), header("x-ratelimit-remaining-requests"), now)
+            self.tokens.sync(header("x-ratelimit-limit-tokens"), header("x-ratelimit-remaining-tokens"), now)
+
+    def _retry_delay(self, attempt: int, error: Exception) -> Optional[float]:
+        # seconds until the next attempt, None when the error is not worth retrying
+        if isinstance(error, APIStatusError):
+            self.update(error.response.headers)
+            if error.status_code not in RETRY_STATUS_CODES and error.status_code < 500:
+                return None
+        elif not isinstance(error, APIConnectionError):
+            return None
+        if attempt >= self.max_retries:
+            return None
+
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
+        if isinstance(error, APIStatusError) and error.status_code == 429:
+            headers = error.response.headers
+            retry_after = headers.get("retry-after-ms") or headers.get("retry-after")
+            if retry_after:
+                scale = 0.001 if headers.get("retry-after-ms") else 1
+                delay = float(retry_after) * scale if retry_after.replace(".", "", 1).isdigit() else delay
+            elif headers.get("x-ratelimit-reset-tokens") or headers.get("x-ratelimit-reset-requests"):
+                reset = max(_parse_duration(headers.get(f"x-ratelimit-reset-{n}", "")) for n in ("tokens", "requests"))
+                delay = max(delay, min(self.max_delay, reset))
+            # everyone waits, instead of each caller finding out with its own 429
+            with self._lock:
+                self._paused_until = max(self._paused_until, time.monotonic() + delay)
+                self.stats["rate_limited"] += 1
+        with self._lock:
+            self.stats["retries"] += 1
+        telemetry.current_span().add("retries")
+        telemetry.count("llm.retries", error=type(error).__name__)
+        return delay
+
+    @staticmethod
+    def _check_deadline(deadline_at: Optional[float], wait: float):
+        if deadline_at is not None and time.monotonic() + wait >= deadline_at:
+            raise DeadlineExceeded("LLM call deadline exceeded")
+
+    def _timeout(self, deadline_at: Optional[float]) -> Optional[float]:
+        return deadline_at - time.monotonic() if deadline_at is not None else None
+
+    def run(self, call: Callable[[Optional[float]], T], tokens: int, deadline: Optional[float] = DEADLINE) -> T:
+        """Run `call(timeout)` within the rate limits, retrying transient errors until the deadline."""
+        deadline_at = time.monotonic() + deadline if deadline else None
+        attempt = 0
+        while True:
+            wait = self.reserve(tokens)
+            self._check_deadline(deadline_at, wait)
+            if wait:
+                telemetry.current_span().add("wait_seconds", wait)
+            time.sleep(wait)
+            with self._lock:
+                self.stats["calls"] += 1
+            try:
+                return call(self._timeout(deadline_at))
+            except Exception as e:
+                delay = self._retry_delay(attempt, e)
+                if delay is None:
+                    raise
+                logger.warning(f"Retrying the LLM call in {delay:.1f}s after {type(e).__name__}: {e}")
+                self._check_deadline(deadline_at, delay)
+                time.sleep(delay)
+                attempt += 1
+
+    async def arun(
+        self, call: Callable[[Optional[float]], Awaitable[T]], tokens: int, deadline: Optional[float] = DEADLINE
+    ) -> T:
+        """Same as `run`, for coroutines."""
+        deadline_at = time.monotonic() + deadline if deadline else None
+        attempt = 0
+        while True:
+            wait = self.reserve(tokens)
+            self._check_deadline(deadline_at, wait)
+            if wait:
+                telemetry.current_span().add("wait_seconds", wait)
+            await asyncio.sleep(wait)
+            with self._lock:
+                self.stats["calls"] += 1
+            try:
+                return await call(self._timeout(deadline_at))
+            except Exception as e:
+                delay = self._retry_delay(attempt, e)
+                if delay is None:
+                    raise
+                logger.warning(f"Retrying the LLM call in {delay:.1f}s after {type(e).__name__}: {e}")
+                self._check_deadline(deadline_at, delay)
+                await asyncio.sleep(delay)
+                attempt += 1
+
+
+def get_scheduler(model: str, api_key: Optional[str] = None, base_url: Optional[str] = None) -> RateLimitScheduler:
+    """Get the shared scheduler of a model, rate limits apply per model and API key."""
+    key = (model, api_key, base_url)
+    with _registry_lock:
+        if key not in _schedulers:
+            _schedulers[key] = RateLimitScheduler()
+        return _schedulers[key]
+
+
+def _strict_schema(schema: dict) -> Optional[dict]:
+    # strict schemas need every property to be required and no additional properties, None when that would change
+    # the meaning of the schema (optional fields). Defaults are not supported either.
+    strict = {key: value for key, value in schema.items() if key != "default"}
+    if schema.get("type") == "object":
+        if set(schema.get("properties", {})) != set(schema.get("required", [])):
+            return None
+        strict["additionalProperties"] = False
+    for key in ("properties", "$defs"):
+        if key in schema:
+            strict[key] = {name: _strict_schema(value) for name, value in schema[key].items()}
+            if None in strict[key].values():
+                return None
+    for key in ("anyOf", "allOf"):
+        if key in schema:
+            strict[key] = [_strict_schema(value) for value in schema[key]]
+            if None in strict[key]:
+                return None
+    if "items" in schema:
+        strict["items"] = _strict_schema(schema["items"])
+        if strict["items"] is None:
+            return None
+    return strict
+
+
+@functools.lru_cache(maxsize=None)
+def _response_schema(response_model: type[BaseModel]) -> tuple[str, str]:
+    # serialized, as the params of a request end up in the completion cache key
+    schema = response_model.model_json_schema()
+    strict = _strict_schema(schema)
+    return json.dumps(strict or schema), json.dumps(strict is not None)
+
+
+@functools.lru_cache(maxsize=None)
+def _structured_output_params(response_model: type[BaseModel], method: str) -> str:
+    schema, strict = (json.loads(value) for value in _response_schema(response_model))
+    name = response_model.__name__
+    if method == "json_schema":
+        json_schema = {"name": name, "schema": schema, "strict": strict}
+        params = {"response_format": {"type": "json_schema", "json_schema": json_schema}}
+    elif method == "function_calling":
+        function = {"name": name, "parameters": schema}
+        if response_model.__doc__:
+            function["description"] = response_model.__doc__.strip()
+        params = {
+            "tools": [{"type": "function", "function": function}],
+            "tool_choice": {"type": "function", "function": {"name": name}},
+        }
+    else:
+        raise ValueError(f"Invalid structured output method: {method}")
+    return json.dumps(params)
+
+
+def structured_output_params(response_model: type[BaseModel], method: str = "json_schema") -> dict:
+    """
+    Request params that constrain the completion to the JSON schema of a pydantic model, with a response format
+    ("json_schema") or a forced function call ("function_calling"). The schema is built once per model class.
+    """
+    return json.loads(_structured_output_params(response_model, method))
+
+
+def repair_json(text: str) -> str:
+    """
+    Cheap repair of near-valid JSON: drops code fences and text around the outermost object or array, trailing
+    commas, and closes the strings, objects and arrays of a truncated response.
+    """
+    text = _CODE_FENCE_RE.sub("", text.strip())
+    starts = [i for i in (text.find("{"), text.find("[")) if i >= 0]
+    if not starts:
+        return text
+    repaired, closers, in_string, escaped = [], [], False, False
+    for char in text[min(starts) :]:
+        if in_string:
+            repaired.append(char)
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+            continue
+        if char in "}]":
+            while repaired and repaired[-1] in " \t\r\n,":
+                repaired.pop()
+            repaired.append(closers.pop() if closers else char)
+            if not closers:
+                break
+            continue
+        repaired.append(char)
+        if char == '"':
+            in_string = True
+        elif char == "{":
+            closers.append("}")
+        elif char == "[":
+            closers.append("]")
+    if in_string:
+        repaired.append('"')
+    while closers:
+        while repaired and repaired[-1] in " \t\r\n,":
+            repaired.pop()
+        if repaired and repaired[-1] == ":":
+            repaired.append("null")
+        repaired.append(closers.pop())
+    return "".join(repaired)
+
+
+def parse_structured(response_model: type[M], text: str) -> M:
+    """Validate a JSON response with a pydantic model, falling back to the repaired JSON when it is not valid."""
+    try:
+        return response_model.model_validate_json(text)
+    except ValidationError as e:
+        repaired = repair_json(text)
+        if repaired == text:
+            raise
+        try:
+            result = response_model.model_validate_json(repaired)
+        except ValidationError:
+            raise e from None
+        logger.info(f"Repaired an invalid {response_model.__name__} response")
+        return result
+
+
+def _content_text(content: Union[str, list[dict], None]) -> str:
+    # text of the content of a request message: None for assistant tool calls, or a list of parts, of which only
+    # the text parts are counted
+    if isinstance(content, list):
+        return "".join(part.get("text", "") for part in content if part.get("type") == "text")
+    return content or ""
+
+
+def _message_text(message) -> str:
+    # content of a completion, or the arguments of its function call for structured outputs
+    if message.tool_calls:
+        return message.tool_calls[0].function.arguments
+    return message.content
+
+
+class ChatLLM:
+    """
+    OpenAI chat completion model with fixed sampling params, running on the shared clients.
+
+    Run it with llm("your prompt") or llm.complete(messages), or the async variants
+    await llm.acall("your prompt") and await llm.acomplete(messages).
+    llm.structured("your prompt", SomeModel) returns an instance of the pydantic model SomeModel.
+    """
+
+    def __init__(
+        self,
+        model: str,
+        api_key: Optional[str] = None,
+        base_url: Optional[str] = None,
+        max_connections: int = MAX_CONNECTIONS,
+        messages: Optional[list[dict]] = None,
+        temperature: float = 0.7,
+        max_tokens: int = 256,
+        top_p: float = 1,
+        cache: Optional[bool] = None,
+        deadline: Optional[float] = DEADLINE,
+    ):
+        self.model = model
+        # None: only cache deterministic (temperature 0) completions
+        self.cache = cache
+        # seconds a call may take, including waiting for the rate limits and retries
+        self.deadline = deadline
+        self.scheduler = get_scheduler(model, api_key, base_url)
+        self.client_kws = {"api_key": api_key, "base_url": base_url, "max_connections": max_connections}
+        self.messages = messages
+        self.params = {"temperature": temperature, "max_tokens": max_tokens, "top_p": top_p}
+        # token usage of the completions that were not served from the cache
+        self.usage = {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "cached_tokens": 0}
+        self._usage_lock = threading.Lock()
+
+    def _get_messages(self, prompt: Union[str, list[dict]]) -> list[dict]:
+        # prompts are plain text or chat messages, e.g. of a `common.prompts.PromptTemplate`
+        if not isinstance(prompt, str):
+            return prompt
+        return self.messages or [{"role": "user", "content": prompt}]
+
+    def _get_cache_key(self, messages: list[dict], params: dict) -> Optional[str]:
+        use_cache = self.cache if self.cache is not None else params["temperature"] == 0
+        return CompletionCache.make_key(self.model, messages, params) if use_cache else None
+
+    def _estimate_tokens(self, messages: list[dict], params: dict) -> int:
+        # rate limits count the prompt and the max tokens of the reply
+        tokens = sum(count_tokens(_content_text(m.get("content")), self.model) + 4 for m in messages)
+        return tokens + params.get("max_tokens", 0)
+
+    def _create(self, messages: list[dict], params: dict, deadline: Optional[float] = None):
+        def create(timeout: Optional[float]):
+            kws = {"timeout": timeout} if timeout is not None else {}
+            raw = get_client(**self.client_kws).chat.completions.with_raw_response.create(
+                model=self.model, messages=messages, **params, **kws
+            )
+            self.scheduler.update(raw.headers)
+            return raw.parse()
+
+        tokens = self._estimate_tokens(messages, params)
+        return self.scheduler.run(create, tokens, deadline if deadline is not None else self.deadline)
+
+    async def _acreate(self, messages: list[dict], params: dict, deadline: Optional[float] = None):
+        async def create(timeout: Optional[float]):
+            kws = {"timeout": timeout} if timeout is not None else {}
+            raw = await get_async_client(**self.client_kws).chat.completions.with_raw_response.create(
+                model=self.model, messages=messages, **params, **kws
+            )
+            self.scheduler.update(raw.headers)
+            return raw.parse()
+
+        tokens = self._estimate_tokens(messages, params)
+        return await self.scheduler.arun(create, tokens, deadline if deadline is not None else self.deadline)
+
+    def _record_usage(self, response, span):
+        if response.usage is None:
+            with self._usage_lock:
+                self.usage["calls"] += 1
+            return
+        # prompt tokens served from the prompt cache of the provider
+        details = getattr(response.usage, "prompt_tokens_details", None)
+        cached_tokens = (details.cached_tokens or 0) if details else 0
+        with self._usage_lock:
+            self.usage["calls"] += 1
+            self.usage["prompt_tokens"] += response.usage.prompt_tokens
+            self.usage["completion_tokens"] += response.usage.completion_tokens
+            self.usage["cached_tokens"] += cached_tokens
+        span.set(
+            prompt_tokens=response.usage.prompt_tokens,
+            completion_tokens=response.usage.completion_tokens,
+            cached_tokens=cached_tokens,
+        )
+
+    def complete(self, messages: list[dict], deadline: Optional[float] = None, **params) -> str:
+        params = {**self.params, **params}
+        with telemetry.span("llm.complete", model=self.model) as span:
+            cache_key = self._get_cache_key(messages, params)
+            if cache_key and (content := get_completion_cache().get(cache_key)) is not None:
+                span.set(cache_hit=True)
+                return content
+            response = self._create(messages, params, deadline)
+            self._record_usage(response, span)
+            content = _message_text(response.choices[0].message)
+            if cache_key:
+                get_completion_cache().set(cache_key, content)
+            return content
+
+    async def acomplete(self, messages: list[dict], deadline: Optional[float] = None, **params) -> str:
+        params = {**self.params, **params}
+        with telemetry.span("llm.complete", model=self.model) as span:
+            cache_key = self._get_cache_key(messages, params)
+            if cache_key and (content := get_completion_cache().get(cache_key)) is not None:
+                span.set(cache_hit=True)
+                return content
+            response = await self._acreate(messages, params, deadline)
+            self._record_usage(response, span)
+            content = _message_text(response.choices[0].message)
+            if cache_key:
+                get_completion_cache().set(cache_key, content)
+            return content
+
+    def stream(self, prompt: Union[str, list[dict]], **params) -> Iterator[str]:
+        """Yield the completion of the prompt in pieces, as they are generated by the streaming API."""
+        messages = self._get_messages(prompt)
+        params = {**self.params, **params}
+        span_start = time.perf_counter()
+        with telemetry.span("llm.stream", model=self.model) as span:
+            cache_key = self._get_cache_key(messages, params)
+            if cache_key and (content := get_completion_cache().get(cache_key)) is not None:
+                span.set(cache_hit=True)
+                yield content
+                return
+            pieces = []
+            # only opening the stream is retried, a broken stream raises as its pieces were already yielded
+            response = self._create(messages, {**params, "stream": True})
+            for chunk in response:
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta
+                # the arguments of a forced function call are streamed like the content, see `structured_params`
+                piece = delta.tool_calls[0].function.arguments if delta.tool_calls else delta.content
+                if piece:
+                    if not pieces:
+                        span.set(first_token_ms=round((time.perf_counter() - span_start) * 1000, 3))
+                    pieces.append(piece)
+                    yield piece
+            content = "".join(pieces)
+            # streamed responses come without usage, count the tokens instead
+            prompt_tokens = sum(count_tokens(m["content"], self.model) for m in messages)
+            completion_tokens = count_tokens(content, self.model)
+            with self._usage_lock:
+                self.usage["calls"] += 1
+                self.usage["prompt_tokens"] += prompt_tokens
+                self.usage["completion_tokens"] += completion_tokens
+            span.set(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+            if cache_key:
+                get_completion_cache().set(cache_key, content)
+
+    def invalidate(self, prompt: Union[str, list[dict]], **params):
+        """Drop the cached completion of a prompt, e.g. when the response turned out to be invalid."""
+        self.invalidate_messages(self._get_messages(prompt), **params)
+
+    def invalidate_messages(self, messages: list[dict], **params):
+        cache_key = self._get_cache_key(messages, {**self.params, **params})
+        if cache_key:
+            get_completion_cache().delete(cache_key)
+
+    def structured_params(self, response_model: type[BaseModel]) -> dict:
+        """Params of a completion in the JSON schema of `response_model`, see `structured_output_params`."""
+        method = "json_schema" if self.model.startswith(JSON_SCHEMA_MODELS) else "function_calling"
+        return structured_output_params(response_model, method)
+
+    def structured(
+        self, prompt: Union[str, list[dict]], response_model: type[M], deadline: Optional[float] = None, **params
+    ) -> M:
+        """
+        Complete a prompt (or messages) into an instance of `response_model`. The schema is sent as response format
+        instead of being pasted into the prompt, and near-valid responses are repaired locally. Raises
+        ValidationError when the response is still invalid, after dropping it from the completion cache.
+        """
+        messages = self._get_messages(prompt)
+        params = {**self.structured_params(response_model), **params}
+        content = self.complete(messages, deadline, **params)
+        try:
+            return parse_structured(response_model, content)
+        except ValidationError:
+            self.invalidate_messages(messages, **params)
+            raise
+
+    async def astructured(
+        self, prompt: Union[str, list[dict]], response_model: type[M], deadline: Optional[float] = None, **params
+    ) -> M:
+        messages = self._get_messages(prompt)
+        params = {**self.structured_params(response_model), **params}
+        content = await self.acomplete(messages, deadline, **params)
+        try:
+            return parse_structured(response_model, content)
+        except ValidationError:
+            self.invalidate_messages(messages, **params)
+            raise
+
+    def __call__(self, prompt: Union[str, list[dict]]) -> str:
+        return self.complete(self._get_messages(prompt))
+
+    async def acall(self, prompt: Union[str, list[dict]]) -> str:
+        return await self.acomplete(self._get_messages(prompt))
+
+
+def _registry_key(*a, **kws) -> tuple:
+    return a + (json.dumps(kws, sort_keys=True, default=str),)
+
+
+def get_chat_llm(model: str, **kws) -> ChatLLM:
+    """Get the shared `ChatLLM` for any OpenAI chat model, e.g. get_chat_llm("gpt-4o-mini", temperature=0)."""
+    key = _registry_key("chat", model, **kws)
+    with _registry_lock:
+        if key not in _llms:
+            logger.info(f"Loading LLM '{model}'")
+            _llms[key] = ChatLLM(model, **kws)
+        return _llms[key]
 
 
 def get_llm(model_name: str, *a, **kws):
     if model_name == "gpt-4":
-        llm = get_gpt_4(*a, **kws)
+        key = _registry_key(model_name, *a, **kws)
+        with _registry_lock:
+            if key not in _llms:
+                _llms[key] = get_gpt_4(*a, **kws)
+            llm = _llms[key]
     elif model_name == "gpt-3":
         llm = get_gpt_35_turbo(*a, **kws)
     else:
@@ -23,6 +787,9 @@ def get_llm(model_name: str, *a, **kws):
 
 
 def get_gpt_4(*a, **kws):
+    # imported here as langchain is only needed for the azure deployment of gpt-4
+    from langchain_community.llms import AzureOpenAI
+
     logger.info("Loading LLM 'gpt-4'")
     return AzureOpenAI(
         model_name="gpt-4",
@@ -34,22 +801,13 @@ def get_gpt_4(*a, **kws):
     )
 
 
-def get_gpt_35_turbo(*a, **kws):
+def get_gpt_35_turbo(*a, **kws) -> ChatLLM:
     # Different approach than gpt-4, as for gpt-3 we get an error:
     # "The completion operation does not work with the specified model, gpt-35-turbo."
-    logger.info("Loading LLM 'gpt-3.5-turbo'")
-    client = OpenAI()
-
     # this allows running the returned llm with llm("your prompt")
-    return (
-        lambda prompt: client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            # engine="gpt-35-turbo-us",
-            messages=kws.get("messages", [{"role": "user", "content": prompt}]),
-            temperature=kws.get("temperature", 0.7),
-            max_tokens=kws.get("max_tokens", 256),
-            top_p=kws.get("top_p", 1),
-        )
-        .choices[0]
-        .message.content
+    return get_chat_llm(
+        "gpt-3.5-turbo",
+        # engine="gpt-35-turbo-us",
+        **kws,
     )
+
@@ -0,0 +1,140 @@
+"""
+Token split of the prompt templates of the applications, and the prompt tokens and latency saved by the prompt
+cache when the static instructions come first, against a local fake LLM. Run from 02-applications:
+
+    python -m common.prompt_benchmark --calls 40 --seconds-per-prompt-token 0.0002
+
+Every workload is run twice: with the instructions as prefix of the prompt (system message first, as the templates
+send them) and with the instructions after the fields, where no prefix can be cached. Prompt caches need a minimum
+prefix length and work in blocks of tokens: OpenAI caches from 1024 tokens in blocks of 128 (the defaults), the
+automatic prefix caching of vLLM in blocks of 16 tokens (`--min-cached-tokens 16 --cache-block-tokens 16`).
+"""
+import argparse
+import json
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+APPLICATIONS = Path(__file__).parent.parent
+sys.path.insert(0, APPLICATIONS.as_posix())
+sys.path.insert(0, (APPLICATIONS / "youtube-summarizer-llm").as_posix())
+sys.path.insert(0, (APPLICATIONS / "youtube-digest-bot" / "src").as_posix())
+sys.path.insert(0, (APPLICATIONS / "vedic-astrology-llm").as_posix())
+
+from common.chunking import chunk_text  # noqa: E402
+from common.fake_llm import FakeLLM  # noqa: E402
+from common.prompts import prompt_text  # noqa: E402
+from common.prompts import PromptTemplate  # noqa: E402
+from common.prompts import token_report  # noqa: E402
+
+
+def _templates() -> dict[str, PromptTemplate]:
+    # imported here as the applications pull in their own dependencies
+    import functions
+    import summarizer
+    from src.model import prompts
+
+    return {
+        **{f"summarizer.{name}": template for name, template in functions.PROMPT_TEMPLATES.items()},
+        "digest.video": summarizer.VIDEO_TEMPLATE,
+        "digest.batch": summarizer.BATCH_TEMPLATE,
+        "vedic.question": prompts.QUESTION_TEMPLATE,
+    }
+
+
+def _transcript(num_words: int, seed: int) -> str:
+    words = ["video", "model", "token", "summary", "latency", "the", "a", "of", "and", "chunk", "prompt", "cache"]
+    return " ".join(words[(i * 7 + seed) % len(words)] + str(i % 97) for i in range(num_words))
+
+
+def _workloads(templates: dict[str, PromptTemplate], calls: int) -> dict[str, list[list[dict]]]:
+    """Prompts of each application, as chat messages."""
+    # imported here as the applications pull in their own dependencies
+    from src.retrieval import chunk_knowledge, format_passages, load_knowledge
+
+    map_parts = chunk_text(_transcript(calls * 400, 0), 400)[:calls]
+    # the retrieved passages vary per question, the knowledge passages in turn stand in for them
+    passages = chunk_knowledge(load_knowledge())
+    return {
+        "summarizer.map": [
+            templates["summarizer.map"].format(i + 1, len(map_parts), part) for i, part in enumerate(map_parts)
+        ],
+        "digest.video": [
+            templates["digest.video"].format(title=f"Video {i}", channel="Channel", transcript=_transcript(300, i))
+            for i in range(calls)
+        ],
+        "vedic.question": [
+            templates["vedic.question"].format(
+                question=f"What does Jupiter in house {i % 12 + 1} mean for #{i}?",
+                passages=format_passages(passages[i % len(passages) :][:4]),
+            )
+            for i in range(calls)
+        ],
+    }
+
+
+def _run(llm: FakeLLM, prompts: list[str], max_workers: int) -> float:
+    llm.reset()
+    t0 = time.perf_counter()
+    # the first call warms the cache, like the first request of a run
+    llm(prompts[0])
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        list(executor.map(llm, prompts[1:]))
+    return time.perf_counter() - t0
+
+
+def main(
+    calls: int,
+    latency: float,
+    seconds_per_prompt_token: float,
+    min_cached_tokens: int,
+    cache_block_tokens: int,
+    max_workers: int,
+):
+    templates = _templates()
+    print(token_report(templates))
+    print()
+
+    llm = FakeLLM(
+        lambda prompt: json.dumps({"summary": ["point"]}),
+        latency=latency,
+        seconds_per_prompt_token=seconds_per_prompt_token,
+        min_cached_tokens=min_cached_tokens,
+        cache_block_tokens=cache_block_tokens,
+    )
+    print(
+        f"{calls} calls per workload, fake LLM latency {latency}s + {seconds_per_prompt_token}s per uncached prompt"
+        f" token, prompt cache from {min_cached_tokens} tokens in blocks of {cache_block_tokens}"
+    )
+    print(f"{'workload':<16} {'layout':<20} {'seconds':>8} {'prompt tokens':>14} {'cached tokens':>14}")
+    for name, prompts in _workloads(templates, calls).items():
+        layouts = {
+            "instructions first": [prompt_text(messages) for messages in prompts],
+            "fields first": [prompt_text(messages[::-1]) for messages in prompts],
+        }
+        for layout, texts in layouts.items():
+            seconds = _run(llm, texts, max_workers)
+            usage = llm.usage
+            print(
+                f"{name:<16} {layout:<20} {seconds:>8.2f} {usage['prompt_tokens']:>14} {usage['cached_tokens']:>14}"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--calls", type=int, default=40, help="Prompts per workload")
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds per fake LLM call")
+    parser.add_argument("--seconds-per-prompt-token", type=float, default=0.0002, help="Prefill time per token")
+    parser.add_argument("--min-cached-tokens", type=int, default=1024, help="Shortest prefix the cache reuses")
+    parser.add_argument("--cache-block-tokens", type=int, default=128, help="Granularity of the prompt cache")
+    parser.add_argument("--max-workers", type=int, default=8, help="Concurrent fake LLM calls")
+    args = parser.parse_args()
+    main(
+        args.calls,
+        args.latency,
+        args.seconds_per_prompt_token,
+        args.min_cached_tokens,
+        args.cache_block_tokens,
+        args.max_workers,
+    )
@@ -0,0 +1,68 @@
+import functools
+import hashlib
+import string
+
+from common.chunking import count_tokens
+
+
+class PromptTemplate:
+    """
+    Chat prompt of a static system message followed by a user message template, built once per process.
+
+    The instructions go into the system message, which is the same for every call and comes first: providers cache
+    the longest prompt prefix they have seen before (OpenAI from 1024 tokens on), so only the user message with the
+    fields of the call is processed again. The user message is a str.format template, "{{" / "}}" are literal braces.
+    """
+
+    def __init__(self, system: str, user: str):
+        self.system = system
+        self.user = user
+        # parsed once for the token split, filling the fields is left to str.format which is faster
+        parsed = list(string.Formatter().parse(user))
+        self._static_user = "".join(literal for literal, _, _, _ in parsed)
+        self.fields: list[str] = [field for _, field, _, _ in parsed if field is not None]
+        self.hash = hashlib.sha256(f"{system}\n{user}".encode()).hexdigest()[:16]
+
+    def format_user(self, *args, **kws) -> str:
+        return self.user.format(*args, **kws)
+
+    def format(self, *args, **kws) -> list[dict]:
+        """Chat messages of the prompt."""
+        return [
+            {"role": "system", "content": self.system},
+            {"role": "user", "content": self.format_user(*args, **kws)},
+        ]
+
+    @functools.cached_property
+    def static_text(self) -> str:
+        """Text of the prompt without its fields, e.g. to budget the tokens of the fields."""
+        return prompt_text([{"content": self.system}, {"content": self._static_user}])
+
+    def token_split(self, model: str = "gpt-3.5-turbo") -> dict:
+        """Tokens of the cacheable prefix (system message) and of the static text of the suffix (user message)."""
+        return {
+            "prefix_tokens": count_tokens(self.system, model),
+            "suffix_tokens": count_tokens(self._static_user, model),
+            "fields": len(self.fields),
+        }
+
+    def to_dict(self) -> dict:
+        return {"system": self.system, "user": self.user}
+
+
+def prompt_text(messages: list[dict]) -> str:
+    """Single prompt of chat messages, for LLMs that complete a plain text prompt. Keeps the order of the prefix."""
+    return "\n\n".join(message["content"] for message in messages)
+
+
+def token_report(templates: dict[str, PromptTemplate], model: str = "gpt-3.5-turbo") -> str:
+    """Table of the prefix/suffix token split of prompt templates."""
+    lines = [f"{'template':<28} {'prefix tokens':>14} {'suffix tokens':>14} {'fields':>7} {'cacheable':>10}"]
+    for name, template in templates.items():
+        split = template.token_split(model)
+        cacheable = split["prefix_tokens"] / max(1, split["prefix_tokens"] + split["suffix_tokens"])
+        lines.append(
+            f"{name:<28} {split['prefix_tokens']:>14} {split['suffix_tokens']:>14} {split['fields']:>7}"
+            f" {cacheable:>10.0%}"
+        )
+    return "\n".join(lines)
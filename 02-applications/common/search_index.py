@@ -0,0 +1,262 @@
+"""
+Documents with metadata and vectors in SQLite, for keyword search with BM25 ranking on an FTS5 full-text index and
+for exact vector search over the documents that match a filter, the two halves of a hybrid search.
+
+The text is in an FTS5 table, and the id, metadata and vector of every document in a plain table with an index per
+metadata column, joined by rowid. A keyword search only scores the documents that contain a query word, and the
+metadata filters use the column indexes, so neither scans the whole corpus. Filters are dicts in the format of
+chroma's `where`, e.g. {"channel_id": "UC...", "published": {"$gte": 1700000000}}.
+
+Words like "the" or "how" are in nearly every document, and a query with them would score the whole corpus for
+little gain, as BM25 weighs them close to zero. A table of the number of documents per word lets a search of a large
+index leave out the words of more than `COMMON_WORD_FRACTION` of the documents.
+"""
+import re
+import sqlite3
+import threading
+from collections import Counter
+from pathlib import Path
+from typing import Optional, Sequence, Union
+
+import numpy as np
+
+# SQLite limits the number of variables of a query
+_SQL_BATCH = 500
+_OPERATORS = {"$eq": "=", "$ne": "!=", "$gt": ">", "$gte": ">=", "$lt": "<", "$lte": "<="}
+# words are left out of the queries of an index of at least COMMON_WORD_MIN_DOCUMENTS documents when they are in
+# more than COMMON_WORD_FRACTION of them, the rarest word of the query is always kept
+COMMON_WORD_FRACTION = 0.01
+COMMON_WORD_MIN_DOCUMENTS = 10_000
+# letters and digits, as split by the FTS5 unicode61 tokenizer
+_WORD_RE = re.compile(r"[^\W_]+")
+
+
+def words(text: str) -> list[str]:
+    """The distinct lowercase words of the text, in order."""
+    return list(dict.fromkeys(_WORD_RE.findall(text.lower())))
+
+
+def match_query(query_words: list[str]) -> str:
+    """An FTS5 query that matches documents with any of the words, as the query syntax would reject punctuation."""
+    return " OR ".join(f'"{word}"' for word in query_words)
+
+
+class SearchIndex:
+    """
+    Documents with metadata `columns` and optional vectors, searched by BM25 or by the cosine similarity of their
+    vectors. Set `path` to None to keep the index in memory. Words are matched by their stem (porter stemmer), case
+    and accent insensitive, and counted by their lowercase form.
+    """
+
+    def __init__(self, path: Optional[Union[str, Path]], columns: Sequence[str] = ()):
+        if any(not column.isidentifier() for column in columns):
+            raise ValueError(f"Invalid column names: {columns}")
+        self.path = path
+        self.columns = tuple(columns)
+        self._lock = threading.Lock()
+        if path:
+            path = Path(path).expanduser()
+            path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(str(path) if path else ":memory:", check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS documents "
+            f"(id TEXT UNIQUE NOT NULL, vector BLOB{''.join(f', {column}' for column in self.columns)})"
+        )
+        for column in self.columns:
+            self._db.execute(f"CREATE INDEX IF NOT EXISTS documents_{column} ON documents ({column})")
+        self._db.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS documents_text USING fts5(text, tokenize='porter unicode61')"
+        )
+        self._db.execute("CREATE TABLE IF NOT EXISTS words (word TEXT PRIMARY KEY, documents INTEGER) WITHOUT ROWID")
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._document_count()
+
+    def _document_count(self) -> int:
+        # the empty word, which no text has, counts the documents
+        row = self._db.execute("SELECT documents FROM words WHERE word = ''").fetchone()
+        return row[0] if row else 0
+
+    def _where(self, where: Optional[dict]) -> tuple[str, list]:
+        clauses, params = [], []
+        for column, condition in (where or {}).items():
+            if column not in self.columns:
+                raise ValueError(f"Invalid filter column: {column}, expected one of {', '.join(self.columns)}")
+            conditions = condition if isinstance(condition, dict) else {"$eq": condition}
+            for operator, value in conditions.items():
+                if operator in ("$in", "$nin"):
+                    not_in = "NOT " if operator == "$nin" else ""
+                    clauses.append(f"d.{column} {not_in}IN ({','.join('?' * len(value))})")
+                    params += list(value)
+                elif operator in _OPERATORS:
+                    clauses.append(f"d.{column} {_OPERATORS[operator]} ?")
+                    params.append(value)
+                else:
+                    raise ValueError(f"Invalid filter operator: {operator}")
+        return "".join(f" AND {clause}" for clause in clauses), params
+
+    def _documents(self, rows: list[tuple]) -> list[dict]:
+        # rows of id, text, score and the metadata columns
+        return [
+            {
+                "id": id,
+                "text": text,
+                "score": score,
+                "metadata": {column: value for column, value in zip(self.columns, values) if value is not None},
+            }
+            for id, text, score, *values in rows
+        ]
+
+    def upsert(
+        self,
+        ids: list[str],
+        texts: list[str],
+        metadatas: Optional[list[dict]] = None,
+        vectors: Optional[np.ndarray] = None,
+    ):
+        """Add the documents, replacing the text, metadata and vector of ids that are already in the index."""
+        metadatas = metadatas or [{}] * len(ids)
+        if vectors is not None:
+            vectors = np.asarray(vectors, dtype=np.float32)
+            vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        with self._lock:
+            self._db.execute("BEGIN")
+            try:
+                self._delete_ids(ids)
+                for i, (id, text, metadata) in enumerate(zip(ids, texts, metadatas)):
+                    row = self._db.execute(
+                        f"INSERT INTO documents (id, vector{''.join(f', {column}' for column in self.columns)}) "
+                        f"VALUES (?, ?{', ?' * len(self.columns)})",
+                        [id, vectors[i].tobytes() if vectors is not None else None]
+                        + [metadata.get(column) for column in self.columns],
+                    )
+                    self._db.execute("INSERT INTO documents_text (rowid, text) VALUES (?, ?)", (row.lastrowid, text))
+                self._count_words(texts, 1)
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def _delete_ids(self, ids: list[str]):
+        for i in range(0, len(ids), _SQL_BATCH):
+            batch = ids[i : i + _SQL_BATCH]
+            rowids = [
+                rowid
+                for rowid, in self._db.execute(
+                    f"SELECT rowid FROM documents WHERE id IN ({','.join('?' * len(batch))})", batch
+                )
+            ]
+            if rowids:
+                placeholders = ",".join("?" * len(rowids))
+                texts = self._db.execute(f"SELECT text FROM documents_text WHERE rowid IN ({placeholders})", rowids)
+                self._count_words([text for text, in texts], -1)
+                self._db.execute(f"DELETE FROM documents_text WHERE rowid IN ({placeholders})", rowids)
+                self._db.execute(f"DELETE FROM documents WHERE rowid IN ({placeholders})", rowids)
+
+    def _count_words(self, texts: list[str], sign: int):
+        counts = Counter(word for text in texts for word in words(text))
+        counts[""] = len(texts)
+        self._db.executemany(
+            "INSERT INTO words VALUES (?, ?) "
+            "ON CONFLICT (word) DO UPDATE SET documents = documents + excluded.documents",
+            ((word, sign * count) for word, count in counts.items()),
+        )
+
+    def delete(self, where: dict):
+        """Delete the documents that match the filter."""
+        clause, params = self._where(where)
+        with self._lock:
+            ids = [id for id, in self._db.execute(f"SELECT d.id FROM documents d WHERE 1{clause}", params)]
+            self._db.execute("BEGIN")
+            try:
+                self._delete_ids(ids)
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def get(self, ids: list[str], where: Optional[dict] = None) -> dict[str, dict]:
+        """The documents of the ids that are in the index and match the filter, by id, with their text and metadata."""
+        clause, params = self._where(where)
+        columns = "".join(f", d.{column}" for column in self.columns)
+        documents = {}
+        with self._lock:
+            for i in range(0, len(ids), _SQL_BATCH):
+                batch = ids[i : i + _SQL_BATCH]
+                rows = self._db.execute(
+                    f"SELECT d.id, t.text, NULL{columns} FROM documents d JOIN documents_text t ON t.rowid = d.rowid "
+                    f"WHERE d.id IN ({','.join('?' * len(batch))}){clause}",
+                    batch + params,
+                ).fetchall()
+                documents.update((document["id"], document) for document in self._documents(rows))
+        return documents
+
+    def count(self, where: Optional[dict] = None) -> int:
+        """The number of documents that match the filter."""
+        if not where:
+            return len(self)
+        clause, params = self._where(where)
+        with self._lock:
+            return self._db.execute(f"SELECT COUNT(*) FROM documents d WHERE 1{clause}", params).fetchone()[0]
+
+    def _query_words(self, query: str) -> list[str]:
+        # the words of the query without those of more than COMMON_WORD_FRACTION of the documents of a large index
+        query_words = words(query)
+        if not query_words:
+            return []
+        documents = dict(
+            self._db.execute(
+                f"SELECT word, documents FROM words WHERE word IN ({','.join('?' * (len(query_words) + 1))})",
+                [""] + query_words,
+            )
+        )
+        total = documents.pop("", 0)
+        if total < COMMON_WORD_MIN_DOCUMENTS:
+            return query_words
+        rare = [word for word in query_words if documents.get(word, 0) <= COMMON_WORD_FRACTION * total]
+        return rare or [min(query_words, key=lambda word: documents.get(word, 0))]
+
+    def keyword_search(self, query: str, k: int = 10, where: Optional[dict] = None) -> list[dict]:
+        """
+        The `k` documents that best match the words of the query and the filter, best first, with their text,
+        metadata and BM25 score (higher is better).
+        """
+        clause, params = self._where(where)
+        columns = "".join(f", d.{column}" for column in self.columns)
+        with self._lock:
+            match = match_query(self._query_words(query))
+            if not match:
+                return []
+            rows = self._db.execute(
+                f"SELECT d.id, t.text, -bm25(documents_text){columns} "
+                f"FROM documents_text t JOIN documents d ON d.rowid = t.rowid "
+                f"WHERE documents_text MATCH ?{clause} ORDER BY bm25(documents_text) LIMIT ?",
+                [match] + params + [k],
+            ).fetchall()
+        return self._documents(rows)
+
+    def vector_search(self, vector: np.ndarray, k: int = 10, where: Optional[dict] = None) -> list[dict]:
+        """
+        The `k` documents with a vector that are most similar to `vector` and match the filter, best first, with
+        their text, metadata and cosine similarity. Exact, the vectors of all documents that match are compared, so
+        meant for selective filters, see `count`.
+        """
+        clause, params = self._where(where)
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT d.id, d.vector FROM documents d WHERE d.vector IS NOT NULL{clause}", params
+            ).fetchall()
+        if not rows:
+            return []
+        vectors = np.frombuffer(b"".join(vector for _, vector in rows), dtype=np.float32).reshape(len(rows), -1)
+        scores = vectors @ (np.asarray(vector, dtype=np.float32) / max(np.linalg.norm(vector), 1e-12))
+        top = np.argpartition(-scores, k)[:k] if k < len(scores) else np.arange(len(scores))
+        top = top[np.argsort(-scores[top])]
+        documents = self.get([rows[i][0] for i in top])
+        return [{**documents[rows[i][0]], "score": float(scores[i])} for i in top if rows[i][0] in documents]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
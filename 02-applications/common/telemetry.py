@@ -0,0 +1,340 @@
+"""
+Spans and counters around the stages of the pipelines (transcript fetch, chunking, LLM calls, Chroma reads and
+writes, feed fetches, SMTP), exported as JSON lines and optionally to Prometheus or OpenTelemetry.
+
+    with telemetry.span("chroma.get", ids=len(ids)) as span:
+        result = collection.get(ids=ids)
+        span.set(found=len(result["ids"]))
+
+Telemetry is off unless an exporter is configured, with the TELEMETRY_* environment variables or `configure`, and
+`span` then returns a shared no-op span. Spans opened while another span is open are its children, in the same
+thread or coroutine; wrap functions that run in a thread pool with `propagate` to keep them in the trace.
+Summarize a JSON lines file per stage with:
+
+    python -m common.telemetry telemetry.jsonl
+"""
+import argparse
+import contextvars
+import functools
+import importlib.util
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import defaultdict
+from typing import Callable, Optional, TypeVar
+
+import dotenv
+
+dotenv.load_dotenv()
+
+
+logger = logging.getLogger(__name__)
+# JSON lines file the spans and counters are appended to
+TELEMETRY_PATH = os.environ.get("TELEMETRY_PATH", "")
+# port of a Prometheus scrape endpoint (needs prometheus_client), 0 for none
+PROMETHEUS_PORT = int(os.environ.get("TELEMETRY_PROMETHEUS_PORT", 0))
+# export the spans to the tracer provider of the OpenTelemetry SDK set up by the application (needs opentelemetry-api)
+OTEL = os.environ.get("TELEMETRY_OTEL", "").lower() in ("1", "true", "yes")
+T = TypeVar("T")
+
+# every span and counter record is passed to all exporters, telemetry is off without exporters
+_exporters: list[Callable[[dict], None]] = []
+_exporters_lock = threading.Lock()
+_current_span: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar("telemetry_span", default=None)
+
+
+class Span:
+    """Timed stage of a trace, recorded with its attributes when the `with` block exits."""
+
+    __slots__ = ("name", "attrs", "trace_id", "span_id", "parent_id", "error", "_start", "_t0", "_token")
+
+    def __init__(self, name: str, attrs: dict):
+        parent = _current_span.get()
+        self.name = name
+        self.attrs = attrs
+        self.trace_id = parent.trace_id if parent else uuid.uuid4().hex
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent.span_id if parent else None
+        self.error: Optional[str] = None
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def add(self, name: str, value: float = 1):
+        """Increment a numeric attribute, e.g. the retries of an LLM call."""
+        self.attrs[name] = self.attrs.get(name, 0) + value
+
+    def record_error(self, error: BaseException):
+        """Mark the span as failed for an error that is handled inside the span."""
+        self.error = f"{type(error).__name__}: {error}"
+
+    def __enter__(self) -> "Span":
+        self._token = _current_span.set(self)
+        self._start = time.time()
+        self._t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = time.perf_counter() - self._t0
+        try:
+            _current_span.reset(self._token)
+        except ValueError:
+            # a generator closed in another context than it was started in
+            pass
+        if exc is not None:
+            self.record_error(exc)
+        record = {
+            "type": "span",
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start": self._start,
+            "duration_ms": round(duration * 1000, 3),
+            "status": "error" if self.error else "ok",
+            "attrs": self.attrs,
+        }
+        if self.error:
+            record["error"] = self.error
+        _export(record)
+        return False
+
+
+class _NoopSpan:
+    """Returned by `span` while telemetry is off."""
+
+    __slots__ = ()
+
+    def set(self, **attrs):
+        pass
+
+    def add(self, name: str, value: float = 1):
+        pass
+
+    def record_error(self, error: BaseException):
+        pass
+
+    def __enter__(self) -> "_NoopSpan":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+def enabled() -> bool:
+    return bool(_exporters)
+
+
+def span(name: str, **attrs):
+    """Context manager timing a stage, see the module docstring."""
+    if not _exporters:
+        return _NOOP_SPAN
+    return Span(name, attrs)
+
+
+def current_span():
+    """The innermost open span, or a no-op span."""
+    return (_current_span.get() if _exporters else None) or _NOOP_SPAN
+
+
+def count(name: str, value: float = 1, **labels):
+    """Record a counter increment, e.g. a cache hit."""
+    if not _exporters:
+        return
+    parent = _current_span.get()
+    _export(
+        {
+            "type": "counter",
+            "name": name,
+            "trace_id": parent.trace_id if parent else None,
+            "span_id": parent.span_id if parent else None,
+            "time": time.time(),
+            "value": value,
+            "labels": labels,
+        }
+    )
+
+
+def propagate(fn: Callable[..., T]) -> Callable[..., T]:
+    """Wrap a function to run in another thread (e.g. of a ThreadPoolExecutor) as part of the current span."""
+    parent = _current_span.get() if _exporters else None
+    if parent is None:
+        return fn
+
+    @functools.wraps(fn)
+    def run(*a, **kws):
+        token = _current_span.set(parent)
+        try:
+            return fn(*a, **kws)
+        finally:
+            _current_span.reset(token)
+
+    return run
+
+
+def _export(record: dict):
+    for exporter in _exporters:
+        try:
+            exporter(record)
+        except Exception as e:
+            logger.warning(f"Telemetry exporter {exporter!r} failed: {e}")
+
+
+class JsonLinesExporter:
+    """Appends every record to a JSON lines file, one line per span or counter increment."""
+
+    def __init__(self, path: str):
+        self.path = os.path.expanduser(path)
+        self._lock = threading.Lock()
+        # line buffered, so that the records of a crashed run are not lost
+        self._file = open(self.path, "a", buffering=1)
+
+    def __call__(self, record: dict):
+        line = json.dumps(record, default=str)
+        with self._lock:
+            self._file.write(line + "\n")
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+    def __repr__(self) -> str:
+        return f"JsonLinesExporter({self.path!r})"
+
+
+class PrometheusExporter:
+    """Span durations as the histogram `pipeline_span_seconds` and counters as `pipeline_events_total`."""
+
+    def __init__(self, port: int):
+        import prometheus_client
+
+        self.spans = prometheus_client.Histogram("pipeline_span_seconds", "Duration of the stages", ["name", "status"])
+        self.events = prometheus_client.Counter("pipeline_events", "Counters of the pipeline stages", ["name"])
+        prometheus_client.start_http_server(port)
+
+    def __call__(self, record: dict):
+        if record["type"] == "span":
+            self.spans.labels(record["name"], record["status"]).observe(record["duration_ms"] / 1000)
+        else:
+            self.events.labels(record["name"]).inc(record["value"])
+
+
+class OpenTelemetryExporter:
+    """
+    Spans of the OpenTelemetry tracer provider configured by the application, created when a span ends with its
+    start and end time. The trace and parent ids of this module are kept as the attributes `pipeline.*`.
+    """
+
+    def __init__(self):
+        from opentelemetry import trace
+
+        self._trace = trace
+        self.tracer = trace.get_tracer("llm-playground")
+
+    def __call__(self, record: dict):
+        if record["type"] != "span":
+            return
+        start_ns = int(record["start"] * 1e9)
+        attributes = {
+            key: value if isinstance(value, (bool, int, float, str)) else str(value)
+            for key, value in record["attrs"].items()
+        }
+        attributes["pipeline.trace_id"] = record["trace_id"]
+        attributes["pipeline.span_id"] = record["span_id"]
+        if record["parent_id"]:
+            attributes["pipeline.parent_id"] = record["parent_id"]
+        otel_span = self.tracer.start_span(record["name"], start_time=start_ns, attributes=attributes)
+        if record["status"] == "error":
+            otel_span.set_status(self._trace.Status(self._trace.StatusCode.ERROR, record.get("error")))
+        otel_span.end(end_time=start_ns + int(record["duration_ms"] * 1e6))
+
+
+def add_exporter(exporter: Callable[[dict], None]):
+    """Pass every span and counter record to `exporter` too, which turns telemetry on."""
+    with _exporters_lock:
+        _exporters.append(exporter)
+
+
+def configure(path: Optional[str] = None, prometheus_port: Optional[int] = None, otel: Optional[bool] = None):
+    """
+    Replace the exporters, defaulting to the TELEMETRY_* environment variables read at call time, so that
+    applications can call it again after loading a .env file. Unavailable optional exporters are skipped.
+    """
+    path = os.environ.get("TELEMETRY_PATH", TELEMETRY_PATH) if path is None else path
+    if prometheus_port is None:
+        prometheus_port = int(os.environ.get("TELEMETRY_PROMETHEUS_PORT", PROMETHEUS_PORT))
+    if otel is None:
+        otel = os.environ.get("TELEMETRY_OTEL", str(OTEL)).lower() in ("1", "true", "yes")
+
+    exporters = []
+    if path:
+        exporters.append(JsonLinesExporter(path))
+    if prometheus_port:
+        if importlib.util.find_spec("prometheus_client") is None:
+            logger.warning("TELEMETRY_PROMETHEUS_PORT is set but prometheus_client is not installed")
+        else:
+            exporters.append(_prometheus_exporter(prometheus_port))
+    if otel:
+        if importlib.util.find_spec("opentelemetry") is None:
+            logger.warning("TELEMETRY_OTEL is set but opentelemetry-api is not installed")
+        else:
+            exporters.append(OpenTelemetryExporter())
+
+    with _exporters_lock:
+        for exporter in _exporters:
+            if isinstance(exporter, JsonLinesExporter):
+                exporter.close()
+        _exporters[:] = exporters
+    if exporters:
+        logger.info(f"Telemetry exported to {', '.join(repr(exporter) for exporter in exporters)}")
+
+
+@functools.lru_cache(maxsize=None)
+def _prometheus_exporter(port: int) -> PrometheusExporter:
+    # metrics can only be registered once per process, and the port only be bound once
+    return PrometheusExporter(port)
+
+
+def _percentile(values: list[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def report(path: str) -> str:
+    """Table of the count, errors and p50/p95/max duration of every span name, and the totals of the counters."""
+    durations, errors, counters = defaultdict(list), defaultdict(int), defaultdict(float)
+    with open(os.path.expanduser(path)) as f:
+        for line in f:
+            record = json.loads(line)
+            if record["type"] == "span":
+                durations[record["name"]].append(record["duration_ms"])
+                errors[record["name"]] += record["status"] == "error"
+            else:
+                counters[record["name"]] += record["value"]
+
+    lines = [f"{'span':<28} {'count':>7} {'errors':>7} {'p50 ms':>10} {'p95 ms':>10} {'max ms':>10} {'total s':>9}"]
+    for name, values in sorted(durations.items(), key=lambda item: -sum(item[1])):
+        lines.append(
+            f"{name:<28} {len(values):>7} {errors[name]:>7} {_percentile(values, 0.5):>10.1f}"
+            f" {_percentile(values, 0.95):>10.1f} {max(values):>10.1f} {sum(values) / 1000:>9.2f}"
+        )
+    if counters:
+        lines += ["", f"{'counter':<28} {'total':>10}"]
+        lines += [f"{name:<28} {total:>10g}" for name, total in sorted(counters.items())]
+    return "\n".join(lines)
+
+
+configure()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Summarize a telemetry JSON lines file per stage")
+    parser.add_argument("path", nargs="?", default=TELEMETRY_PATH or "telemetry.jsonl")
+    args = parser.parse_args()
+    print(report(args.path))
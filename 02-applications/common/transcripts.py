@@ -0,0 +1,180 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Sequence
+
+import youtube_transcript_api
+from youtube_transcript_api import NoTranscriptFound
+from youtube_transcript_api import TranscriptList
+from youtube_transcript_api import YouTubeTranscriptApi
+
+from common import telemetry
+from common.singleflight import SingleFlight
+
+
+logger = logging.getLogger(__name__)
+# how long videos without transcripts are remembered, and fetched listings are reused
+NEGATIVE_TTL = float(os.environ.get("TRANSCRIPT_NEGATIVE_TTL", 3600))
+LISTING_TTL = float(os.environ.get("TRANSCRIPT_LISTING_TTL", 600))
+MAX_ENTRIES = int(os.environ.get("TRANSCRIPT_MAX_ENTRIES", 1024))
+# errors that will not go away by retrying soon, other errors (rate limits, network) are never cached,
+# NoTranscriptAvailable only exists before youtube-transcript-api 1.0
+NOT_AVAILABLE_ERRORS = tuple(
+    getattr(youtube_transcript_api, name)
+    for name in ("NoTranscriptAvailable", "NoTranscriptFound", "TranscriptsDisabled", "VideoUnavailable")
+    if hasattr(youtube_transcript_api, name)
+)
+
+_transcript_service: Optional["TranscriptService"] = None
+_transcript_service_lock = threading.Lock()
+
+
+class _TTLCache:
+    """Thread-safe LRU whose entries expire after `ttl` seconds."""
+
+    def __init__(self, ttl: float, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[tuple, tuple[float, object]] = OrderedDict()
+
+    def get(self, key: tuple) -> Optional[object]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if time.monotonic() - entry[0] > self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key: tuple, value: object):
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key: tuple):
+        with self._lock:
+            self._entries.pop(key, None)
+
+
+class TranscriptService:
+    """
+    Shared access to YouTube transcripts, so that concurrent callers do not repeat network calls.
+
+    Concurrent requests for the same video share one in-flight listing and one caption download, listings are
+    reused for `listing_ttl` seconds (e.g. checking availability and then fetching), and videos without
+    transcripts are remembered for `negative_ttl` seconds.
+    """
+
+    def __init__(
+        self, negative_ttl: float = NEGATIVE_TTL, listing_ttl: float = LISTING_TTL, max_entries: int = MAX_ENTRIES
+    ):
+        self._listings = _TTLCache(listing_ttl, max_entries)
+        self._not_available = _TTLCache(negative_ttl, max_entries)
+        self._in_flight = SingleFlight()
+        # youtube-transcript-api >= 1.0 lists with an instance, older versions with a static method
+        self._api = YouTubeTranscriptApi() if hasattr(YouTubeTranscriptApi, "list") else None
+        self._stats_lock = threading.Lock()
+        self.stats = {"listings": 0, "fetches": 0, "listing_hits": 0, "negative_hits": 0}
+
+    def _count(self, name: str):
+        with self._stats_lock:
+            self.stats[name] += 1
+        telemetry.count(f"transcript.{name}")
+
+    def _check_available(self, key: tuple):
+        error = self._not_available.get(key)
+        if error is not None:
+            self._count("negative_hits")
+            raise error.with_traceback(None)
+
+    def list_transcripts(self, video_id: str) -> TranscriptList:
+        self._check_available((video_id,))
+        listing = self._listings.get((video_id,))
+        if listing is not None:
+            self._count("listing_hits")
+            return listing
+
+        def list_and_cache() -> TranscriptList:
+            listing = self._listings.get((video_id,))
+            if listing is not None:
+                return listing
+            self._count("listings")
+            try:
+                with telemetry.span("transcript.list", video_id=video_id):
+                    if self._api is not None:
+                        listing = self._api.list(video_id)
+                    else:
+                        listing = YouTubeTranscriptApi.list_transcripts(video_id)
+            except NOT_AVAILABLE_ERRORS as e:
+                self._not_available.set((video_id,), e)
+                raise
+            self._listings.set((video_id,), listing)
+            return listing
+
+        return self._in_flight.do(("listing", video_id), list_and_cache)
+
+    def is_available(self, video_id: str) -> bool:
+        try:
+            return len(list(self.list_transcripts(video_id))) > 0
+        except Exception:
+            return False
+
+    def fetch(self, video_id: str, languages: Sequence[str] = ("en",), any_language: bool = False) -> list[dict]:
+        """
+        Captions of the first transcript in `languages` (manually created before generated), or of any transcript
+        with `any_language=True`. Raises the errors of youtube-transcript-api.
+        """
+        with telemetry.span("transcript.fetch", video_id=video_id) as span:
+            captions = self._fetch(video_id, languages, any_language)
+            span.set(captions=len(captions))
+            return captions
+
+    def _fetch(self, video_id: str, languages: Sequence[str], any_language: bool) -> list[dict]:
+        key = (video_id, tuple(languages), any_language)
+        self._check_available((video_id,))
+        self._check_available(key)
+
+        def fetch_captions() -> list[dict]:
+            listing = self.list_transcripts(video_id)
+            try:
+                transcript = listing.find_transcript(languages)
+            except NoTranscriptFound as e:
+                transcripts = list(listing)
+                if not any_language or not transcripts:
+                    self._not_available.set(key, e)
+                    raise
+                transcript = transcripts[0]
+            self._count("fetches")
+            with telemetry.span("transcript.download", video_id=video_id, language=transcript.language_code):
+                captions = transcript.fetch()
+            # youtube-transcript-api >= 1.0 returns snippet objects instead of dicts
+            return captions.to_raw_data() if hasattr(captions, "to_raw_data") else captions
+
+        return self._in_flight.do(key, fetch_captions)
+
+    def invalidate(self, video_id: str):
+        self._listings.delete((video_id,))
+        self._not_available.delete((video_id,))
+
+
+def get_transcript_service() -> TranscriptService:
+    """Get the process-wide transcript service."""
+    global _transcript_service
+    with _transcript_service_lock:
+        if _transcript_service is None:
+            _transcript_service = TranscriptService()
+        return _transcript_service
+
+
+def set_transcript_service(service: TranscriptService):
+    """Replace the process-wide transcript service, e.g. with fixture transcripts for benchmarks."""
+    global _transcript_service
+    with _transcript_service_lock:
+        _transcript_service = service
@@ -4,21 +4,28 @@ import sys
 
 sys.path.insert(0, Path(__file__).parent.parent.parent.as_posix())
 
-from common.llm import get_llm, ValidationError
-from src.model.prompts import AstroQuestionResponse
+from common.llm import get_llm, ValidationError  # noqa: E402
+from src.model.prompts import AstroQuestionResponse  # noqa: E402
+from src.model.prompts import QUESTION_TEMPLATE  # noqa: E402
+from src.retrieval import format_passages, get_index  # noqa: E402
 
 logger = logging.getLogger(__name__)
+# passages of the knowledge base per question
+TOP_K = 4
 
 
 if __name__ == "__main__":
     llm = get_llm("gpt-3")
+    index = get_index()
     input_ = input("Question?")
 
-    raw_response = llm(AstroQuestionResponse.get_prompt() + f"\nQuestion: {input_}")
+    # only the passages closest to the question go into the prompt, not the whole documents
+    passages = index.search(input_, k=TOP_K)
+    prompt = QUESTION_TEMPLATE.format(question=input_, passages=format_passages(passages))
 
-    # Note: When you are using pydantic<2.0, use parse_raw instead of model_validate_json
+    # the response is constrained to the schema of the model, and near-valid JSON is repaired
     try:
-        validated_response = AstroQuestionResponse.model_validate_json(raw_response)
+        validated_response = llm.structured(prompt, AstroQuestionResponse)
     except ValidationError as e:
         logger.error("Unable to validate LLM response.")
         # Add your own error handling here
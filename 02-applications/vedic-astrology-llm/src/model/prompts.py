@@ -1,8 +1,9 @@
-import json
 from typing import Literal
 
 from pydantic import BaseModel
 
+from common.prompts import PromptTemplate
+
 
 Difficulty = Literal["easy", "medium", "hard"]
 
@@ -14,13 +15,13 @@ class AstroQuestionResponse(BaseModel):
 
     @classmethod
     def get_prompt(cls) -> str:
-        response_schema_dict = cls.model_json_schema()
-        response_schema_json = json.dumps(response_schema_dict, indent=2)
-        prompt = f"""
-        I will ask you questions, and you will respond.
-        Your response should be in the following format:
-        ```json
-        {response_schema_json}
-        ```
-        """
-        return prompt
+        # the response schema is sent as response format, see ChatLLM.structured
+        return QUESTION_TEMPLATE.system
+
+
+# static instructions first, so that the prompt cache of the provider can reuse them
+QUESTION_TEMPLATE = PromptTemplate(
+    "I will ask you questions about vedic astrology, and you will respond with your thought, the answer and its"
+    " difficulty. Base your answer on the passages of the knowledge base given with the question.",
+    "Passages:\n{passages}\n\nQuestion: {question}",
+)
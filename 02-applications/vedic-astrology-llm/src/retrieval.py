@@ -0,0 +1,134 @@
+"""
+Retrieval over the knowledge corpus (data/knowledge.json) of house, planet and sign descriptions.
+
+The documents are chunked into passages, embedded in batches through the embedding cache of `common.embeddings` and
+stored as a matrix of unit vectors. The index is loaded memory-mapped, so a search is a single matrix-vector product
+and a partial sort for the top k passages.
+"""
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+from common import telemetry
+from common.chunking import chunk_text
+from common.embeddings import Embeddings
+from common.embeddings import get_embeddings
+
+logger = logging.getLogger(__name__)
+DATA_PATH = Path(__file__).parent.parent / "data"
+KNOWLEDGE_PATH = DATA_PATH / "knowledge.json"
+INDEX_PATH = Path(os.environ.get("KNOWLEDGE_INDEX_PATH", DATA_PATH / "index"))
+PASSAGE_TOKENS = 200
+OVERLAP_TOKENS = 20
+
+
+def load_knowledge(path: Path = KNOWLEDGE_PATH) -> dict[str, str]:
+    """The documents of the corpus by title, e.g. "1st house", "Moon" or "Pisces"."""
+    with open(path) as f:
+        return json.load(f)
+
+
+def chunk_knowledge(
+    knowledge: dict[str, str], max_tokens: int = PASSAGE_TOKENS, overlap_tokens: int = OVERLAP_TOKENS
+) -> list[dict]:
+    """Passages of at most `max_tokens` tokens of every document, cut at sentence ends, with their title."""
+    return [
+        {"title": title, "text": passage}
+        for title, text in knowledge.items()
+        for passage in chunk_text(text, max_tokens, overlap_tokens=overlap_tokens)
+    ]
+
+
+def _passage_input(passage: dict) -> str:
+    # the title gives passages like "The significator or karaka of this house is Sun." their subject
+    return f"{passage['title']}\n{passage['text']}"
+
+
+class KnowledgeIndex:
+    """Unit vectors of the passages, searched by cosine similarity."""
+
+    def __init__(self, vectors: np.ndarray, passages: list[dict], embeddings: Embeddings):
+        self.vectors = vectors
+        self.passages = passages
+        self.embeddings = embeddings
+
+    @classmethod
+    def build(cls, passages: list[dict], embeddings: Embeddings) -> "KnowledgeIndex":
+        vectors = embeddings.embed([_passage_input(passage) for passage in passages])
+        vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        return cls(vectors, passages, embeddings)
+
+    def save(self, path: Path, manifest: dict):
+        """Write the vectors and passages, and then the manifest that marks the index as complete."""
+        path.mkdir(parents=True, exist_ok=True)
+        np.save(path / "vectors.npy", self.vectors)
+        with open(path / "passages.json", "w") as f:
+            json.dump(self.passages, f, ensure_ascii=False)
+        with open(path / "manifest.json", "w") as f:
+            json.dump(manifest, f, indent=2)
+
+    @classmethod
+    def load(cls, path: Path, embeddings: Embeddings) -> "KnowledgeIndex":
+        with open(path / "passages.json") as f:
+            passages = json.load(f)
+        return cls(np.load(path / "vectors.npy", mmap_mode="r"), passages, embeddings)
+
+    def search_vector(self, vector: np.ndarray, k: int = 4) -> list[dict]:
+        """The `k` passages most similar to a query vector, best first, with their score."""
+        scores = self.vectors @ (vector / max(np.linalg.norm(vector), 1e-12))
+        if k < len(scores):
+            top = np.argpartition(-scores, k)[:k]
+            top = top[np.argsort(-scores[top])]
+        else:
+            top = np.argsort(-scores)
+        return [{**self.passages[i], "score": float(scores[i])} for i in top]
+
+    def search(self, query: str, k: int = 4) -> list[dict]:
+        """The `k` passages most similar to the query, best first, with their score."""
+        with telemetry.span("retrieval.search", k=k, passages=len(self.passages)):
+            return self.search_vector(self.embeddings.embed_query(query), k)
+
+
+def get_index(
+    knowledge_path: Path = KNOWLEDGE_PATH,
+    path: Path = INDEX_PATH,
+    embeddings: Optional[Embeddings] = None,
+    max_tokens: int = PASSAGE_TOKENS,
+    overlap_tokens: int = OVERLAP_TOKENS,
+) -> KnowledgeIndex:
+    """
+    Load the index of the corpus, or build it when the corpus, the embedding model or the passage size changed.
+    Rebuilding only embeds the passages that are not in the embedding cache yet.
+    """
+    embeddings = embeddings or get_embeddings()
+    with open(knowledge_path, "rb") as f:
+        corpus_hash = hashlib.sha256(f.read()).hexdigest()
+    manifest = {
+        "corpus": corpus_hash,
+        "model": embeddings.cache_model,
+        "max_tokens": max_tokens,
+        "overlap_tokens": overlap_tokens,
+    }
+    try:
+        with open(path / "manifest.json") as f:
+            if json.load(f) == manifest:
+                return KnowledgeIndex.load(path, embeddings)
+    except FileNotFoundError:
+        pass
+    with telemetry.span("retrieval.build", model=embeddings.model) as span:
+        passages = chunk_knowledge(load_knowledge(knowledge_path), max_tokens, overlap_tokens)
+        logger.info(f"Building the knowledge index of {len(passages)} passages")
+        index = KnowledgeIndex.build(passages, embeddings)
+        index.save(path, manifest)
+        span.set(passages=len(passages))
+    return KnowledgeIndex.load(path, embeddings)
+
+
+def format_passages(passages: list[dict]) -> str:
+    """Passages for the prompt, each under its title."""
+    return "\n\n".join(f"[{passage['title']}]\n{passage['text']}" for passage in passages)
@@ -0,0 +1,79 @@
+import json
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from openai import OpenAI
+
+# Statuses after which a batch does not change anymore
+FINAL_STATUSES = {'completed', 'failed', 'expired', 'cancelled'}
+
+
+class BatchJob:
+    """
+    A job of the OpenAI Batch API: requests are written to a JSONL file, uploaded and run
+    asynchronously within 24 hours at half the price of synchronous requests.
+    """
+
+    def __init__(self, client: OpenAI, batch_id: str):
+        self.client = client
+        self.batch_id = batch_id
+
+    @classmethod
+    def submit(cls, client: OpenAI, requests: List[dict], batch_file: Path,
+               metadata: Optional[Dict[str, str]] = None) -> "BatchJob":
+        """
+        Write the requests (with `custom_id`, `method`, `url` and `body`) to `batch_file`,
+        upload it and create the batch.
+        """
+        batch_file.parent.mkdir(exist_ok=True)
+        with open(batch_file, 'w') as f:
+            for request in requests:
+                f.write(json.dumps(request) + "\n")
+        with open(batch_file, 'rb') as f:
+            input_file = client.files.create(file=f, purpose='batch')
+        batch = client.batches.create(
+            input_file_id=input_file.id,
+            endpoint='/v1/chat/completions',
+            completion_window='24h',
+            metadata=metadata
+        )
+        print(f"📤 Submitted batch {batch.id} with {len(requests)} requests")
+        return cls(client, batch.id)
+
+    def status(self) -> str:
+        return self.client.batches.retrieve(self.batch_id).status
+
+    def wait(self, poll_interval: float = 30, timeout: Optional[float] = None) -> str:
+        """
+        Poll the batch until it reaches a final status or `timeout` seconds passed.
+        Returns the last status.
+        """
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        while True:
+            status = self.status()
+            if status in FINAL_STATUSES:
+                return status
+            if deadline is not None and time.monotonic() + poll_interval > deadline:
+                return status
+            time.sleep(poll_interval)
+
+    def results(self) -> Dict[str, str]:
+        """
+        Message content of every successful request, keyed by custom_id.
+        Failed requests are missing from the results.
+        """
+        batch = self.client.batches.retrieve(self.batch_id)
+        if not batch.output_file_id:
+            return {}
+        results = {}
+        for line in self.client.files.content(batch.output_file_id).text.splitlines():
+            if not line.strip():
+                continue
+            result = json.loads(line)
+            response = result.get('response') or {}
+            if result.get('error') or response.get('status_code') != 200:
+                print(f"Batch request {result.get('custom_id')} failed: {result.get('error') or response}")
+                continue
+            results[result['custom_id']] = response['body']['choices'][0]['message']['content']
+        return results
@@ -4,133 +4,209 @@ YouTube Daily Digest Bot
 Fetches new videos, extracts transcripts, summarizes with LLM, and sends email digest.
 """
 
+import argparse
+import json
 import sys
+import time
 from pathlib import Path
 from datetime import datetime
 
 # Add src to path for imports
 sys.path.append(str(Path(__file__).parent))
 
-from utils.config import load_config, get_data_path, get_template_path
-from video_fetcher import VideoFetcher
-from transcript_extractor import TranscriptExtractor
-from summarizer import VideoSummarizer
-from email_sender import EmailSender
+from utils.config import load_config, get_data_path, get_template_path  # noqa: E402
+from video_fetcher import VideoFetcher  # noqa: E402
+from transcript_extractor import TranscriptExtractor  # noqa: E402
+from summarizer import VideoSummarizer  # noqa: E402
+from email_sender import EmailSender  # noqa: E402
+from pipeline import DigestPipeline  # noqa: E402
+from subscribers import load_subscribers, union_channels, assign_videos, assemble_digests, dedupe_stats  # noqa: E402
+from common import telemetry  # noqa: E402
+
+
+def send_digest(email_sender: EmailSender, config: dict, template_path: Path, digests: list):
+    """
+    Send the digest email of each subscriber, which is empty when it has no summaries, over
+    the pooled SMTP sessions.
+    """
+    summaries = [summary for digest in digests for summary in digest['summaries']]
+    if not summaries:
+        print("📧 No new videos found. Sending empty digest...")
+    else:
+        print("📧 Sending email digest...")
+    try:
+        results = email_sender.send_digests(
+            digests,
+            subject_template=config['email']['subject'],
+            html_template_path=template_path
+        )
+    finally:
+        email_sender.close()
+    success = all(results)
+
+    if success and not summaries:
+        print("✅ Empty digest sent successfully")
+    elif success:
+        print(f"✅ Daily digest sent successfully! ({len(digests)} digests, {len(summaries)} videos)")
+    elif not summaries:
+        print("❌ Failed to send empty digest")
+    else:
+        print("❌ Failed to send digest")
+        sys.exit(1)
+
+
+def print_report(pipeline: DigestPipeline, summaries: list, assignments: dict, start_time: float):
+    """Print the video counts, deduplication and stage timings of the run."""
+    stats = dedupe_stats(assignments)
+    telemetry.current_span().set(**stats)
+    if not summaries:
+        return
+    print("\n📊 Summary:")
+    print(f"  • Videos processed: {len(summaries)}")
+    print(f"  • Videos delivered: {stats['deliveries']} to {stats['subscribers']} subscribers "
+          f"(deduplication ratio {stats['dedupe_ratio']:.2f})")
+    print(f"  • Videos with transcripts: {sum(1 for s in summaries if s['has_transcript'])}")
+    print(f"  • Videos without transcripts: {sum(1 for s in summaries if not s['has_transcript'])}")
+    print(f"\n⏱️  Stage timings (total {time.perf_counter() - start_time:.2f}s):")
+    print(pipeline.report())
+
 
 def main():
     """Main function to run the daily digest process."""
+    parser = argparse.ArgumentParser(description="YouTube Daily Digest Bot")
+    parser.add_argument(
+        '--phase', choices=['all', 'submit', 'collect'], default='all',
+        help="With openai.batch_api, 'submit' submits the summaries as a batch job and 'collect' "
+             "waits for it and sends the digest. Without it, 'collect' does nothing."
+    )
+    args = parser.parse_args()
+
     print("🚀 Starting YouTube Daily Digest Bot...")
     print(f"📅 Date: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-    
+    start_time = time.perf_counter()
+
     try:
         # Load configuration
         config = load_config()
         print("✅ Configuration loaded")
-        
+
         # Validate required environment variables
         required_keys = ['youtube', 'openai']
         for key in required_keys:
             if not config['api_keys'].get(key):
                 raise ValueError(f"Missing required API key: {key.upper()}_API_KEY")
-        
+
         if not config['email'].get('user') or not config['email'].get('password'):
             raise ValueError("Missing email credentials: EMAIL_USER and EMAIL_PASS")
-        
-        if not config['email'].get('recipient'):
+
+        subscribers = load_subscribers(config)
+        if not subscribers:
             raise ValueError("Missing recipient email: RECIPIENT_EMAIL")
-        
+
         # Initialize components
         data_path = get_data_path()
         template_path = get_template_path() / "email_template.html"
-        
-        video_fetcher = VideoFetcher(data_path)
+
+        video_fetcher = VideoFetcher(
+            data_path,
+            seen_retention_days=config['limits'].get('seen_retention_days', 180)
+        )
         transcript_extractor = TranscriptExtractor(
-            max_length=config['limits']['max_transcript_length']
+            max_length=config['limits']['max_transcript_length'],
+            max_tokens=config['limits'].get('max_transcript_tokens'),
+            model=config['openai']['model']
         )
         summarizer = VideoSummarizer(
             api_key=config['api_keys']['openai'],
             model=config['openai']['model'],
             max_tokens=config['openai']['max_tokens'],
-            temperature=config['openai']['temperature']
+            temperature=config['openai']['temperature'],
+            batch_tokens=config['openai'].get('batch_tokens'),
+            max_batch_size=config['openai'].get('max_batch_size', 8)
         )
         email_sender = EmailSender(
             smtp_server=config['email']['smtp_server'],
             smtp_port=config['email']['smtp_port'],
             username=config['email']['user'],
-            password=config['email']['password']
+            password=config['email']['password'],
+            starttls=config['email'].get('starttls', True),
+            max_connections=config['email'].get('max_connections', 4)
+        )
+        pipeline = DigestPipeline.from_config(
+            config, video_fetcher, transcript_extractor, summarizer
         )
-        
+
         print("✅ Components initialized")
-        
-        # Fetch new videos
-        print("🔍 Fetching new videos...")
-        channel_ids = config['channels']
-        new_videos = video_fetcher.get_latest_videos(channel_ids)
-        
-        print(f"📹 Found {len(new_videos)} new videos")
-        
-        if not new_videos:
-            print("📧 No new videos found. Sending empty digest...")
-            success = email_sender.send_digest(
-                recipient=config['email']['recipient'],
-                summaries=[],
-                subject_template=config['email']['subject'],
-                html_template_path=template_path
-            )
-            if success:
-                print("✅ Empty digest sent successfully")
-            else:
-                print("❌ Failed to send empty digest")
+
+        # With the batch API, summaries are submitted as a batch job and collected by a later run
+        batch_api = config['openai'].get('batch_api', False)
+        pending_file = data_path / "pending_batch.json"
+        if args.phase == 'collect' and not pending_file.exists():
+            print("📭 No pending batch job to collect")
             return
-        
-        # Limit number of videos if specified
-        max_videos = config['limits']['max_videos_per_day']
-        if len(new_videos) > max_videos:
-            print(f"⚠️  Limiting to {max_videos} videos (found {len(new_videos)})")
-            new_videos = new_videos[:max_videos]
-        
-        # Extract transcripts and summarize
-        print("📝 Extracting transcripts and generating summaries...")
-        videos_with_transcripts = []
-        
-        for i, (video_id, title, link, channel_name) in enumerate(new_videos, 1):
-            print(f"  Processing {i}/{len(new_videos)}: {title[:50]}...")
-            
-            # Extract transcript
-            transcript = transcript_extractor.extract_transcript(video_id)
-            
-            videos_with_transcripts.append((
-                video_id, title, link, channel_name, transcript
-            ))
-        
-        # Generate summaries
-        print("🤖 Generating AI summaries...")
-        summaries = summarizer.summarize_multiple_videos(videos_with_transcripts)
-        
-        # Send email digest
-        print("📧 Sending email digest...")
-        success = email_sender.send_digest(
-            recipient=config['email']['recipient'],
-            summaries=summaries,
-            subject_template=config['email']['subject'],
-            html_template_path=template_path
+
+        if not batch_api or not pending_file.exists():
+            # Fetch new videos, the feed of a channel is fetched once for all its subscribers
+            print("🔍 Fetching new videos...")
+            channel_ids = union_channels(subscribers)
+            videos_by_channel = pipeline.fetch_videos_by_channel(channel_ids)
+            found = len({video[0] for videos in videos_by_channel.values() for video in videos})
+
+            print(f"📹 Found {found} new videos")
+
+            # Limit the number of videos of each digest, only the videos of some digest are processed
+            max_videos = config['limits']['max_videos_per_day']
+            new_videos, assignments = assign_videos(subscribers, videos_by_channel, max_videos)
+            if len(new_videos) < found:
+                print(f"⚠️  Limiting to {max_videos} videos per digest ({len(new_videos)} of {found} videos)")
+
+            if not batch_api:
+                if new_videos:
+                    # Extract transcripts and summarize, each video is summarized as soon as its transcript arrives
+                    print("📝 Extracting transcripts and generating AI summaries...")
+                summaries = pipeline.process_videos(new_videos)
+                send_digest(email_sender, config, template_path, assemble_digests(assignments, summaries))
+                print_report(pipeline, summaries, assignments, start_time)
+                return
+
+            print("📝 Extracting transcripts and submitting the summaries as a batch job...")
+            pending = pipeline.submit_batch_job(new_videos, data_path / "batch_input.jsonl")
+            pending['assignments'] = assignments
+            with open(pending_file, 'w') as f:
+                json.dump(pending, f, indent=2)
+            if args.phase == 'submit':
+                print("✅ Batch job submitted, run with --phase collect to send the digest")
+                return
+        elif args.phase == 'submit':
+            print("⚠️  The previous batch job is still pending, collecting it instead")
+
+        with open(pending_file, 'r') as f:
+            pending = json.load(f)
+        print(f"⏳ Collecting batch job {pending['batch_id']}...")
+        summaries = pipeline.collect_batch_job(
+            pending,
+            poll_interval=config['openai'].get('batch_poll_interval', 60),
+            # in the collect phase only wait so long, a later run collects the job if it is still running
+            timeout=None if args.phase == 'all' else config['openai'].get('batch_collect_timeout', 1800)
         )
-        
-        if success:
-            print(f"✅ Daily digest sent successfully! ({len(summaries)} videos)")
-        else:
-            print("❌ Failed to send digest")
-            sys.exit(1)
-        
-        # Print summary
-        print("\n📊 Summary:")
-        print(f"  • Videos processed: {len(summaries)}")
-        print(f"  • Videos with transcripts: {sum(1 for s in summaries if s['has_transcript'])}")
-        print(f"  • Videos without transcripts: {sum(1 for s in summaries if not s['has_transcript'])}")
-        
+        if summaries is None:
+            print("⏳ Batch job still running, collect it with a later run")
+            return
+
+        # pending files of older runs have no assignments, every subscriber gets all videos
+        assignments = pending.get('assignments') or {
+            subscriber['email']: [video[0] for video in pending['videos']] for subscriber in subscribers
+        }
+        send_digest(email_sender, config, template_path, assemble_digests(assignments, summaries))
+        pending_file.unlink()
+        print_report(pipeline, summaries, assignments, start_time)
+
     except Exception as e:
         print(f"❌ Error: {e}")
         sys.exit(1)
 
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    # one trace per run, the spans of the stages are exported when TELEMETRY_PATH is set
+    with telemetry.span("digest.run"):
+        main()
@@ -1,17 +1,44 @@
-import smtplib
+import functools
+import sys
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from datetime import datetime
-from jinja2 import Template
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader
 from pathlib import Path
-from typing import List, Dict
+from typing import List, Dict, Optional
+
+# Add 02-applications to path for the shared telemetry
+sys.path.append(str(Path(__file__).parent.parent.parent))
+
+from common import telemetry  # noqa: E402
+from smtp_pool import SMTPPool  # noqa: E402
+
+
+@functools.lru_cache(maxsize=None)
+def get_template_environment(template_dir: Path) -> Environment:
+    """
+    Jinja environment of a template directory. Templates are compiled once and recompiled when
+    their file's mtime changes, the bytecode is cached across runs in the temp directory.
+    """
+    return Environment(
+        loader=FileSystemLoader(template_dir),
+        auto_reload=True,
+        bytecode_cache=FileSystemBytecodeCache()
+    )
+
 
 class EmailSender:
-    def __init__(self, smtp_server: str, smtp_port: int, username: str, password: str):
+    def __init__(self, smtp_server: str, smtp_port: int, username: str, password: str,
+                 starttls: bool = True, max_connections: int = 4):
         self.smtp_server = smtp_server
         self.smtp_port = smtp_port
         self.username = username
         self.password = password
+        # Only local test servers go without TLS
+        self.starttls = starttls
+        # SMTP sessions are opened on the first send and reused until close()
+        self.pool = SMTPPool(smtp_server, smtp_port, username, password,
+                             starttls=starttls, max_connections=max_connections)
     
     def send_digest(self, recipient: str, summaries: List[Dict], 
                    subject_template: str, html_template_path: Path) -> bool:
@@ -19,49 +46,81 @@ class EmailSender:
         Send the daily digest email.
         Returns True if successful, False otherwise.
         """
-        try:
-            # Generate subject with current date
-            subject = subject_template.format(date=datetime.now().strftime("%Y-%m-%d"))
-            
-            # Generate HTML content
-            html_content = self._generate_html_content(summaries, html_template_path)
-            
-            # Create email message
-            msg = MIMEMultipart('alternative')
-            msg['Subject'] = subject
-            msg['From'] = self.username
-            msg['To'] = recipient
-            
-            # Create plain text version
-            text_content = self._generate_text_content(summaries)
-            
-            # Attach both versions
-            text_part = MIMEText(text_content, 'plain')
-            html_part = MIMEText(html_content, 'html')
-            
-            msg.attach(text_part)
-            msg.attach(html_part)
-            
-            # Send email
-            with smtplib.SMTP(self.smtp_server, self.smtp_port) as server:
-                server.starttls()
-                server.login(self.username, self.password)
-                server.send_message(msg)
-            
-            print(f"✅ Email sent successfully to {recipient}")
-            return True
-            
-        except Exception as e:
-            print(f"❌ Error sending email: {e}")
-            return False
+        return self.send_digests([{'recipient': recipient, 'summaries': summaries}],
+                                 subject_template, html_template_path)[0]
+    
+    def send_digests(self, digests: List[Dict], subject_template: str, html_template_path: Path,
+                     max_workers: Optional[int] = None) -> List[bool]:
+        """
+        Send a digest to each recipient, given as dicts of 'recipient' and 'summaries', over the
+        pooled SMTP sessions with at most `max_workers` messages in flight.
+        Digests sharing the same summaries list are rendered once.
+        Returns whether each digest was sent.
+        """
+        messages = []
+        # id of a summaries list -> its text and HTML content
+        contents = {}
+        for digest in digests:
+            try:
+                if id(digest['summaries']) not in contents:
+                    contents[id(digest['summaries'])] = (
+                        self._generate_text_content(digest['summaries']),
+                        self._generate_html_content(digest['summaries'], html_template_path)
+                    )
+                messages.append(self._create_message(digest['recipient'], subject_template,
+                                                     *contents[id(digest['summaries'])]))
+            except Exception as e:
+                print(f"❌ Error creating email to {digest['recipient']}: {e}")
+                messages.append(None)
+        
+        with telemetry.span("smtp.send", server=self.smtp_server, messages=len(digests),
+                            videos=sum(len(digest['summaries']) for digest in digests)) as span:
+            errors = self.pool.send_many([msg for msg in messages if msg is not None], max_workers)
+            span.set(failed=sum(1 for error in errors if error is not None))
+        
+        errors = iter(errors)
+        results = []
+        for digest, msg in zip(digests, messages):
+            if msg is None:
+                results.append(False)
+                continue
+            error = next(errors)
+            if error is None:
+                print(f"✅ Email sent successfully to {digest['recipient']}")
+            else:
+                print(f"❌ Error sending email to {digest['recipient']}: {error}")
+            results.append(error is None)
+        return results
+    
+    def close(self):
+        """Close the pooled SMTP sessions."""
+        self.pool.close()
+    
+    def _create_message(self, recipient: str, subject_template: str,
+                        text_content: str, html_content: str) -> MIMEMultipart:
+        """Create the email message of a digest, with a plain text and an HTML version."""
+        # Generate subject with current date
+        subject = subject_template.format(date=datetime.now().strftime("%Y-%m-%d"))
+        
+        # Create email message
+        msg = MIMEMultipart('alternative')
+        msg['Subject'] = subject
+        msg['From'] = self.username
+        msg['To'] = recipient
+        
+        # Attach both versions
+        text_part = MIMEText(text_content, 'plain')
+        html_part = MIMEText(html_content, 'html')
+        
+        msg.attach(text_part)
+        msg.attach(html_part)
+        return msg
     
     def _generate_html_content(self, summaries: List[Dict], template_path: Path) -> str:
         """Generate HTML content from template."""
         try:
-            with open(template_path, 'r') as f:
-                template_content = f.read()
-            
-            template = Template(template_content)
+            environment = get_template_environment(Path(template_path).parent)
+            template = environment.get_template(Path(template_path).name)
             
             return template.render(
                 summaries=summaries,
@@ -0,0 +1,49 @@
+import json
+import threading
+from pathlib import Path
+from typing import Dict
+
+
+class FeedState:
+    """
+    Per-channel fetch state of the RSS feeds: the ETag and Last-Modified validators of the
+    last response, for conditional requests, and the newest video seen in the feed.
+    Saved as JSON sorted by channel, so the daily workflow commit only shows changed channels.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._changed = False
+        self._channels: Dict[str, dict] = {}
+        if self.path.exists():
+            with open(self.path, 'r') as f:
+                self._channels = json.load(f)
+
+    def get(self, channel_id: str) -> dict:
+        with self._lock:
+            return dict(self._channels.get(channel_id, {}))
+
+    def update(self, channel_id: str, **fields):
+        """Update the state of a channel, fields set to None are removed."""
+        with self._lock:
+            state = dict(self._channels.get(channel_id, {}))
+            for key, value in fields.items():
+                if value is None:
+                    state.pop(key, None)
+                else:
+                    state[key] = value
+            if state != self._channels.get(channel_id):
+                self._channels[channel_id] = state
+                self._changed = True
+
+    def save(self):
+        """Write the state file, only when a channel changed."""
+        with self._lock:
+            if not self._changed:
+                return
+            self.path.parent.mkdir(exist_ok=True)
+            with open(self.path, 'w') as f:
+                json.dump(self._channels, f, indent=2, sort_keys=True)
+                f.write("\n")
+            self._changed = False
@@ -0,0 +1,155 @@
+import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+# Add 02-applications to path for the shared telemetry
+sys.path.append(str(Path(__file__).parent.parent.parent))
+
+from common import telemetry  # noqa: E402
+from summarizer import VideoSummarizer  # noqa: E402
+from transcript_extractor import TranscriptExtractor  # noqa: E402
+from utils.concurrency import RateLimiter, StageStats  # noqa: E402
+from video_fetcher import VideoFetcher  # noqa: E402
+
+
+class DigestPipeline:
+    """
+    Staged, bounded-concurrency pipeline: fetch feeds -> extract transcripts -> summarize.
+    Every stage has its own thread pool and rate limit, and a video is handed to the
+    summarization stage as soon as its transcript arrives.
+    """
+
+    def __init__(self, video_fetcher: VideoFetcher, transcript_extractor: TranscriptExtractor,
+                 summarizer: VideoSummarizer, feed_workers: int = 8, transcript_workers: int = 4,
+                 summary_workers: int = 4, feeds_per_second: Optional[float] = None,
+                 transcripts_per_second: Optional[float] = None,
+                 summaries_per_second: Optional[float] = None):
+        self.video_fetcher = video_fetcher
+        self.transcript_extractor = transcript_extractor
+        self.summarizer = summarizer
+        self.feed_workers = feed_workers
+        self.transcript_workers = transcript_workers
+        self.summary_workers = summary_workers
+        self.rate_limiters = {
+            'feeds': RateLimiter(feeds_per_second),
+            'transcripts': RateLimiter(transcripts_per_second),
+            'summaries': RateLimiter(summaries_per_second),
+        }
+        self.stats = {name: StageStats(name) for name in self.rate_limiters}
+
+    @classmethod
+    def from_config(cls, config: dict, video_fetcher: VideoFetcher,
+                    transcript_extractor: TranscriptExtractor,
+                    summarizer: VideoSummarizer) -> "DigestPipeline":
+        """Create the pipeline with the settings of the `pipeline` section in config.yml."""
+        return cls(video_fetcher, transcript_extractor, summarizer, **config.get('pipeline', {}))
+
+    def fetch_videos_by_channel(self, channel_ids: List[str]) -> Dict[str, List[tuple]]:
+        """Fetch the new videos of each channel, with the feeds fetched in parallel."""
+        with telemetry.span("digest.feeds", channels=len(channel_ids)) as span:
+            videos_by_channel = self.video_fetcher.get_latest_videos_by_channel(
+                channel_ids,
+                max_workers=self.feed_workers,
+                rate_limiter=self.rate_limiters['feeds'],
+                stats=self.stats['feeds']
+            )
+            span.set(videos=len({video[0] for videos in videos_by_channel.values() for video in videos}))
+            return videos_by_channel
+
+    def process_videos(self, videos: List[Tuple[str, str, str, str]]) -> List[Dict]:
+        """
+        Extract transcripts and summarize videos concurrently.
+        videos should be a list of tuples: (video_id, title, link, channel_name)
+        Returns list of dictionaries with video info and summaries, in the order of `videos`.
+        When the summarizer batches, videos wait for their transcripts to fill a batch, and the
+        last, partial batch is sent once all transcripts are in.
+        """
+        with ThreadPoolExecutor(max_workers=self.transcript_workers) as transcript_pool, \
+                ThreadPoolExecutor(max_workers=self.summary_workers) as summary_pool:
+            transcript_futures = {
+                transcript_pool.submit(telemetry.propagate(self._extract_transcript), video[0]): i
+                for i, video in enumerate(videos)
+            }
+            # index of every video -> (future of the summaries of its batch, position in the batch)
+            summary_futures = {}
+            pending = []
+
+            def submit_batch(items: List[Tuple[int, tuple]]):
+                future = summary_pool.submit(
+                    telemetry.propagate(self._summarize_batch), [video_data for _, video_data in items]
+                )
+                for position, (i, _) in enumerate(items):
+                    summary_futures[i] = (future, position)
+
+            for future in as_completed(transcript_futures):
+                i = transcript_futures[future]
+                video_data = (*videos[i], future.result())
+                if not self.summarizer.batch_tokens or not video_data[4]:
+                    submit_batch([(i, video_data)])
+                    continue
+                pending.append((i, video_data))
+                batches = self.summarizer.pack_batches([video_data for _, video_data in pending])
+                # all batches but the last one are full
+                for batch in batches[:-1]:
+                    submit_batch(pending[:len(batch)])
+                    pending = pending[len(batch):]
+            for batch in self.summarizer.pack_batches([video_data for _, video_data in pending]):
+                submit_batch(pending[:len(batch)])
+                pending = pending[len(batch):]
+            return [summary_futures[i][0].result()[summary_futures[i][1]] for i in range(len(videos))]
+
+    def extract_transcripts(self, videos: List[Tuple[str, str, str, str]]) -> List[tuple]:
+        """
+        Extract the transcripts of the videos concurrently.
+        Returns list of tuples: (video_id, title, link, channel_name, transcript)
+        """
+        with ThreadPoolExecutor(max_workers=self.transcript_workers) as transcript_pool:
+            transcripts = transcript_pool.map(
+                telemetry.propagate(self._extract_transcript), [video[0] for video in videos]
+            )
+            return [(*video, transcript) for video, transcript in zip(videos, transcripts)]
+
+    def submit_batch_job(self, videos: List[Tuple[str, str, str, str]], batch_file: Path) -> dict:
+        """
+        First phase of a batch run: extract the transcripts and submit the summaries as a batch job.
+        Returns the pending job, to be saved until `collect_batch_job`. It holds the video id, title,
+        link and channel of the videos but not their transcripts, as the pending file is committed.
+        """
+        videos_data = self.extract_transcripts(videos)
+        batch_id = self.summarizer.submit_batch_job(videos_data, batch_file)
+        return {'batch_id': batch_id, 'videos': [list(video) for video in videos]}
+
+    def collect_batch_job(self, pending: dict, poll_interval: float = 30,
+                          timeout: Optional[float] = None) -> Optional[List[Dict]]:
+        """
+        Second phase of a batch run: wait for the batch job and return the summaries,
+        or None while the job is still running. The transcripts are extracted again, for the
+        videos whose request failed and for the transcript flag of every video.
+        """
+        summaries = {}
+        if pending['batch_id']:
+            summaries = self.summarizer.collect_batch_job(pending['batch_id'], poll_interval, timeout)
+            if summaries is None:
+                return None
+        # pending files of older runs also hold the transcripts, as a fifth field
+        videos_data = self.extract_transcripts([tuple(video[:4]) for video in pending['videos']])
+        with self.stats['summaries'].track():
+            return self.summarizer.summarize_batch_job_results(videos_data, summaries)
+
+    def _extract_transcript(self, video_id: str) -> Optional[str]:
+        self.rate_limiters['transcripts'].wait()
+        with self.stats['transcripts'].track(), telemetry.span("digest.transcript", video_id=video_id) as span:
+            transcript = self.transcript_extractor.extract_transcript(video_id)
+            span.set(found=transcript is not None)
+            return transcript
+
+    def _summarize_batch(self, videos_data: list) -> List[Dict]:
+        self.rate_limiters['summaries'].wait()
+        with self.stats['summaries'].track(), telemetry.span("digest.summarize", videos=len(videos_data)):
+            return self.summarizer.summarize_batch(videos_data)
+
+    def report(self) -> str:
+        """Per-stage timings of the run."""
+        lines = [f"  • {stats.report()}" for stats in self.stats.values()]
+        return "\n".join(lines + [f"  • requests: {self.summarizer.report()}"])
@@ -0,0 +1,143 @@
+from datetime import date, datetime, timedelta, timezone
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Videos stay listed in a channel's RSS feed until 15 newer ones are published
+FEED_SIZE = 15
+
+
+class SeenStore:
+    """
+    Append-only store of the video IDs that were already processed.
+
+    Every line holds `<video_id> <channel_id> <first seen date>`. New videos are appended at the
+    end of the file, so a run only writes (and the daily workflow only commits) the new lines.
+    Videos older than `retention_days` are dropped by a compaction that rewrites the file sorted by
+    date; it only runs once the oldest entry is `compact_slack_days` past the retention, so the
+    file is rewritten about once a month instead of on every run. The newest `FEED_SIZE` videos of
+    every channel are always kept, as they can still show up in its feed.
+    """
+
+    def __init__(self, path: Path, retention_days: int = 180, compact_slack_days: int = 30):
+        self.path = path
+        self.retention_days = retention_days
+        self.compact_slack_days = compact_slack_days
+        # Dates are kept as ISO strings, which compare like dates and load without parsing
+        self._seen: Dict[str, Tuple[str, str]] = {}
+        # Video IDs of every channel, oldest first
+        self._by_channel: Dict[str, List[str]] = {}
+        self._pending: List[str] = []
+        self._needs_rewrite = False
+        self._load()
+
+    def _load(self):
+        if not self.path.exists():
+            return
+        today = self._today()
+        index = self._index
+        with open(self.path, 'r') as f:
+            for line in f:
+                parts = line.split()
+                if not parts:
+                    continue
+                if len(parts) == 3:
+                    channel_id = "" if parts[1] == "-" else parts[1]
+                    index(parts[0], channel_id, parts[2])
+                else:
+                    # Plain video ID of the old format, migrated by rewriting the file on the next save
+                    index(parts[0], "", today)
+                    self._needs_rewrite = True
+
+    def _index(self, video_id: str, channel_id: str, seen_on: str):
+        if video_id in self._seen:
+            return
+        self._seen[video_id] = (channel_id, seen_on)
+        self._by_channel.setdefault(channel_id, []).append(video_id)
+
+    @staticmethod
+    def _today() -> str:
+        return datetime.now(timezone.utc).date().isoformat()
+
+    def _days_ago(self, days: int) -> str:
+        return (date.fromisoformat(self._today()) - timedelta(days=days)).isoformat()
+
+    def __contains__(self, video_id: str) -> bool:
+        return video_id in self._seen
+
+    def __len__(self) -> int:
+        return len(self._seen)
+
+    def add(self, video_id: str, channel_id: str = ""):
+        """Mark a video as seen, written on the next `save`."""
+        if video_id in self._seen:
+            return
+        today = self._today()
+        self._index(video_id, channel_id, today)
+        self._pending.append(self._format(video_id, channel_id, today))
+
+    def update(self, video_ids: Iterable[str], channel_id: str = ""):
+        for video_id in video_ids:
+            self.add(video_id, channel_id)
+
+    def channel_videos(self, channel_id: str) -> List[str]:
+        """Seen video IDs of a channel, oldest first."""
+        return list(self._by_channel.get(channel_id, []))
+
+    def latest(self, channel_id: str) -> Optional[str]:
+        """The most recently seen video of a channel."""
+        videos = self._by_channel.get(channel_id)
+        return videos[-1] if videos else None
+
+    @staticmethod
+    def _format(video_id: str, channel_id: str, seen_on: str) -> str:
+        return f"{video_id} {channel_id or '-'} {seen_on}\n"
+
+    def _latest_per_channel(self) -> set:
+        latest = set()
+        for videos in self._by_channel.values():
+            latest.update(videos[-FEED_SIZE:])
+        return latest
+
+    def _is_compaction_due(self) -> bool:
+        cutoff = self._days_ago(self.retention_days + self.compact_slack_days)
+        if not any(seen_on < cutoff for _, seen_on in self._seen.values()):
+            return False
+        latest = self._latest_per_channel()
+        return any(seen_on < cutoff and video_id not in latest for video_id, (_, seen_on) in self._seen.items())
+
+    def save(self):
+        """Append the new videos to the file, or compact it when old entries are due for removal."""
+        self.path.parent.mkdir(exist_ok=True)
+        if self._needs_rewrite or self._is_compaction_due():
+            self.compact()
+            return
+        if self._pending:
+            with open(self.path, 'a') as f:
+                f.writelines(self._pending)
+        self._pending = []
+
+    def compact(self):
+        """Drop the videos older than `retention_days` and rewrite the file sorted by date."""
+        cutoff = self._days_ago(self.retention_days)
+        latest = self._latest_per_channel()
+        # Stable sort, videos seen on the same day keep their order
+        entries = sorted(
+            (
+                (seen_on, channel_id, video_id)
+                for video_id, (channel_id, seen_on) in self._seen.items()
+                if seen_on >= cutoff or video_id in latest
+            ),
+            key=lambda entry: entry[0],
+        )
+        removed = len(self._seen) - len(entries)
+
+        self._seen, self._by_channel = {}, {}
+        for seen_on, channel_id, video_id in entries:
+            self._index(video_id, channel_id, seen_on)
+        tmp_path = self.path.with_suffix(".tmp")
+        with open(tmp_path, 'w') as f:
+            f.writelines(self._format(video_id, channel_id, seen_on) for seen_on, channel_id, video_id in entries)
+        tmp_path.replace(self.path)
+        self._pending = []
+        self._needs_rewrite = False
+        print(f"🗜️  Compacted seen videos: kept {len(entries)}, removed {removed}")
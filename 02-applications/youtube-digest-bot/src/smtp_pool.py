@@ -0,0 +1,111 @@
+import smtplib
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from email.message import Message
+from pathlib import Path
+from typing import List, Optional
+
+# Add 02-applications to path for the shared telemetry
+sys.path.append(str(Path(__file__).parent.parent.parent))
+
+from common import telemetry  # noqa: E402
+
+
+class SMTPPool:
+    """
+    Long-lived SMTP sessions, logged in once and reused for every message, with at most
+    `max_connections` open at a time. Thread-safe, so that bulk sends go out in parallel.
+    """
+
+    def __init__(self, smtp_server: str, smtp_port: int, username: str, password: str,
+                 starttls: bool = True, max_connections: int = 4, timeout: float = 30):
+        self.smtp_server = smtp_server
+        self.smtp_port = smtp_port
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max_connections)
+        self._lock = threading.Lock()
+        self._idle: List[smtplib.SMTP] = []
+
+    def _connect(self) -> smtplib.SMTP:
+        with telemetry.span("smtp.connect", server=self.smtp_server):
+            server = smtplib.SMTP(self.smtp_server, self.smtp_port, timeout=self.timeout)
+            try:
+                if self.starttls:
+                    server.starttls()
+                server.login(self.username, self.password)
+            except Exception:
+                server.close()
+                raise
+        telemetry.count("smtp.connections")
+        return server
+
+    def _checkout(self) -> smtplib.SMTP:
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        return self._connect()
+
+    def _checkin(self, server: smtplib.SMTP):
+        with self._lock:
+            self._idle.append(server)
+
+    @staticmethod
+    def _discard(server: smtplib.SMTP):
+        try:
+            server.quit()
+        except Exception:
+            server.close()
+
+    def send(self, msg: Message):
+        """Send a message over an idle session, or a new one while fewer than max_connections are open."""
+        with self._slots:
+            server = self._checkout()
+            try:
+                try:
+                    server.send_message(msg)
+                except (smtplib.SMTPServerDisconnected, ConnectionError):
+                    # the server closed the idle session, retried once on a new one
+                    server.close()
+                    server = None
+                    server = self._connect()
+                    server.send_message(msg)
+            except (smtplib.SMTPResponseException, smtplib.SMTPRecipientsRefused):
+                # the server refused the message, the session itself is still usable
+                if server is not None:
+                    self._checkin(server)
+                raise
+            except Exception:
+                if server is not None:
+                    server.close()
+                raise
+            self._checkin(server)
+
+    def send_many(self, messages: List[Message], max_workers: Optional[int] = None) -> List[Optional[Exception]]:
+        """
+        Send the messages over at most `max_workers` (by default max_connections) sessions in parallel.
+        Returns the error of each message, None for the ones sent.
+        """
+        def send(msg: Message) -> Optional[Exception]:
+            try:
+                self.send(msg)
+                return None
+            except Exception as e:
+                return e
+
+        workers = min(max_workers or self.max_connections, self.max_connections, len(messages))
+        if workers <= 1:
+            return [send(msg) for msg in messages]
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(telemetry.propagate(send), messages))
+
+    def close(self):
+        """Log out of the idle sessions."""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for server in idle:
+            self._discard(server)
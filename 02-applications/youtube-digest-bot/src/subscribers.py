@@ -0,0 +1,68 @@
+from typing import Dict, List, Tuple
+
+
+def load_subscribers(config: dict) -> List[Dict]:
+    """
+    Subscribers of the digest, as dicts of 'email' and 'channels'. Taken from the `subscribers`
+    section in config.yml, or else every recipient of RECIPIENT_EMAIL (comma-separated) gets
+    the global `channels` list.
+    """
+    if config.get('subscribers'):
+        return [{'email': subscriber['email'], 'channels': list(subscriber['channels'])}
+                for subscriber in config['subscribers']]
+    recipients = [r.strip() for r in (config['email'].get('recipient') or '').split(',') if r.strip()]
+    return [{'email': recipient, 'channels': list(config['channels'])} for recipient in recipients]
+
+
+def union_channels(subscribers: List[Dict]) -> List[str]:
+    """The channels of all subscribers, each once, in the order they are first listed."""
+    return list(dict.fromkeys(channel_id for subscriber in subscribers for channel_id in subscriber['channels']))
+
+
+def assign_videos(subscribers: List[Dict], videos_by_channel: Dict[str, List[tuple]],
+                  max_videos: int) -> Tuple[List[tuple], Dict[str, List[str]]]:
+    """
+    Pick the videos of each subscriber's digest from the new videos of the channels, at most
+    `max_videos` per digest.
+    Returns the unique videos of all digests, to be processed once, and the video IDs per subscriber.
+    """
+    unique_videos = {}
+    assignments = {}
+    for subscriber in subscribers:
+        videos = {}
+        for channel_id in subscriber['channels']:
+            for video in videos_by_channel.get(channel_id, []):
+                videos.setdefault(video[0], video)
+        selected = list(videos.values())[:max_videos]
+        for video in selected:
+            unique_videos.setdefault(video[0], video)
+        assignments[subscriber['email']] = [video[0] for video in selected]
+    return list(unique_videos.values()), assignments
+
+
+def assemble_digests(assignments: Dict[str, List[str]], summaries: List[Dict]) -> List[Dict]:
+    """
+    The digest of each subscriber, as dicts of 'recipient' and 'summaries', from the shared summaries.
+    Subscribers with the same videos share one summaries list, so that their email is rendered once.
+    """
+    summaries_by_id = {summary['video_id']: summary for summary in summaries}
+    shared = {}
+    digests = []
+    for email, video_ids in assignments.items():
+        key = tuple(video_ids)
+        if key not in shared:
+            shared[key] = [summaries_by_id[video_id] for video_id in video_ids if video_id in summaries_by_id]
+        digests.append({'recipient': email, 'summaries': shared[key]})
+    return digests
+
+
+def dedupe_stats(assignments: Dict[str, List[str]]) -> Dict:
+    """Videos delivered across all digests against the unique videos processed for them."""
+    deliveries = sum(len(video_ids) for video_ids in assignments.values())
+    unique = len({video_id for video_ids in assignments.values() for video_id in video_ids})
+    return {
+        'subscribers': len(assignments),
+        'deliveries': deliveries,
+        'unique_videos': unique,
+        'dedupe_ratio': deliveries / unique if unique else 1.0
+    }
@@ -1,79 +1,276 @@
-from openai import OpenAI
-from typing import Optional
+import json
+import sys
+import threading
+from pathlib import Path
+from typing import List, Optional
+
+from openai import OpenAIError
+from pydantic import BaseModel, ValidationError
+
+# Add 02-applications to path for the shared LLM clients
+sys.path.append(str(Path(__file__).parent.parent.parent))
+
+from batch_job import BatchJob  # noqa: E402
+from common.chunking import count_tokens  # noqa: E402
+from common.llm import get_chat_llm, get_client, repair_json  # noqa: E402
+from common.prompts import PromptTemplate  # noqa: E402
+
+SYSTEM_PROMPT = ("You are a helpful assistant that creates concise, informative summaries of YouTube videos. "
+                 "Focus on the main points and key takeaways.")
+# The instructions are part of the system message, which is the same for every request (single
+# and batched), so the prompt cache of the API can reuse it and only the videos are new tokens
+INSTRUCTIONS = "Summarize every YouTube video in 2-3 sentences, focusing on the main points and key takeaways."
+VIDEO_TEMPLATE = PromptTemplate(
+    f"{SYSTEM_PROMPT}\n\n{INSTRUCTIONS}",
+    "Video Title: {title}\nChannel: {channel}\n\nTranscript:\n{transcript}\n\nSummary:"
+)
+BATCH_TEMPLATE = PromptTemplate(
+    f"{SYSTEM_PROMPT}\n\n{INSTRUCTIONS}",
+    "Respond with one summary for every video, using its video_id.\n\nVideos:\n{videos}"
+)
+
+
+class VideoSummary(BaseModel):
+    video_id: str
+    summary: str
+
+
+class BatchSummaries(BaseModel):
+    summaries: List[VideoSummary]
+
 
 class VideoSummarizer:
     def __init__(self, api_key: str, model: str = "gpt-3.5-turbo", 
-                 max_tokens: int = 150, temperature: float = 0.3):
-        self.client = OpenAI(api_key=api_key)
+                 max_tokens: int = 150, temperature: float = 0.3,
+                 batch_tokens: Optional[int] = None, max_batch_size: int = 8):
+        """
+        With `batch_tokens` set, `summarize_batch` packs several videos into one request of up to
+        `batch_tokens` prompt tokens and at most `max_batch_size` videos.
+        """
         self.model = model
         self.max_tokens = max_tokens
         self.temperature = temperature
+        self.batch_tokens = batch_tokens
+        self.max_batch_size = max_batch_size
+        # pooled client, shared with every other summarizer using the same settings,
+        # with cached completions so that re-summarizing a video costs nothing
+        self.llm = get_chat_llm(
+            model, api_key=api_key, max_tokens=max_tokens, temperature=temperature, cache=True
+        )
+        self.request_stats = {'videos': 0, 'requests': 0, 'batches': 0, 'fallbacks': 0, 'failures': 0}
+        self._stats_lock = threading.Lock()
+    
+    def _count(self, name: str, n: int = 1):
+        with self._stats_lock:
+            self.request_stats[name] += n
     
-    def summarize_video(self, title: str, transcript: str, channel_name: str) -> Optional[str]:
+    def summarize_video(self, title: str, transcript: str, channel_name: str) -> str:
         """
         Summarize a video based on its title and transcript.
-        Returns a concise summary or None if summarization fails.
+        Returns a concise summary, or a placeholder when the LLM call still fails after the
+        retries of the shared scheduler (see common/llm.py) or runs past its deadline.
         """
         if not transcript:
             return f"Video from {channel_name}: {title} (No transcript available)"
         
-        prompt = self._create_prompt(title, transcript, channel_name)
-        
         try:
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {
-                        "role": "system",
-                        "content": "You are a helpful assistant that creates concise, informative summaries of YouTube videos. Focus on the main points and key takeaways."
-                    },
-                    {
-                        "role": "user",
-                        "content": prompt
-                    }
-                ],
-                max_tokens=self.max_tokens,
-                temperature=self.temperature
-            )
+            self._count('requests')
+            response = self.llm.complete(self._create_messages(title, transcript, channel_name))
             
-            summary = response.choices[0].message.content.strip()
+            summary = response.strip()
             return summary
             
-        except Exception as e:
+        except (OpenAIError, TimeoutError) as e:
+            self._count('failures')
             print(f"Error summarizing video '{title}': {e}")
             return f"Summary unavailable for: {title} (Channel: {channel_name})"
     
-    def _create_prompt(self, title: str, transcript: str, channel_name: str) -> str:
-        """Create a prompt for the summarization."""
-        return f"""
-Please summarize this YouTube video in 2-3 sentences, focusing on the main points and key takeaways:
-
-Video Title: {title}
-Channel: {channel_name}
-
-Transcript:
-{transcript}
-
-Summary:"""
+    def _create_messages(self, title: str, transcript: str, channel_name: str) -> List[dict]:
+        return VIDEO_TEMPLATE.format(title=title, channel=channel_name, transcript=transcript)
     
     def summarize_multiple_videos(self, videos_data: list) -> list:
         """
-        Summarize multiple videos.
+        Summarize multiple videos, packed into batches when `batch_tokens` is set.
         videos_data should be a list of tuples: (video_id, title, link, channel_name, transcript)
         Returns list of dictionaries with video info and summaries.
         """
-        summaries = []
+        return [summary for batch in self.pack_batches(videos_data) for summary in self.summarize_batch(batch)]
+    
+    def summarize_video_data(self, video_data: tuple) -> dict:
+        """
+        Summarize one video given as tuple: (video_id, title, link, channel_name, transcript)
+        Returns a dictionary with video info and summary.
+        """
+        video_id, title, link, channel_name, transcript = video_data
+        summary = self.summarize_video(title, transcript, channel_name)
+        return self._video_dict(video_data, summary)
+    
+    def _video_dict(self, video_data: tuple, summary: str) -> dict:
+        video_id, title, link, channel_name, transcript = video_data
+        if transcript:
+            self._count('videos')
+        return {
+            'video_id': video_id,
+            'title': title,
+            'link': link,
+            'channel_name': channel_name,
+            'summary': summary,
+            'has_transcript': bool(transcript)
+        }
+    
+    def batch_cost(self, video_data: tuple) -> int:
+        """Prompt tokens a video adds to a batch request."""
+        _, title, _, channel_name, transcript = video_data
+        return count_tokens(f"{title} {channel_name} {transcript or ''}", self.model)
+    
+    def pack_batches(self, videos_data: list) -> List[list]:
+        """
+        Group consecutive videos with transcripts into batches of up to `batch_tokens` prompt tokens
+        and `max_batch_size` videos. Videos without transcripts need no request and stay alone.
+        """
+        batches, batch, batch_cost = [], [], 0
+        for video_data in videos_data:
+            if not self.batch_tokens or not video_data[4]:
+                batches.append([video_data])
+                continue
+            cost = self.batch_cost(video_data)
+            if batch and (batch_cost + cost > self.batch_tokens or len(batch) >= self.max_batch_size):
+                batches.append(batch)
+                batch, batch_cost = [], 0
+            batch.append(video_data)
+            batch_cost += cost
+        if batch:
+            batches.append(batch)
+        return batches
+    
+    def summarize_batch(self, videos_data: list) -> list:
+        """
+        Summarize several videos in one structured-output request.
+        videos_data should be a list of tuples: (video_id, title, link, channel_name, transcript)
+        The response is validated per video, and every video with a missing or invalid summary
+        is summarized with its own request instead.
+        Returns list of dictionaries with video info and summaries, in the order of `videos_data`.
+        """
+        if len(videos_data) == 1 or not all(video_data[4] for video_data in videos_data):
+            return [self.summarize_video_data(video_data) for video_data in videos_data]
         
-        for video_id, title, link, channel_name, transcript in videos_data:
-            summary = self.summarize_video(title, transcript, channel_name)
-            
-            summaries.append({
-                'video_id': video_id,
-                'title': title,
-                'link': link,
-                'channel_name': channel_name,
-                'summary': summary,
-                'has_transcript': bool(transcript)
-            })
+        messages = self._create_batch_messages(videos_data)
+        # room for the summary of every video, plus its video_id and the JSON syntax
+        max_tokens = (self.max_tokens + 20) * len(videos_data)
+        params = {**self.llm.structured_params(BatchSummaries), 'max_tokens': max_tokens}
+        summaries = {}
+        try:
+            self._count('requests')
+            self._count('batches')
+            # the response follows the schema of BatchSummaries, responses without a list of summaries
+            # are dropped from the cache
+            response = self.llm.complete(messages, **params)
+            summaries = self._parse_batch_summaries(response)
+        except ValueError as e:
+            self.llm.invalidate_messages(messages, **params)
+            print(f"Invalid batch response for {len(videos_data)} videos, summarizing them one by one: {e}")
+        except (OpenAIError, TimeoutError) as e:
+            print(f"Error summarizing a batch of {len(videos_data)} videos: {e}")
         
-        return summaries
\ No newline at end of file
+        results = []
+        for video_data in videos_data:
+            if video_data[0] in summaries:
+                results.append(self._video_dict(video_data, summaries[video_data[0]]))
+            else:
+                self._count('fallbacks')
+                results.append(self.summarize_video_data(video_data))
+        return results
+    
+    def _parse_batch_summaries(self, response: str) -> dict:
+        """
+        Summaries of a batch response by video id, validated per video so that an invalid item only
+        drops its own video. Raises ValueError when the response has no list of summaries.
+        """
+        items = json.loads(repair_json(response))
+        if not isinstance(items, dict) or not isinstance(items.get('summaries'), list):
+            raise ValueError("expected an object with a list of summaries")
+        summaries = {}
+        for item in items['summaries']:
+            try:
+                video_summary = VideoSummary.model_validate(item)
+            except ValidationError as e:
+                print(f"Invalid summary in a batch response, summarizing its video on its own: {e}")
+                continue
+            if video_summary.summary.strip():
+                summaries[video_summary.video_id] = video_summary.summary.strip()
+        return summaries
+    
+    def _create_batch_messages(self, videos_data: list) -> List[dict]:
+        """Create the messages to summarize several videos, answered in the schema of `BatchSummaries`."""
+        videos = [
+            {"video_id": video_id, "title": title, "channel": channel_name, "transcript": transcript}
+            for video_id, title, _, channel_name, transcript in videos_data
+        ]
+        return BATCH_TEMPLATE.format(videos=json.dumps(videos, ensure_ascii=False, indent=1))
+    
+    def report(self) -> str:
+        """Request count of the run, and the requests saved by batching."""
+        stats = self.request_stats
+        saved = stats['videos'] - stats['requests']
+        return (f"{stats['requests']} requests for {stats['videos']} videos "
+                f"({stats['batches']} batched, {stats['fallbacks']} fallbacks, {stats['failures']} failed, "
+                f"{saved} requests saved)")
+    
+    def submit_batch_job(self, videos_data: list, batch_file: Path) -> Optional[str]:
+        """
+        Submit the summaries of the videos with transcripts as one job of the OpenAI Batch API.
+        videos_data should be a list of tuples: (video_id, title, link, channel_name, transcript)
+        Returns the batch id, or None when no video needs a summary.
+        """
+        requests = [
+            {
+                "custom_id": video_id,
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": {
+                    "model": self.model,
+                    "messages": self._create_messages(title, transcript, channel_name),
+                    **self.llm.params
+                }
+            }
+            for video_id, title, _, channel_name, transcript in videos_data
+            if transcript
+        ]
+        if not requests:
+            return None
+        return BatchJob.submit(get_client(**self.llm.client_kws), requests, batch_file).batch_id
+    
+    def collect_batch_job(self, batch_id: str, poll_interval: float = 30,
+                          timeout: Optional[float] = None) -> Optional[dict]:
+        """
+        Wait up to `timeout` seconds for a batch job.
+        Returns the summaries keyed by video id, or None while the job is still running.
+        Videos whose request failed are missing, see `summarize_batch_job_results`.
+        """
+        job = BatchJob(get_client(**self.llm.client_kws), batch_id)
+        status = job.wait(poll_interval, timeout)
+        if status == 'completed':
+            return {video_id: summary.strip() for video_id, summary in job.results().items()}
+        if status in ('failed', 'expired', 'cancelled'):
+            print(f"Batch {batch_id} {status}, summarizing its videos directly")
+            return {}
+        return None
+    
+    def summarize_batch_job_results(self, videos_data: list, summaries: dict) -> list:
+        """
+        Video dictionaries of the collected batch summaries, in the order of `videos_data`.
+        Videos with a transcript but without a batch summary are summarized directly.
+        The batch job counts as one request, the direct summaries as one request each.
+        """
+        if summaries:
+            self._count('requests')
+            self._count('batches')
+        results = []
+        for video_data in videos_data:
+            if video_data[0] in summaries:
+                results.append(self._video_dict(video_data, summaries[video_data[0]]))
+            else:
+                if video_data[4]:
+                    self._count('fallbacks')
+                results.append(self.summarize_video_data(video_data))
+        return results
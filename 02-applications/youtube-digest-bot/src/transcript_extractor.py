@@ -1,9 +1,26 @@
-from youtube_transcript_api import YouTubeTranscriptApi
+import sys
+from pathlib import Path
 from typing import Optional
 
+# Add 02-applications to path for the shared chunking and transcript service
+sys.path.append(str(Path(__file__).parent.parent.parent))
+
+from common.chunking import join_captions, truncate_text
+from common.transcripts import get_transcript_service
+
 class TranscriptExtractor:
-    def __init__(self, max_length: int = 5000):
+    def __init__(self, max_length: int = 5000, max_tokens: Optional[int] = None,
+                 model: str = "gpt-3.5-turbo"):
+        """
+        Transcripts are truncated to `max_tokens` tokens of `model` at a caption boundary,
+        or to `max_length` characters when `max_tokens` is not set.
+        """
         self.max_length = max_length
+        self.max_tokens = max_tokens
+        self.model = model
+        # Shared with the other extractors of the process, so that concurrent requests for
+        # the same video and checking availability before extracting hit the network once
+        self.transcripts = get_transcript_service()
     
     def extract_transcript(self, video_id: str) -> Optional[str]:
         """
@@ -11,39 +28,19 @@ class TranscriptExtractor:
         Returns the transcript text or None if unavailable.
         """
         try:
-            # Try to get transcript in English first, then fall back to auto-generated
-            transcript_list = YouTubeTranscriptApi.list_transcripts(video_id)
-            
-            transcript = None
+            # Manual English transcript first, then auto-generated English, then any available transcript
+            transcript_data = self.transcripts.fetch(video_id, languages=['en'], any_language=True)
             
-            # Try to find manual English transcript first
-            try:
-                transcript = transcript_list.find_transcript(['en'])
-            except:
-                # Fall back to auto-generated English
-                try:
-                    transcript = transcript_list.find_generated_transcript(['en'])
-                except:
-                    # Try any available transcript
-                    try:
-                        transcript = transcript_list[0]
-                    except:
-                        return None
-            
-            if transcript is None:
-                return None
-            
-            # Fetch the actual transcript
-            transcript_data = transcript.fetch()
-            
-            # Combine all text
-            full_text = ' '.join([entry['text'] for entry in transcript_data])
-            
-            # Clean up the text
-            full_text = self._clean_transcript(full_text)
+            # Clean up and combine all captions, keeping track of where every caption starts
+            captions = [self._clean_transcript(entry['text']) for entry in transcript_data]
+            full_text, caption_starts = join_captions([c for c in captions if c])
             
             # Truncate if too long
-            if len(full_text) > self.max_length:
+            if self.max_tokens:
+                truncated_text = truncate_text(full_text, self.max_tokens, self.model, caption_starts)
+                if len(truncated_text) < len(full_text):
+                    full_text = truncated_text + "..."
+            elif len(full_text) > self.max_length:
                 full_text = full_text[:self.max_length] + "..."
             
             return full_text
@@ -66,8 +63,4 @@ class TranscriptExtractor:
     
     def is_transcript_available(self, video_id: str) -> bool:
         """Check if transcript is available for a video."""
-        try:
-            transcript_list = YouTubeTranscriptApi.list_transcripts(video_id)
-            return len(list(transcript_list)) > 0
-        except:
-            return False
\ No newline at end of file
+        return self.transcripts.is_available(video_id)
\ No newline at end of file
@@ -0,0 +1,63 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+
+class RateLimiter:
+    """Thread-safe limiter that spaces calls to at most `rate` per second (None means unlimited)."""
+
+    def __init__(self, rate: Optional[float] = None):
+        self.rate = rate
+        self._lock = threading.Lock()
+        self._next_time = 0.0
+
+    def wait(self):
+        """Block until the next call is allowed."""
+        if not self.rate:
+            return
+        with self._lock:
+            now = time.monotonic()
+            wait_time = self._next_time - now
+            self._next_time = max(now, self._next_time) + 1 / self.rate
+        if wait_time > 0:
+            time.sleep(wait_time)
+
+
+class StageStats:
+    """Timings of one pipeline stage, collected across worker threads."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.count = 0
+        self.busy_seconds = 0.0
+        self.first_start = None
+        self.last_end = None
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def track(self):
+        """Time one item of work in this stage."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            with self._lock:
+                self.count += 1
+                self.busy_seconds += end - start
+                self.first_start = start if self.first_start is None else min(self.first_start, start)
+                self.last_end = end if self.last_end is None else max(self.last_end, end)
+
+    @property
+    def wall_seconds(self) -> float:
+        if self.first_start is None:
+            return 0.0
+        return self.last_end - self.first_start
+
+    def report(self) -> str:
+        average = self.busy_seconds / self.count if self.count else 0.0
+        return (
+            f"{self.name:<12} {self.count:>4} items | wall {self.wall_seconds:7.2f}s"
+            f" | busy {self.busy_seconds:7.2f}s | avg {average:5.2f}s/item"
+        )
@@ -4,7 +4,8 @@ from pathlib import Path
 
 def load_config():
     """Load configuration from config.yml and environment variables."""
-    config_path = Path(__file__).parent.parent.parent / "config.yml"
+    # DIGEST_CONFIG points to another config file, e.g. of the benchmarks
+    config_path = Path(os.getenv('DIGEST_CONFIG', Path(__file__).parent.parent.parent / "config.yml"))
     
     with open(config_path, 'r') as f:
         config = yaml.safe_load(f)
@@ -22,8 +23,8 @@ def load_config():
     return config
 
 def get_data_path():
-    """Get the path to the data directory."""
-    return Path(__file__).parent.parent.parent / "data"
+    """Get the path to the data directory, DIGEST_DATA_PATH if set."""
+    return Path(os.getenv('DIGEST_DATA_PATH', Path(__file__).parent.parent.parent / "data"))
 
 def get_template_path():
     """Get the path to the templates directory."""
@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the OpenAI chat completions, embeddings, files and batch endpoints, to run the
+digest without an API key or spending tokens:
+
+    python src/utils/fake_openai_server.py --port 8089 --batch-seconds 5
+    OPENAI_BASE_URL=http://localhost:8089/v1 python src/digest.py --phase submit
+
+Completions answer with a canned summary of the prompt after `latency` seconds plus the time to
+generate the completion at `tokens_per_second`, and batches complete `batch_seconds` after they
+were created. Embeddings are hashed bags of words, so texts sharing words are similar.
+"""
+
+import argparse
+import json
+import re
+import zlib
+import threading
+import time
+import uuid
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Optional
+
+
+def default_responder(body: dict) -> str:
+    """Answer a chat completion request with a summary quoting its prompt."""
+    prompt = body['messages'][-1]['content']
+    if 'tools' in body or 'response_format' in body:
+        # batched summaries, see VideoSummarizer.summarize_batch
+        videos = json.loads(prompt[prompt.index('['):])
+        return json.dumps({'summaries': [
+            {'video_id': video['video_id'], 'summary': f"Summary of {video['title']}."} for video in videos
+        ]})
+    title = next((line for line in prompt.splitlines() if line.startswith('Video Title:')), 'the video')
+    return f"Summary of {title.removeprefix('Video Title:').strip()}."
+
+
+class FakeOpenAI:
+    """In-memory state of the fake server."""
+
+    def __init__(self, responder: Callable[[dict], str] = default_responder, batch_seconds: float = 0,
+                 latency: float = 0, tokens_per_second: Optional[float] = None):
+        self.responder = responder
+        self.batch_seconds = batch_seconds
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.files: Dict[str, dict] = {}
+        self.batches: Dict[str, dict] = {}
+        self.counts = {'completions': 0, 'embeddings': 0, 'batches': 0, 'batch_requests': 0}
+        self._lock = threading.Lock()
+
+    def completion(self, body: dict) -> dict:
+        content = self.responder(body)
+        with self._lock:
+            self.counts['completions'] += 1
+        prompt_tokens = sum(len(m['content'].split()) for m in body['messages'])
+        message = {'role': 'assistant', 'content': content}
+        if body.get('tool_choice'):
+            # structured output as forced function call, see ChatLLM.structured
+            name = body['tool_choice']['function']['name']
+            message = {'role': 'assistant', 'content': None, 'tool_calls': [{
+                'id': f"call_{uuid.uuid4().hex[:12]}",
+                'type': 'function',
+                'function': {'name': name, 'arguments': content}
+            }]}
+        return {
+            'id': f"chatcmpl-{uuid.uuid4().hex[:12]}",
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': body['model'],
+            'choices': [{
+                'index': 0,
+                'message': message,
+                'finish_reason': 'tool_calls' if body.get('tool_choice') else 'stop'
+            }],
+            'usage': {
+                'prompt_tokens': prompt_tokens,
+                'completion_tokens': len(content.split()),
+                'total_tokens': prompt_tokens + len(content.split())
+            }
+        }
+
+    def embeddings(self, body: dict) -> dict:
+        """Embed every input as the counts of its words hashed into `dimensions` buckets."""
+        inputs = [body['input']] if isinstance(body['input'], str) else body['input']
+        dimensions = body.get('dimensions') or 256
+        data = []
+        for i, text in enumerate(inputs):
+            vector = [0.0] * dimensions
+            for word in re.findall(r'\w+', text.lower()):
+                vector[zlib.crc32(word.encode()) % dimensions] += 1.0
+            data.append({'object': 'embedding', 'index': i, 'embedding': vector})
+        with self._lock:
+            self.counts['embeddings'] += len(inputs)
+        tokens = sum(len(text.split()) for text in inputs)
+        return {
+            'object': 'list',
+            'data': data,
+            'model': body['model'],
+            'usage': {'prompt_tokens': tokens, 'total_tokens': tokens}
+        }
+
+    def wait(self, completion: dict):
+        """Sleep as long as the API would take to respond with the completion."""
+        generation = completion['usage']['completion_tokens'] / self.tokens_per_second if self.tokens_per_second else 0
+        time.sleep(self.latency + generation)
+
+    def create_file(self, filename: str, content: bytes, purpose: str) -> dict:
+        file = {
+            'id': f"file-{uuid.uuid4().hex[:12]}",
+            'object': 'file',
+            'bytes': len(content),
+            'created_at': int(time.time()),
+            'filename': filename,
+            'purpose': purpose,
+            'status': 'processed'
+        }
+        with self._lock:
+            self.files[file['id']] = {**file, 'content': content}
+        return file
+
+    def create_batch(self, body: dict) -> dict:
+        batch = {
+            'id': f"batch_{uuid.uuid4().hex[:12]}",
+            'object': 'batch',
+            'endpoint': body['endpoint'],
+            'input_file_id': body['input_file_id'],
+            'completion_window': body['completion_window'],
+            'status': 'in_progress',
+            'created_at': int(time.time()),
+            'output_file_id': None,
+            'error_file_id': None,
+            'metadata': body.get('metadata')
+        }
+        with self._lock:
+            self.batches[batch['id']] = batch
+            self.counts['batches'] += 1
+        return batch
+
+    def get_batch(self, batch_id: str) -> Optional[dict]:
+        with self._lock:
+            batch = self.batches.get(batch_id)
+        if batch and batch['status'] == 'in_progress' and time.time() - batch['created_at'] >= self.batch_seconds:
+            self._complete_batch(batch)
+        return batch
+
+    def _complete_batch(self, batch: dict):
+        lines = self.files[batch['input_file_id']]['content'].decode().splitlines()
+        results = []
+        for line in filter(None, lines):
+            request = json.loads(line)
+            results.append({
+                'id': f"batch_req_{uuid.uuid4().hex[:12]}",
+                'custom_id': request['custom_id'],
+                'response': {'status_code': 200, 'body': self.completion(request['body'])},
+                'error': None
+            })
+        output = "".join(json.dumps(result) + "\n" for result in results).encode()
+        output_file = self.create_file(f"{batch['id']}_output.jsonl", output, 'batch_output')
+        with self._lock:
+            self.counts['batch_requests'] += len(results)
+            batch.update({'status': 'completed', 'output_file_id': output_file['id'],
+                          'completed_at': int(time.time())})
+
+
+def make_handler(fake: FakeOpenAI) -> type:
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _send_json(self, data: dict, status: int = 200):
+            body = json.dumps(data).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _read_body(self) -> bytes:
+            return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+        def do_POST(self):
+            path = self.path.split('?')[0].removeprefix('/v1')
+            if path == '/chat/completions':
+                completion = fake.completion(json.loads(self._read_body()))
+                fake.wait(completion)
+                self._send_json(completion)
+            elif path == '/embeddings':
+                embeddings = fake.embeddings(json.loads(self._read_body()))
+                time.sleep(fake.latency)
+                self._send_json(embeddings)
+            elif path == '/files':
+                message = BytesParser(policy=HTTP).parsebytes(
+                    f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode() + self._read_body()
+                )
+                fields = {part.get_param('name', header='content-disposition'): part for part in message.iter_parts()}
+                file = fields['file']
+                self._send_json(fake.create_file(
+                    file.get_filename(), file.get_payload(decode=True), fields['purpose'].get_content().strip()
+                ))
+            elif path == '/batches':
+                self._send_json(fake.create_batch(json.loads(self._read_body())))
+            else:
+                self._send_json({'error': {'message': f"Unknown path {path}"}}, 404)
+
+        def do_GET(self):
+            path = self.path.split('?')[0].removeprefix('/v1')
+            parts = path.strip('/').split('/')
+            if parts[0] == 'batches' and len(parts) == 2 and fake.get_batch(parts[1]):
+                self._send_json(fake.get_batch(parts[1]))
+            elif parts[0] == 'files' and len(parts) == 3 and parts[2] == 'content' and parts[1] in fake.files:
+                content = fake.files[parts[1]]['content']
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/octet-stream')
+                self.send_header('Content-Length', str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+            else:
+                self._send_json({'error': {'message': f"Unknown path {path}"}}, 404)
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+def serve(port: int = 0, fake: Optional[FakeOpenAI] = None) -> ThreadingHTTPServer:
+    """Start the fake server in a background thread, its base URL is http://localhost:<port>/v1"""
+    server = ThreadingHTTPServer(('localhost', port), make_handler(fake or FakeOpenAI()))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument('--batch-seconds', type=float, default=5, help="Seconds until a batch completes")
+    parser.add_argument('--latency', type=float, default=0, help="Seconds until a completion starts")
+    parser.add_argument('--tokens-per-second', type=float, default=None, help="Completion tokens per second")
+    args = parser.parse_args()
+    fake = FakeOpenAI(batch_seconds=args.batch_seconds, latency=args.latency,
+                      tokens_per_second=args.tokens_per_second)
+    server = ThreadingHTTPServer(('localhost', args.port), make_handler(fake))
+    print(f"🧪 Fake OpenAI server on http://localhost:{args.port}/v1")
+    server.serve_forever()
@@ -1,82 +1,211 @@
-import feedparser
 import os
-from datetime import datetime, timedelta
+import sys
+import threading
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
-from typing import List, Tuple, Set
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Add 02-applications to path for the shared telemetry
+sys.path.append(str(Path(__file__).parent.parent.parent))
+
+from common import telemetry  # noqa: E402
+from feed_state import FeedState  # noqa: E402
+from seen_store import SeenStore  # noqa: E402
+from utils.concurrency import RateLimiter, StageStats  # noqa: E402
+
+# YOUTUBE_FEED_URL points to another feed server, e.g. of the benchmarks
+FEED_URL = os.getenv('YOUTUBE_FEED_URL', "https://www.youtube.com/feeds/videos.xml?channel_id={channel_id}")
+ATOM = "{http://www.w3.org/2005/Atom}"
+YT = "{http://www.youtube.com/xml/schemas/2015}"
+
 
 class VideoFetcher:
-    def __init__(self, data_path: Path):
+    def __init__(self, data_path: Path, seen_retention_days: int = 180):
         self.data_path = data_path
         self.seen_file = data_path / "seen_videos.txt"
-        
-    def load_seen_videos(self) -> Set[str]:
+        self.seen_retention_days = seen_retention_days
+        self.feed_state = FeedState(data_path / "feed_state.json")
+        # One pooled session for all feeds, kept alive across the channels of a run
+        self.session = requests.Session()
+        self.session.mount("https://", HTTPAdapter(pool_maxsize=32))
+        self.feed_counts = {'not_modified': 0, 'fetched': 0, 'entries_parsed': 0}
+        self._counts_lock = threading.Lock()
+
+    def load_seen_videos(self) -> SeenStore:
         """Load previously seen video IDs from file."""
-        if self.seen_file.exists():
-            with open(self.seen_file, 'r') as f:
-                return set(line.strip() for line in f if line.strip())
-        return set()
-    
-    def save_seen_videos(self, seen_videos: Set[str]):
-        """Save seen video IDs to file."""
-        self.data_path.mkdir(exist_ok=True)
-        with open(self.seen_file, 'w') as f:
-            for video_id in seen_videos:
-                f.write(f"{video_id}\n")
-    
-    def get_latest_videos(self, channel_ids: List[str], hours_back: int = 24) -> List[Tuple[str, str, str, str]]:
+        return SeenStore(self.seen_file, retention_days=self.seen_retention_days)
+
+    def save_seen_videos(self, seen_videos: SeenStore):
+        """Append the newly seen video IDs to file, compacting it when old entries expire."""
+        seen_videos.save()
+        self.feed_state.save()
+
+    def get_latest_videos(self, channel_ids: List[str], hours_back: int = 24, max_workers: int = 8,
+                          rate_limiter: Optional[RateLimiter] = None,
+                          stats: Optional[StageStats] = None) -> List[Tuple[str, str, str, str]]:
         """
         Fetch latest videos from YouTube channels using RSS feeds.
+        Feeds are fetched in parallel by up to `max_workers` threads.
         Returns list of tuples: (video_id, title, link, channel_name)
         """
+        videos_by_channel = self.get_latest_videos_by_channel(
+            channel_ids, hours_back, max_workers, rate_limiter, stats
+        )
+        # merge in the order of the channels, a video can be listed by more than one channel
+        new_videos = {}
+        for videos in videos_by_channel.values():
+            for video in videos:
+                new_videos.setdefault(video[0], video)
+        return list(new_videos.values())
+
+    def get_latest_videos_by_channel(self, channel_ids: List[str], hours_back: int = 24,
+                                     max_workers: int = 8, rate_limiter: Optional[RateLimiter] = None,
+                                     stats: Optional[StageStats] = None) -> Dict[str, List[tuple]]:
+        """
+        Fetch latest videos from YouTube channels using RSS feeds, like `get_latest_videos`.
+        Returns the new videos of each channel, a video listed by more than one channel is new in each.
+        """
         seen_videos = self.load_seen_videos()
-        new_videos = []
-        cutoff_time = datetime.now() - timedelta(hours=hours_back)
-        
-        for channel_id in channel_ids:
-            try:
-                feed_url = f"https://www.youtube.com/feeds/videos.xml?channel_id={channel_id}"
-                feed = feedparser.parse(feed_url)
-                
-                if not hasattr(feed, 'entries'):
-                    print(f"Warning: Could not fetch feed for channel {channel_id}")
-                    continue
-                
-                channel_name = getattr(feed.feed, 'title', 'Unknown Channel')
-                
-                for entry in feed.entries:
-                    # Extract video ID from entry.id or link
-                    video_id = entry.id.split(':')[-1] if ':' in entry.id else entry.id
-                    
-                    # Check if we've seen this video before
-                    if video_id in seen_videos:
-                        continue
-                    
-                    # Check if video is recent enough
-                    published = datetime(*entry.published_parsed[:6])
-                    if published < cutoff_time:
-                        continue
-                    
-                    new_videos.append((
-                        video_id,
-                        entry.title,
-                        entry.link,
-                        channel_name
-                    ))
-                    seen_videos.add(video_id)
-                    
-            except Exception as e:
-                print(f"Error fetching videos from channel {channel_id}: {e}")
-                continue
-        
+        new_videos = {}
+        new_video_ids = set()
+        cutoff_time = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(hours=hours_back)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            # all feeds are read before the new videos are marked as seen
+            channel_videos = list(executor.map(
+                telemetry.propagate(lambda channel_id: self._fetch_channel_videos(
+                    channel_id, seen_videos, cutoff_time, rate_limiter, stats
+                )),
+                channel_ids
+            ))
+        for channel_id, videos in zip(channel_ids, channel_videos):
+            new_videos[channel_id] = []
+            for video in videos:
+                if video[0] in new_video_ids or video[0] not in seen_videos:
+                    new_videos[channel_id].append(video)
+                    if video[0] not in new_video_ids:
+                        new_video_ids.add(video[0])
+                        seen_videos.add(video[0], channel_id)
+
         # Save updated seen videos
         self.save_seen_videos(seen_videos)
-        
+        counts = self.feed_counts
+        print(f"📡 Feeds: {counts['fetched']} fetched, {counts['not_modified']} not modified, "
+              f"{counts['entries_parsed']} entries parsed")
+
         return new_videos
-    
+
+    def _count(self, name: str, n: int = 1):
+        with self._counts_lock:
+            self.feed_counts[name] += n
+        telemetry.count(f"rss.{name}", n)
+
+    def _fetch_channel_videos(self, channel_id: str, seen_videos: SeenStore, cutoff_time: datetime,
+                              rate_limiter: Optional[RateLimiter] = None,
+                              stats: Optional[StageStats] = None) -> List[Tuple[str, str, str, str]]:
+        """
+        Fetch the unseen videos published after `cutoff_time` from one channel's RSS feed.
+        The request is conditional on the ETag/Last-Modified of the previous run, so an unchanged
+        feed answers 304 and is skipped, and parsing stops at the first video that was already
+        seen or is too old, as feeds list the newest videos first.
+        """
+        if rate_limiter:
+            rate_limiter.wait()
+        with stats.track() if stats else nullcontext(), \
+                telemetry.span("rss.fetch", channel_id=channel_id) as span:
+            videos = []
+            try:
+                state = self.feed_state.get(channel_id)
+                headers = {}
+                if state.get('etag'):
+                    headers['If-None-Match'] = state['etag']
+                if state.get('last_modified'):
+                    headers['If-Modified-Since'] = state['last_modified']
+
+                with self.session.get(FEED_URL.format(channel_id=channel_id), headers=headers,
+                                      stream=True, timeout=30) as response:
+                    span.set(status_code=response.status_code)
+                    if response.status_code == 304:
+                        self._count('not_modified')
+                        return videos
+                    response.raise_for_status()
+                    self._count('fetched')
+
+                    stop_at = {state['latest_video_id']} if state.get('latest_video_id') else set()
+                    channel_name, newest_video_id = 'Unknown Channel', None
+                    for entry in self._parse_feed(response):
+                        if 'channel_name' in entry:
+                            channel_name = entry['channel_name']
+                            continue
+                        self._count('entries_parsed')
+                        video_id = entry['video_id']
+                        newest_video_id = newest_video_id or video_id
+
+                        # Everything after a seen or too old video is older still
+                        if video_id in seen_videos or video_id in stop_at:
+                            break
+                        if entry['published'] < cutoff_time:
+                            break
+
+                        videos.append((
+                            video_id,
+                            entry['title'],
+                            entry['link'],
+                            channel_name
+                        ))
+
+                self.feed_state.update(
+                    channel_id,
+                    etag=response.headers.get('ETag'),
+                    last_modified=response.headers.get('Last-Modified'),
+                    latest_video_id=newest_video_id or state.get('latest_video_id')
+                )
+
+            except Exception as e:
+                span.record_error(e)
+                print(f"Error fetching videos from channel {channel_id}: {e}")
+            span.set(videos=len(videos))
+            return videos
+
+    def _parse_feed(self, response: requests.Response) -> Iterator[dict]:
+        """
+        Incrementally parse an Atom feed from the response body, yielding the channel name and
+        then every entry as soon as it is complete, so that the caller can stop reading early.
+        """
+        parser = ET.XMLPullParser(events=('start', 'end'))
+        in_entry = False
+        for chunk in response.iter_content(chunk_size=8192):
+            parser.feed(chunk)
+            for event, element in parser.read_events():
+                if element.tag != f"{ATOM}entry":
+                    if event == 'end' and element.tag == f"{ATOM}title" and not in_entry:
+                        yield {'channel_name': element.text or 'Unknown Channel'}
+                    continue
+                if event == 'start':
+                    in_entry = True
+                    continue
+                in_entry = False
+                link = element.find(f"{ATOM}link[@rel='alternate']")
+                published = datetime.fromisoformat(element.findtext(f"{ATOM}published"))
+                yield {
+                    'video_id': element.findtext(f"{YT}videoId"),
+                    'title': element.findtext(f"{ATOM}title"),
+                    'link': link.get('href') if link is not None else None,
+                    # Naive UTC, like the cutoff time
+                    'published': published.astimezone(timezone.utc).replace(tzinfo=None),
+                }
+                element.clear()
+
     def get_video_info(self, video_id: str) -> dict:
         """Get additional video information if needed."""
         # This could be extended to use YouTube Data API for more details
         return {
             'id': video_id,
             'url': f"https://www.youtube.com/watch?v={video_id}"
-        }
\ No newline at end of file
+        }
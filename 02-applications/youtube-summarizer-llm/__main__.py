@@ -5,28 +5,57 @@ from pathlib import Path
 os.environ["CHROMA_DB_PATH"] = str(Path(__file__).parent.parent / "chroma.db")
 
 from functions import (  # noqa: E402
+    SUMMARIZE_MODES,
     download_transcript,
     summarize_transcript,
     save_summary_to_database,
     get_summary_from_database,
 )
+from backfill import backfill, is_batch_source  # noqa: E402
+from common import telemetry  # noqa: E402
 
 
-def main(link: str):
-    transcript = download_transcript(link)
-    summary = summarize_transcript(link, transcript)
-    save_summary_to_database(link, summary)
-    summary = get_summary_from_database(link)
+def main(link: str, mode: str = "map_reduce", max_workers: int = 4):
+    # a trace per video, with the transcript download, chunking, LLM calls and database reads and writes as stages
+    with telemetry.span("video", link=link):
+        transcript = download_transcript(link)
+        summary = summarize_transcript(link, transcript, mode=mode, max_workers=max_workers)
+        save_summary_to_database(link, summary)
+        summary = get_summary_from_database(link)
     print("===== Youtube Link =====")
     print(link)
     print("===== Summary =====")
     print(summary)
 
 
+def main_backfill(source: str, mode: str = "map_reduce", max_workers: int = 4, **kws):
+    stats = backfill(source, max_workers=max_workers, mode=mode, **kws)
+    print("===== Backfill =====")
+    print(source)
+    print(f"Videos: {stats['videos']} ({stats['summarized']} summarized, {stats['failed']} failed)")
+    print(f"Throughput: {stats['videos_per_minute']:.1f} videos/min, {stats['tokens_per_minute']:.0f} tokens/min")
+
+
 if __name__ == "__main__":
     # parse a string argument as a youtube link
     parser = argparse.ArgumentParser()
-    parser.add_argument("link", help="Youtube video link", default="https://www.youtube.com/watch?v=Oq46-UCWuZ4")
+    parser.add_argument(
+        "link",
+        help="Youtube video link, or a playlist link, channel link or id, or file of links to backfill",
+        default="https://www.youtube.com/watch?v=Oq46-UCWuZ4",
+    )
+    parser.add_argument("--mode", choices=SUMMARIZE_MODES, default="map_reduce", help="Summarization mode")
+    parser.add_argument("--max-workers", type=int, default=4, help="Concurrent LLM calls")
+    parser.add_argument("--checkpoint", type=Path, default=None, help="Checkpoint file to resume a backfill")
+    parser.add_argument("--retry-failed", action="store_true", help="Retry videos that failed in the checkpoint")
+    parser.add_argument("--telemetry", default=None, help="JSON lines file of spans and counters, see TELEMETRY_PATH")
     args = parser.parse_args()
+    if args.telemetry:
+        telemetry.configure(path=args.telemetry)
     link = args.link
-    main(link)
+    if is_batch_source(link):
+        main_backfill(
+            link, args.mode, args.max_workers, checkpoint_path=args.checkpoint, retry_failed=args.retry_failed
+        )
+    else:
+        main(link, args.mode, args.max_workers)
@@ -0,0 +1,203 @@
+import hashlib
+import json
+import logging
+import os
+import time
+import urllib.parse
+import urllib.request
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+
+from functions import download_transcripts
+from functions import get_summaries_from_database
+from functions import get_summary_llm
+from functions import get_video_id
+from functions import save_summaries_to_database
+from functions import summarize_transcript
+
+logger = logging.getLogger(__name__)
+YOUTUBE_API_URL = "https://www.googleapis.com/youtube/v3"
+YOUTUBE_FEED_URL = "https://www.youtube.com/feeds/videos.xml"
+BATCH_SIZE = 50
+
+
+def _youtube_api(resource: str, **params) -> dict:
+    params["key"] = os.environ["YT_API_KEY"]
+    with urllib.request.urlopen(f"{YOUTUBE_API_URL}/{resource}?{urllib.parse.urlencode(params)}") as response:
+        return json.load(response)
+
+
+def _timestamp(published: Optional[str]) -> Optional[int]:
+    # publish times are filtered on as unix seconds
+    return int(datetime.fromisoformat(published.replace("Z", "+00:00")).timestamp()) if published else None
+
+
+def _playlist_videos(playlist_id: str) -> dict[str, dict]:
+    # the links of the videos of a playlist, with their channel id and publish time
+    if not os.environ.get("YT_API_KEY"):
+        # the RSS feed works without an API key, but only lists the latest 15 videos
+        logger.warning("YT_API_KEY is not set, only the latest videos of the playlist are listed")
+        with urllib.request.urlopen(f"{YOUTUBE_FEED_URL}?playlist_id={playlist_id}") as response:
+            feed = ET.parse(response)
+        namespace = {"atom": "http://www.w3.org/2005/Atom", "yt": "http://www.youtube.com/xml/schemas/2015"}
+        return {
+            f"https://www.youtube.com/watch?v={entry.findtext('yt:videoId', namespaces=namespace)}": {
+                "channel_id": entry.findtext("yt:channelId", namespaces=namespace),
+                "published": _timestamp(entry.findtext("atom:published", namespaces=namespace)),
+            }
+            for entry in feed.iterfind("atom:entry", namespace)
+        }
+
+    videos, page_token = {}, None
+    while True:
+        params = {"part": "contentDetails,snippet", "playlistId": playlist_id, "maxResults": 50}
+        if page_token:
+            params["pageToken"] = page_token
+        page = _youtube_api("playlistItems", **params)
+        for item in page["items"]:
+            videos[f"https://www.youtube.com/watch?v={item['contentDetails']['videoId']}"] = {
+                "channel_id": item["snippet"].get("videoOwnerChannelId"),
+                "published": _timestamp(item["contentDetails"].get("videoPublishedAt")),
+            }
+        page_token = page.get("nextPageToken")
+        if not page_token:
+            return videos
+
+
+def _channel_id(source: str) -> str:
+    # the segment after /channel/ or the @handle of a link, e.g. with a /videos tab, or a channel id
+    segments = urllib.parse.urlparse(source).path.strip("/").split("/")
+    if "channel" in segments[:-1]:
+        channel = segments[segments.index("channel") + 1]
+    else:
+        channel = next((segment for segment in segments if segment.startswith("@")), source)
+    if channel.startswith("@"):
+        channels = _youtube_api("channels", part="id", forHandle=channel)
+        channel = channels["items"][0]["id"]
+    if not channel.startswith("UC"):
+        raise ValueError(f"Invalid channel: {source}, expected a channel id starting with UC")
+    return channel
+
+
+def is_batch_source(source: str) -> bool:
+    return (
+        Path(source).is_file()
+        or "list=" in source
+        or any(part in source for part in ("/channel/", "/@"))
+        or (source.startswith("UC") and len(source) == 24)
+    )
+
+
+def resolve_videos(source: str) -> dict[str, dict]:
+    """
+    Video links of a file with one link per line, a playlist or a channel (link, handle link or channel id), with
+    the channel id and publish time of the videos of playlists and channels.
+    """
+    if Path(source).is_file():
+        links = [line.strip() for line in Path(source).read_text().splitlines()]
+        videos = {link: {} for link in links if link and not link.startswith("#")}
+    elif "list=" in source:
+        videos = _playlist_videos(urllib.parse.parse_qs(urllib.parse.urlparse(source).query)["list"][0])
+    else:
+        # the uploads playlist of a channel has the id of the channel with prefix UU instead of UC
+        videos = _playlist_videos("UU" + _channel_id(source)[2:])
+    # deduplicate by video id, keeping the order
+    links = list({get_video_id(link): link for link in reversed(videos)}.values())[::-1]
+    return {link: videos[link] for link in links}
+
+
+class Checkpoint:
+    """Append-only JSON lines file with the outcome of every processed video, to resume interrupted runs."""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.records = {}
+        if self.path.exists():
+            for line in self.path.read_text().splitlines():
+                if line.strip():
+                    record = json.loads(line)
+                    self.records[record["video_id"]] = record
+
+    def status(self, video_id: str) -> Optional[str]:
+        return self.records.get(video_id, {}).get("status")
+
+    def save(self, records: list[dict]):
+        with open(self.path, "a") as f:
+            for record in records:
+                f.write(json.dumps(record) + "\n")
+                self.records[record["video_id"]] = record
+
+
+def backfill(
+    source: str,
+    max_workers: int = 4,
+    checkpoint_path: Optional[Path] = None,
+    mode: str = "map_reduce",
+    retry_failed: bool = False,
+    batch_size: int = BATCH_SIZE,
+) -> dict:
+    """
+    Summarize all videos of a playlist, a channel or a file of links with a pool of `max_workers` workers.
+
+    Videos are processed in batches: summaries already in the database are skipped, transcripts are read and
+    written in bulk, and after every batch the results are saved to the database and the checkpoint file.
+    An interrupted run resumes from the checkpoint without repeating transcript downloads or LLM calls.
+    """
+    start_time = time.perf_counter()
+    checkpoint_path = checkpoint_path or Path(f"backfill-{hashlib.sha256(source.encode()).hexdigest()[:12]}.jsonl")
+    checkpoint = Checkpoint(checkpoint_path)
+    videos = resolve_videos(source)
+    links = list(videos)
+    skip_statuses = {"done", "cached"} if retry_failed else {"done", "cached", "failed"}
+    links = [link for link in links if checkpoint.status(get_video_id(link)) not in skip_statuses]
+    logger.info(f"✅ Resolved {len(links)} videos to process, {len(checkpoint.records)} in the checkpoint")
+
+    cached = get_summaries_from_database(links)
+    checkpoint.save([{"video_id": get_video_id(link), "link": link, "status": "cached"} for link in cached])
+    links = [link for link in links if link not in cached]
+
+    llm = get_summary_llm()
+    usage_before = dict(llm.usage)
+    stats = {"videos": len(cached), "summarized": 0, "failed": 0}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for i in range(0, len(links), batch_size):
+            batch = links[i : i + batch_size]
+            transcripts = download_transcripts(batch, max_workers=max_workers, raise_errors=False, metadata=videos)
+
+            def summarize(link: str) -> Optional[list[str]]:
+                try:
+                    # parallelism comes from the pool of videos, every video summarizes its parts one at a time
+                    return summarize_transcript(link, transcripts[link], mode, max_workers=1, llm=llm)
+                except Exception as e:
+                    logger.error(f"❌ Summarizing {link}: {e}")
+                    return None
+
+            summaries = dict(zip(transcripts, executor.map(summarize, transcripts)))
+            summaries = {link: summary for link, summary in summaries.items() if summary is not None}
+            if summaries:
+                save_summaries_to_database(summaries, metadata=videos)
+            checkpoint.save(
+                [
+                    {"video_id": get_video_id(link), "link": link, "status": "done" if link in summaries else "failed"}
+                    for link in batch
+                ]
+            )
+            stats["videos"] += len(batch)
+            stats["summarized"] += len(summaries)
+            stats["failed"] += len(batch) - len(summaries)
+            logger.info(f"✅ Processed {i + len(batch)}/{len(links)} videos")
+
+    minutes = (time.perf_counter() - start_time) / 60
+    tokens = sum(llm.usage[k] - usage_before[k] for k in ("prompt_tokens", "completion_tokens"))
+    stats.update(
+        {
+            "minutes": minutes,
+            "videos_per_minute": stats["videos"] / minutes,
+            "tokens": tokens,
+            "tokens_per_minute": tokens / minutes,
+        }
+    )
+    return stats
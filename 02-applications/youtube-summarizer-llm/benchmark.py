@@ -0,0 +1,65 @@
+"""
+Compare the sequential and map-reduce summarization modes against a local fake LLM.
+
+    python benchmark.py --num-words 20000 --latency 0.5 --max-workers 4
+"""
+import argparse
+import json
+import random
+import sys
+import time
+from pathlib import Path
+from typing import Optional
+
+sys.path.insert(0, Path(__file__).parent.parent.as_posix())
+
+from common.fake_llm import FakeLLM  # noqa: E402
+from functions import summarize_transcript  # noqa: E402
+from functions import SUMMARIZE_MODES  # noqa: E402
+
+
+def _fake_responder(prompt: str) -> str:
+    # answer the summarizer prompts with a valid response of ~10 bullet points
+    summary = [f"📌 point {i}. Reference: {prompt[100 + i * 20 : 140 + i * 20]}" for i in range(10)]
+    if '"last_part": "False"' in prompt:
+        return json.dumps({"message": "waiting", "summary": []})
+    if '"last_part": "True"' in prompt:
+        return json.dumps({"message": "done", "summary": summary})
+    return json.dumps({"summary": summary})
+
+
+def _fake_transcript(num_words: int, seed: int = 0) -> str:
+    rng = random.Random(seed)
+    vocabulary = ["video", "model", "token", "summary", "latency", "the", "a", "of", "and", "chunk", "prompt"]
+    return " ".join(rng.choice(vocabulary) for _ in range(num_words))
+
+
+def main(num_words: int, latency: float, max_workers: int, chunk_tokens: Optional[int] = None):
+    transcript = _fake_transcript(num_words)
+    llm = FakeLLM(_fake_responder, latency=latency)
+    print(
+        f"Transcript of {num_words} words, fake LLM latency {latency}s, max_workers {max_workers},"
+        f" chunk_tokens {chunk_tokens or 'auto'}"
+    )
+    print(f"{'mode':<12} {'seconds':>8} {'calls':>6} {'prompt tokens':>14} {'completion tokens':>18}")
+    for mode in SUMMARIZE_MODES:
+        llm.reset()
+        t0 = time.perf_counter()
+        link = "https://www.youtube.com/watch?v=benchmark"
+        summarize_transcript(link, transcript, mode, max_workers, llm=llm, chunk_tokens=chunk_tokens)
+        duration = time.perf_counter() - t0
+        usage = llm.usage
+        print(
+            f"{mode:<12} {duration:>8.2f} {usage['calls']:>6} {usage['prompt_tokens']:>14}"
+            f" {usage['completion_tokens']:>18}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num-words", type=int, default=20000, help="Length of the fake transcript")
+    parser.add_argument("--latency", type=float, default=0.5, help="Seconds per fake LLM call")
+    parser.add_argument("--max-workers", type=int, default=4, help="Concurrent LLM calls in map-reduce mode")
+    parser.add_argument("--chunk-tokens", type=int, default=None, help="Tokens per part, defaults to the model budget")
+    args = parser.parse_args()
+    main(args.num_words, args.latency, args.max_workers, args.chunk_tokens)
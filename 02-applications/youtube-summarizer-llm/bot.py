@@ -1,9 +1,13 @@
-from functions import download_transcript
-from functions import summarize_transcript
+from typing import Optional
+
+from fastapi.responses import StreamingResponse
+from modal import Dict
 from modal import Image
 from modal import Secret
 from modal import Stub
 from modal import web_endpoint
+from results import ResultCache
+from results import ResultStore
 
 image = Image.debian_slim().pip_install(
     "langchain_community==0.0.32",
@@ -15,12 +19,40 @@ image = Image.debian_slim().pip_install(
 stub = Stub()
 
 
-@stub.function(
+class ModalDictStore(ResultStore):
+    """Results persisted in a modal.Dict, shared by all containers and deployments."""
+
+    def __init__(self, name: str):
+        # lazy, the dict is only created or looked up on first use inside a container
+        self.dict = Dict.from_name(name, create_if_missing=True)
+
+    def get(self, key: str) -> Optional[str]:
+        return self.dict.get(key)
+
+    def set(self, key: str, value: str):
+        self.dict[key] = value
+
+
+# module state lives as long as the container, so warm containers answer repeated videos from memory
+results = ResultCache(ModalDictStore("youtube-summarizer-results"))
+warm_container_kws = dict(
     image=image,
     secrets=[Secret.from_name("my-openai-secret")],
+    keep_warm=1,
+    container_idle_timeout=300,
+    # concurrent requests share a container, so requests for the same video share one summarization
+    allow_concurrent_inputs=20,
 )
+
+
+@stub.function(**warm_container_kws)
 @web_endpoint()
 def summarise(link: str):
-    transcript = download_transcript(link)
-    summary = summarize_transcript(link, transcript)
-    return summary
+    return results.get_summary(link)
+
+
+@stub.function(**warm_container_kws)
+@web_endpoint()
+def summarise_stream(link: str):
+    # server-sent events with progress and the summary points of every part as soon as they are generated
+    return StreamingResponse(results.stream_summary(link), media_type="text/event-stream")
@@ -1,20 +1,35 @@
+import functools
+import hashlib
 import importlib.util
 import json
 import logging
 import os
+import queue
+import re
 import sys
+from concurrent.futures import Future
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from typing import Callable, Iterator, Literal, Optional, TypeVar
 
 if importlib.util.find_spec("chromadb") is not None:
     import chromadb
 else:
     chromadb = None
 from pydantic import BaseModel, ValidationError
-from youtube_transcript_api import YouTubeTranscriptApi
 
 sys.path.insert(0, Path(__file__).parent.parent.as_posix())
 
+from common import telemetry  # noqa: E402
+from common.chunking import chunk_text  # noqa: E402
+from common.chunking import count_tokens  # noqa: E402
+from common.chunking import get_chunk_budget  # noqa: E402
+from common.llm import ChatLLM  # noqa: E402
 from common.llm import get_llm  # noqa: E402
+from common.llm import parse_structured  # noqa: E402
+from common.prompts import prompt_text  # noqa: E402
+from common.prompts import PromptTemplate  # noqa: E402
+from common.transcripts import get_transcript_service  # noqa: E402
 
 
 logging.basicConfig(level=logging.INFO)
@@ -26,187 +41,655 @@ if chromadb and os.environ.get("CHROMA_DB_PATH"):
     collection = chroma_client.get_or_create_collection(name="youtube_summarizer")
 else:
     collection = None
-PROMPT_TEMPLATE = (
-    json.dumps(
-        {
-            "format": "json",
-            "system": "Youtube Video Summarizer",
-            "goal": "Summarize the transcript of a youtube video.",
-            "instructions": [
-                "Transcript (transcript) of the video is provided as input in parts.",
-                "last_part is a boolean field that indicates if the last part is received.",
-                "Only create a summary when last_part is True.",
-                "Output must contain message and summary fields.",
-                "When last part is received, create a summary in bullet points.",
-                "Each point starts with an relevant emoji.",
-                "Each point is in order as mentioned in the transcript.",
-                "Each point contains a one line reference to the section of the transcript"
-                " that the point is from. e.g., `* summary point. Reference: reference text"
-                " from transcript`.",
-                "Must be minimum 10 points. Add more points if needed and are not similar to" " previous points.",
-                "Each point must be be salient and non-repetitive.",
-                "Output must be json format.",
-                "Output follows this input template.",
-                "Output must remove and not include the transcript field.",
-                "Output must contain the summary text in the summary field.",
-            ],
-            "last_part": "{}",
-            "transcript": "{}",
-            "message": "'waiting' if last_part is False, otherwise 'done'.",
-            "summary": "Empty list [] if last_part is False else a list[str] summary of the video transcript.",
-        }
+
+
+@functools.lru_cache(maxsize=None)
+def get_document_embeddings():
+    """
+    The embeddings of the stored documents: the same all-MiniLM-L6-v2 model as chroma's default embedding function,
+    but in length-sorted batches and through the embedding cache. None without a collection or without
+    sentence-transformers, chroma then embeds the documents itself. common.embeddings, and with it numpy, is only
+    imported with a collection, the Modal image of bot.py has neither.
+    """
+    if not collection or importlib.util.find_spec("sentence_transformers") is None:
+        return None
+    from common.embeddings import get_embeddings
+
+    return get_embeddings("sentence-transformers/all-MiniLM-L6-v2", provider="local")
+
+
+@functools.lru_cache(maxsize=None)
+def get_passage_index():
+    """
+    The passages of the transcripts and summaries for search, see search.py, or None without a collection. Its chroma
+    collection and search index are only opened by the first call, when passages are indexed or searched.
+    """
+    if not collection:
+        return None
+    from common.search_index import SearchIndex
+    from passages import PASSAGE_METADATA
+    from passages import PassageIndex
+
+    return PassageIndex(
+        chroma_client.get_or_create_collection(name="youtube_summarizer_passages", metadata={"hnsw:space": "cosine"}),
+        SearchIndex(
+            os.environ.get("SEARCH_INDEX_PATH") or Path(os.environ["CHROMA_DB_PATH"]).parent / "search.sqlite3",
+            PASSAGE_METADATA,
+        ),
+        get_document_embeddings(),
     )
-    .replace("{", "{{")
-    .replace("}", "}}")
-    .replace("{{}}", "{}")
-)
-MAX_RETRIES = 3
 
 
-class GenericResponse(BaseModel):
-    message: str
+def _build_prompt_template(system: dict, user: dict) -> PromptTemplate:
+    # the instructions are the static system message, only the user message has "{}" fields,
+    # its json braces are escaped so that only the fields are filled
+    user_template = json.dumps(user).replace("{", "{{").replace("}", "}}").replace("{{}}", "{}")
+    return PromptTemplate(json.dumps(system), user_template)
 
-    @classmethod
-    def validate_response(cls, raw_response: str, expected_msg: str) -> bool:
-        try:
-            response = cls.model_validate_json(raw_response)
-            if response.message != expected_msg:
-                raise ValidationError.from_exception_data(
-                    f"Expected message: {expected_msg}, got: {response.message}",
-                    [],
-                )
-            return True
-        except ValidationError as e:
-            logger.error(f"❌ Unable to validate LLM response: {e}")
-        return False
+
+# the response format of ChatLLM follows the schema of the response model, other LLMs (e.g. the gpt-4 deployment or
+# FakeLLM) only get the text of the prompt and are asked for json in the user message
+JSON_OUTPUT = "Output must be json format, only a json object"
+SUMMARY_POINT_INSTRUCTIONS = [
+    "Each point starts with an relevant emoji.",
+    "Each point is in order as mentioned in the transcript.",
+    "Each point contains a one line reference to the section of the transcript"
+    " that the point is from. e.g., `* summary point. Reference: reference text"
+    " from transcript`.",
+]
+PROMPT_TEMPLATE = _build_prompt_template(
+    {
+        "system": "Youtube Video Summarizer",
+        "goal": "Summarize the transcript of a youtube video.",
+        "instructions": [
+            "Transcript (transcript) of the video is provided as input in parts.",
+            "last_part is a boolean field that indicates if the last part is received.",
+            "Only create a summary when last_part is True.",
+            "When last part is received, create a summary in bullet points.",
+            *SUMMARY_POINT_INSTRUCTIONS,
+            "Must be minimum 10 points. Add more points if needed and are not similar to" " previous points.",
+            "Each point must be be salient and non-repetitive.",
+        ],
+        "message": "'waiting' if last_part is False, otherwise 'done'.",
+        "summary": "Empty list [] if last_part is False else a list[str] summary of the video transcript.",
+    },
+    {"format": f"{JSON_OUTPUT} with the message and summary fields.", "last_part": "{}", "transcript": "{}"},
+)
+MAP_PROMPT_TEMPLATE = _build_prompt_template(
+    {
+        "system": "Youtube Video Summarizer",
+        "goal": "Summarize one part of the transcript of a youtube video.",
+        "instructions": [
+            "Transcript (transcript) is part number part of total_parts parts of the video.",
+            "Create a summary of only this part in bullet points.",
+            *SUMMARY_POINT_INSTRUCTIONS,
+            "Each point must be be salient and non-repetitive.",
+        ],
+        "summary": "A list[str] summary of this part of the video transcript.",
+    },
+    {"format": f"{JSON_OUTPUT} with the summary field.", "part": "{}", "total_parts": "{}", "transcript": "{}"},
+)
+REDUCE_PROMPT_TEMPLATE = _build_prompt_template(
+    {
+        "system": "Youtube Video Summarizer",
+        "goal": "Merge partial summaries of consecutive parts of a youtube video into one summary.",
+        "instructions": [
+            "partial_summaries is a list of bullet point summaries, in the order of the video.",
+            "Merge them into a single summary in bullet points.",
+            "Keep the emoji and the reference of each point.",
+            "Keep the points in the order of the video.",
+            "Must be minimum 10 points if the partial summaries contain at least 10 points.",
+            "Merge points that are similar and drop points that are not salient.",
+        ],
+        "summary": "A list[str] summary of the whole video.",
+    },
+    {"format": f"{JSON_OUTPUT} with the summary field.", "partial_summaries": "{}"},
+)
+PROMPT_TEMPLATES = {"sequential": PROMPT_TEMPLATE, "map": MAP_PROMPT_TEMPLATE, "reduce": REDUCE_PROMPT_TEMPLATE}
+MAX_RETRIES = 3
+MODEL = "gpt-3.5-turbo"
+MAX_TOKENS = 1024
+MAX_WORKERS = 4
+SUMMARIZE_MODES = ("map_reduce", "sequential")
+PROMPT_TEMPLATE_HASH = hashlib.sha256("\n".join(t.hash for t in PROMPT_TEMPLATES.values()).encode()).hexdigest()[:16]
+# stay below the max batch size of chroma's sqlite backend
+CHROMA_MAX_BATCH_SIZE = 5000
+ENGLISH_LANGUAGES = (
+    "en",
+    "en-US",
+    "en-GB",
+    "en-AU",
+    "en-CA",
+    "en-IN",
+    "en-NZ",
+    "en-ZA",
+    "en-IE",
+    "en-JM",
+    "en-BZ",
+    "en-TT",
+)
+_prompt_template_saved = False
+# start of the summary list and its complete points, in a partially generated json response
+_SUMMARY_START_RE = re.compile(r'"summary"\s*:\s*\[')
+_SUMMARY_POINT_RE = re.compile(r'\s*,?\s*"((?:[^"\\]|\\.)*)"')
 
 
 class SummaryResponse(BaseModel):
     summary: list[str]
 
-    @classmethod
-    def validate_response(cls, raw_response: str) -> bool:
-        try:
-            cls.model_validate_json(raw_response)
-            return True
-        except ValidationError as e:
-            logger.error(f"❌ Unable to validate LLM response: {e}")
-        return False
 
+class WaitingResponse(BaseModel):
+    """Response to a part of the transcript that is not the last one, in sequential mode."""
 
-def download_transcript(yt_vid_link: str) -> str:
+    message: Literal["waiting"]
+
+
+R = TypeVar("R", bound=BaseModel)
+
+
+def _normalize_link(yt_vid_link: str) -> str:
     # handle shortened youtube links
     if "youtu.be" in yt_vid_link:
         yt_vid_link = yt_vid_link.split("?")[0]
         yt_vid_link = yt_vid_link.replace("youtu.be/", "youtube.com/watch?v=")
+    return yt_vid_link
+
+
+def get_video_id(yt_vid_link: str) -> str:
+    return _normalize_link(yt_vid_link).split("v=")[1].split("&")[0]
+
+
+def _get_documents(ids: list[str], doc_type: str) -> dict[str, str]:
+    # resolve all ids in a single round-trip, chroma does not keep the order of the requested ids
+    if not collection or not ids:
+        return {}
+    with telemetry.span("chroma.get", type=doc_type, ids=len(ids)) as span:
+        result = collection.get(ids=list(dict.fromkeys(ids)), where={"type": doc_type})
+        span.set(found=len(result["ids"]))
+    return dict(zip(result["ids"], result["documents"]))
+
 
-    # download the transcript of the video
-    video_id = yt_vid_link.split("v=")[1]
+def _upsert_documents(ids: list[str], documents: list[str], metadatas: list[dict]):
+    with telemetry.span("chroma.upsert", type=metadatas[0]["type"] if metadatas else None, ids=len(ids)):
+        for i in range(0, len(ids), CHROMA_MAX_BATCH_SIZE):
+            batch = documents[i : i + CHROMA_MAX_BATCH_SIZE]
+            embeddings = get_document_embeddings()
+            collection.upsert(
+                ids=ids[i : i + CHROMA_MAX_BATCH_SIZE],
+                documents=batch,
+                metadatas=metadatas[i : i + CHROMA_MAX_BATCH_SIZE],
+                **({"embeddings": embeddings.embed(batch)} if embeddings else {}),
+            )
+
+
+def _video_metadata(yt_vid_links: list[str], metadata: Optional[dict[str, dict]]) -> dict[str, dict]:
+    # the channel id and publish time of the videos by video id, without unknown values
+    metadata = metadata or {}
+    return {
+        get_video_id(link): {key: value for key, value in metadata.get(link, {}).items() if value is not None}
+        for link in yt_vid_links
+    }
+
+
+def index_passages(doc_type: str, documents: dict[str, str], metadatas: dict[str, dict]):
+    """
+    Index the passages of the documents of a type for search, keyed by video id. A failure is only logged, as the
+    documents are stored, `python search.py --reindex` indexes them again.
+    """
+    if not collection or not documents:
+        return
     try:
-        if collection:
-            transcript_json = collection.get(ids=[video_id], where={"type": "transcript"})
-            if video_id in transcript_json["ids"]:
-                logger.info("✅ Got the transcript of the video from the database")
-                return transcript_json["documents"][0]
-        transcript_json = YouTubeTranscriptApi.get_transcript(
-            video_id,
-            languages=[
-                "en",
-                "en-US",
-                "en-GB",
-                "en-AU",
-                "en-CA",
-                "en-IN",
-                "en-NZ",
-                "en-ZA",
-                "en-IE",
-                "en-JM",
-                "en-BZ",
-                "en-TT",
-            ],
-        )
+        get_passage_index().add(doc_type, documents, metadatas)
+    except Exception as e:
+        logger.error(f"❌ Indexing the {doc_type} passages: {e}")
+
+
+class ChunkCheckpoints:
+    """
+    Summaries of the transcript parts of a video in map-reduce mode, stored in the collection as soon as a part is
+    summarized. A retry or a restarted process only summarizes the parts without a stored summary, and summarizing
+    again with another reduce prompt reuses all of them.
+
+    Parts are keyed by video id, part index and the hash of the map prompt, which covers the prompt template, the
+    text of the part and the chunking parameters. Without a collection nothing is stored.
+    """
+
+    def __init__(self, yt_vid_link: str, prompts: list[list[dict]]):
+        self.yt_vid_link = yt_vid_link
+        self.ids = []
+        self.summaries: dict[str, list[str]] = {}
+        if not collection:
+            return
+        video_id = get_video_id(yt_vid_link)
+        prompt_hashes = [hashlib.sha256(prompt_text(prompt).encode()).hexdigest()[:16] for prompt in prompts]
+        self.ids = [f"{video_id}_chunk_{i}_{prompt_hash}" for i, prompt_hash in enumerate(prompt_hashes)]
+        try:
+            documents = _get_documents(self.ids, "chunk_summary")
+        except Exception as e:
+            logger.error(f"❌ Downloading the part summaries: {e}")
+            return
+        self.summaries = {chunk_id: json.loads(document)["summary"] for chunk_id, document in documents.items()}
+        if self.summaries:
+            logger.info(f"Resuming with {len(self.summaries)} of {len(prompts)} part summaries from the database")
+
+    def get(self, part: int) -> Optional[list[str]]:
+        return self.summaries.get(self.ids[part]) if self.ids else None
+
+    def set(self, part: int, summary: list[str]):
+        if not self.ids:
+            return
+        self.summaries[self.ids[part]] = summary
+        try:
+            _upsert_documents(
+                ids=[self.ids[part]],
+                documents=[json.dumps({"summary": summary})],
+                metadatas=[{"source": self.yt_vid_link, "type": "chunk_summary", "part": part}],
+            )
+        except Exception as e:
+            # the summary of the part is still used, it is only generated again on a restart
+            logger.error(f"❌ Adding the part summary to database: {e}")
+
+
+def _fetch_transcript(video_id: str) -> str:
+    # shared with concurrent callers of the same video, and videos without transcripts are remembered for a while
+    transcript_json = get_transcript_service().fetch(video_id, languages=ENGLISH_LANGUAGES)
+    return " ".join([item["text"] for item in transcript_json])
+
+
+def download_transcripts(
+    yt_vid_links: list[str],
+    max_workers: int = 1,
+    raise_errors: bool = True,
+    metadata: Optional[dict[str, dict]] = None,
+) -> dict[str, str]:
+    """
+    Get the transcripts of many videos, keyed by link.
+
+    Transcripts in the database are read in one query and the missing ones are downloaded by up to `max_workers`
+    threads and then written in one batched upsert, and their passages are indexed for search with the channel id
+    and publish time of `metadata` by link, when known. With `raise_errors=False`, videos whose transcript cannot be
+    downloaded are logged and left out of the result.
+    """
+    video_ids = {link: get_video_id(link) for link in yt_vid_links}
+    video_metadata = _video_metadata(yt_vid_links, metadata)
+    try:
+        transcripts = _get_documents(list(video_ids.values()), "transcript")
     except Exception as e:
-        logger.error(f"❌ Downloading the transcript: {e}")
+        logger.error(f"❌ Getting the transcripts from the database: {e}")
         raise e
-    transcript = " ".join([item["text"] for item in transcript_json])
-    if collection:
+    logger.info(f"✅ Got {len(transcripts)} transcripts from the database")
+
+    missing = {video_id: _normalize_link(link) for link, video_id in video_ids.items() if video_id not in transcripts}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        fetch_transcript = telemetry.propagate(_fetch_transcript)
+        futures = {video_id: executor.submit(fetch_transcript, video_id) for video_id in missing}
+        for video_id, future in futures.items():
+            try:
+                transcripts[video_id] = future.result()
+            except Exception as e:
+                logger.error(f"❌ Downloading the transcript of {video_id}: {e}")
+                if raise_errors:
+                    raise e
+    missing = {video_id: link for video_id, link in missing.items() if video_id in transcripts}
+    if collection and missing:
         try:
-            collection.add(
-                documents=[transcript], metadatas=[{"source": yt_vid_link, "type": "transcript"}], ids=[video_id]
+            _upsert_documents(
+                ids=list(missing),
+                documents=[transcripts[video_id] for video_id in missing],
+                metadatas=[
+                    {"source": link, "type": "transcript", **video_metadata[video_id]}
+                    for video_id, link in missing.items()
+                ],
             )
         except Exception as e:
-            logger.error(f"❌ Adding transcript to database: {e}")
+            logger.error(f"❌ Adding transcripts to database: {e}")
             raise e
-    logger.info("✅ Got the transcript of the video")
-    return transcript
+        index_passages(
+            "transcript",
+            {video_id: transcripts[video_id] for video_id in missing},
+            {video_id: {"source": link, **video_metadata[video_id]} for video_id, link in missing.items()},
+        )
+    logger.info(f"✅ Downloaded {len(missing)} transcripts")
+    return {link: transcripts[video_id] for link, video_id in video_ids.items() if video_id in transcripts}
+
+
+def download_transcript(yt_vid_link: str) -> str:
+    return download_transcripts([yt_vid_link])[yt_vid_link]
 
 
-def _split_string_into_substrings(s, num_words):
-    words = s.split()
-    return [" ".join(words[i : i + num_words]) for i in range(0, len(words), num_words)]
+def _group_summaries(summaries: list[list[str]], num_tokens: int) -> list[list[list[str]]]:
+    # group consecutive partial summaries so that each reduce prompt stays within the token budget,
+    # every group holds at least two summaries so that each reduce round shrinks the list
+    groups, group, group_tokens = [], [], 0
+    for summary in summaries:
+        summary_tokens = count_tokens(json.dumps(summary), MODEL)
+        if len(group) >= 2 and group_tokens + summary_tokens > num_tokens:
+            groups.append(group)
+            group, group_tokens = [], 0
+        group.append(summary)
+        group_tokens += summary_tokens
+    if len(group) == 1 and groups:
+        groups[-1].append(group[0])
+    elif group:
+        groups.append(group)
+    return groups
 
 
-def summarize_transcript(yt_vid_link: str, transcript: str) -> str:
+def _invalidate(llm: Callable[[str], str], prompts: list[list[dict]], response_model: type[BaseModel]):
+    # invalid responses must not be served from the completion cache when retrying
+    if isinstance(llm, ChatLLM):
+        for prompt in prompts:
+            llm.invalidate(prompt, **llm.structured_params(response_model))
+
+
+def _complete_structured(llm: Callable[[str], str], prompt: list[dict], response_model: type[R]) -> R:
+    """
+    Complete the messages of a prompt into a `response_model`, retrying only this prompt while the response is
+    invalid. A ChatLLM gets the schema as response format, other LLMs get the messages as one text prompt and are
+    expected to follow its JSON template. Transient API errors are already retried with backoff by the scheduler of
+    the LLM.
+    """
+    for _ in range(MAX_RETRIES):
+        try:
+            if isinstance(llm, ChatLLM):
+                return llm.structured(prompt, response_model)
+            return parse_structured(response_model, llm(prompt_text(prompt)))
+        except ValidationError as e:
+            logger.error(f"❌ Unable to validate LLM response: {e}")
+    raise ValueError(f"❌ Unable to get a valid response after {MAX_RETRIES} retries")
+
+
+def _summarize_sequential(transcript_parts: list[str], llm: Callable[[str], str]) -> list[str]:
+    number_of_parts = len(transcript_parts)
+    for t in transcript_parts[:-1]:
+        _complete_structured(llm, PROMPT_TEMPLATE.format(False, t), WaitingResponse)
+    prompt = PROMPT_TEMPLATE.format(True, transcript_parts[-1])
+    summary = _complete_structured(llm, prompt, SummaryResponse).summary
+    logger.info(f"Summarized {number_of_parts} parts sequentially")
+    return summary
+
+
+def _summarize_map_reduce(
+    yt_vid_link: str, transcript_parts: list[str], llm: Callable[[str], str], executor: ThreadPoolExecutor
+) -> list[str]:
+    number_of_parts = len(transcript_parts)
+
+    def summarize(prompt: list[dict]) -> list[str]:
+        return _complete_structured(llm, prompt, SummaryResponse).summary
+
+    # map: summarize all parts concurrently, a part with an invalid response is retried on its own
+    prompts = [MAP_PROMPT_TEMPLATE.format(i + 1, number_of_parts, t) for i, t in enumerate(transcript_parts)]
+    checkpoints = ChunkCheckpoints(yt_vid_link, prompts)
+
+    def summarize_part(part: int) -> list[str]:
+        summary = checkpoints.get(part)
+        if summary is None:
+            summary = summarize(prompts[part])
+            checkpoints.set(part, summary)
+        return summary
+
+    # propagated, so that the LLM calls of the worker threads are part of the trace of the summary
+    summaries = list(executor.map(telemetry.propagate(summarize_part), range(number_of_parts)))
+
+    # reduce: merge the partial summaries, in multiple rounds if they do not fit in one prompt
+    while len(summaries) > 1:
+        groups = _group_summaries(summaries, get_chunk_budget(MODEL, REDUCE_PROMPT_TEMPLATE.static_text, MAX_TOKENS))
+        logger.info(f"Reducing {len(summaries)} partial summaries in {len(groups)} groups")
+        prompts = [REDUCE_PROMPT_TEMPLATE.format(json.dumps(g)) for g in groups]
+        summaries = list(executor.map(telemetry.propagate(summarize), prompts))
+    return summaries[0]
+
+
+def _stream(llm: Callable[[str], str], prompt: list[dict]) -> Iterator[str]:
+    if isinstance(llm, ChatLLM):
+        yield from llm.stream(prompt, **llm.structured_params(SummaryResponse))
+    elif hasattr(llm, "stream"):
+        yield from llm.stream(prompt_text(prompt))
+    else:
+        yield llm(prompt_text(prompt))
+
+
+def _complete_summary(
+    llm: Callable[[str], str],
+    prompt: list[dict],
+    on_point: Optional[Callable[[str], None]] = None,
+    on_retry: Optional[Callable[[], None]] = None,
+):
+    """
+    Get the validated summary of a summary prompt, retrying invalid responses.
+
+    The response is streamed and `on_point` is called with every summary point as soon as it is complete, and
+    `on_retry` before an invalid response is regenerated, as its points were already passed to `on_point`.
+    """
+    for attempt in range(MAX_RETRIES):
+        response, position = "", None
+        for delta in _stream(llm, prompt):
+            response += delta
+            if position is None and (match := _SUMMARY_START_RE.search(response)):
+                position = match.end()
+            while position is not None and (match := _SUMMARY_POINT_RE.match(response, position)):
+                position = match.end()
+                if on_point:
+                    on_point(json.loads(f'"{match.group(1)}"'))
+        try:
+            return parse_structured(SummaryResponse, response).summary
+        except ValidationError as e:
+            logger.error(f"❌ Unable to validate LLM response: {e}")
+        _invalidate(llm, [prompt], SummaryResponse)
+        logger.warning("Retrying...")
+        if on_retry and attempt < MAX_RETRIES - 1:
+            on_retry()
+    raise ValueError(f"❌ Unable to summarize after {MAX_RETRIES} retries")
+
+
+def summarize_transcript_stream(
+    yt_vid_link: str,
+    transcript: str,
+    max_workers: int = MAX_WORKERS,
+    llm: Optional[Callable[[str], str]] = None,
+    chunk_tokens: Optional[int] = None,
+    overlap_tokens: int = 0,
+) -> Iterator[dict]:
+    """
+    Summarize the transcript in map-reduce mode, yielding events as soon as they are produced.
+
+    Events are dicts {"event": name, "data": dict} with names
+    "progress" (stage, done and total parts), "point" (a summary point of a part, or of the final summary when part
+    is None), "retry" (the response of the part was invalid and is regenerated), "partial" (the summary of a part)
+    and finally "summary". Clients must drop the points of a part they received before a "retry" of that part, the
+    regenerated points follow.
+    """
+    llm = llm or get_summary_llm()
+    chunk_tokens = chunk_tokens or get_chunk_budget(MODEL, PROMPT_TEMPLATE.static_text, MAX_TOKENS)
+    transcript_parts = chunk_text(transcript, chunk_tokens, MODEL, overlap_tokens)
+    number_of_parts = len(transcript_parts)
+    logger.info(f"Transcript split into {number_of_parts} parts")
+    reduce_budget = get_chunk_budget(MODEL, REDUCE_PROMPT_TEMPLATE.static_text, MAX_TOKENS)
+    # events of the worker threads, None marks the end of a task
+    events = queue.Queue()
+
+    def summarize(
+        prompt: list[dict], part: Optional[int] = None, checkpoints: Optional[ChunkCheckpoints] = None
+    ) -> list[str]:
+        try:
+            summary = checkpoints.get(part - 1) if checkpoints else None
+            if summary is None:
+                on_point = lambda point: events.put({"event": "point", "data": {"part": part, "point": point}})  # noqa
+                on_retry = lambda: events.put({"event": "retry", "data": {"part": part}})  # noqa
+                summary = _complete_summary(llm, prompt, on_point, on_retry)
+                if checkpoints:
+                    checkpoints.set(part - 1, summary)
+            if part is not None:
+                events.put({"event": "partial", "data": {"part": part, "summary": summary}})
+            return summary
+        finally:
+            events.put(None)
+
+    def forward_events(futures: list[Future], stage: str) -> Iterator[dict]:
+        done = 0
+        yield {"event": "progress", "data": {"stage": stage, "done": done, "total": len(futures)}}
+        while done < len(futures):
+            event = events.get()
+            if event is None:
+                done += 1
+                event = {"event": "progress", "data": {"stage": stage, "done": done, "total": len(futures)}}
+            yield event
+        return [future.result() for future in futures]
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        if number_of_parts == 1:
+            future = executor.submit(summarize, PROMPT_TEMPLATE.format(True, transcript_parts[0]))
+            summary = (yield from forward_events([future], "summary"))[0]
+            yield {"event": "summary", "data": {"summary": summary}}
+            return
+
+        # map: summarize all parts concurrently
+        prompts = [MAP_PROMPT_TEMPLATE.format(i + 1, number_of_parts, t) for i, t in enumerate(transcript_parts)]
+        checkpoints = ChunkCheckpoints(yt_vid_link, prompts)
+        futures = [executor.submit(summarize, prompt, i + 1, checkpoints) for i, prompt in enumerate(prompts)]
+        summaries = yield from forward_events(futures, "map")
+
+        # reduce: intermediate rounds without streaming, only the points of the final summary are streamed
+        groups = _group_summaries(summaries, reduce_budget)
+        while len(groups) > 1:
+            yield {"event": "progress", "data": {"stage": "reduce", "done": 0, "total": len(groups)}}
+            prompts = [REDUCE_PROMPT_TEMPLATE.format(json.dumps(g)) for g in groups]
+            summaries = list(executor.map(lambda prompt: _complete_summary(llm, prompt), prompts))
+            groups = _group_summaries(summaries, reduce_budget)
+        future = executor.submit(summarize, REDUCE_PROMPT_TEMPLATE.format(json.dumps(groups[0])))
+        summary = (yield from forward_events([future], "reduce"))[0]
+    yield {"event": "summary", "data": {"summary": summary}}
+
+
+def get_summary_llm() -> ChatLLM:
+    # openai completion, shared by all retries and threads. Its completions are sampled at temperature 0.7 and so
+    # not cached (cache=None caches only at temperature 0), a cache would replay the same summary on every call. To
+    # pay only once per transcript, pass get_llm("gpt-3", max_tokens=MAX_TOKENS, cache=True) as the llm of
+    # summarize_transcript, or get_llm("gpt-3", max_tokens=MAX_TOKENS, temperature=0) for deterministic summaries
+    return get_llm("gpt-3", max_tokens=MAX_TOKENS)
+
+
+def summarize_transcript(
+    yt_vid_link: str,
+    transcript: str,
+    mode: str = "map_reduce",
+    max_workers: int = MAX_WORKERS,
+    llm: Optional[Callable[[str], str]] = None,
+    chunk_tokens: Optional[int] = None,
+    overlap_tokens: int = 0,
+) -> list[str]:
+    """
+    Summarize the transcript of a youtube video.
+
+    mode "map_reduce" summarizes the transcript parts concurrently with up to `max_workers` LLM calls in flight
+    and merges the partial summaries. mode "sequential" sends the parts one after another to a single LLM
+    conversation and is used as fallback when map-reduce fails to produce a valid summary.
+
+    The transcript is split into parts of `chunk_tokens` tokens, by default as many as fit in the context window
+    of the model next to the prompt and the reply, with `overlap_tokens` tokens of overlap between parts.
+    In map-reduce mode the summaries of the parts are checkpointed in the database, see `ChunkCheckpoints`.
+    """
+    if mode not in SUMMARIZE_MODES:
+        raise ValueError(f"Invalid mode: {mode}")
+
     # split the transcript into parts
-    transcript_parts = _split_string_into_substrings(transcript, 2048)
+    # budget for the longest prompt template, so that the parts fit in either mode
+    chunk_tokens = chunk_tokens or get_chunk_budget(MODEL, PROMPT_TEMPLATE.static_text, MAX_TOKENS)
+    transcript_parts = chunk_text(transcript, chunk_tokens, MODEL, overlap_tokens)
     number_of_parts = len(transcript_parts)
     logger.info(f"Transcript split into {number_of_parts} parts")
 
-    # summarize the transcript
-    for i in range(MAX_RETRIES):
-        # openai completion
-        llm = get_llm("gpt-3", max_tokens=1024)
-        retry = False
+    # a single part is summarized in a single call either way
+    if number_of_parts == 1:
+        mode = "sequential"
 
-        try:
-            for i, t in enumerate(transcript_parts):
-                formatted_prompt = PROMPT_TEMPLATE.format(i + 1 == number_of_parts, t)
-                response = llm(formatted_prompt)
-                if i + 1 < number_of_parts and not GenericResponse.validate_response(response, "waiting"):
-                    retry = True
-                    break
-            if retry or not SummaryResponse.validate_response(response):
-                logger.warn("Retrying...")
-                continue
-            summary = SummaryResponse.parse_raw(response).summary
-            break
-        except Exception as e:
-            logger.error(f"❌ Summarizing the transcript: {e}")
-            raise e
+    # summarize the transcript
+    llm_ = llm or get_summary_llm()
+    try:
+        with telemetry.span("summarize", mode=mode, parts=number_of_parts):
+            if mode == "map_reduce":
+                with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                    summary = _summarize_map_reduce(yt_vid_link, transcript_parts, llm_, executor)
+            else:
+                summary = _summarize_sequential(transcript_parts, llm_)
+    except ValueError as e:
+        if mode != "map_reduce":
+            raise
+        logger.warning(f"Map-reduce summarization failed, falling back to sequential mode: {e}")
+        return summarize_transcript(
+            yt_vid_link, transcript, "sequential", llm=llm, chunk_tokens=chunk_tokens, overlap_tokens=overlap_tokens
+        )
 
     logger.info("✅ Generated the summary of the video")
     return summary
 
 
-def save_summary_to_database(yt_vid_link: str, summary: str):
-    video_id = yt_vid_link.split("v=")[1]
+def _save_prompt_template():
+    # the prompt templates are stored once and referenced by their hash from every summary
+    global _prompt_template_saved
+    if _prompt_template_saved:
+        return
+    prompt_template_id = f"prompt_template_{PROMPT_TEMPLATE_HASH}"
+    if not _get_documents([prompt_template_id], "prompt_template"):
+        _upsert_documents(
+            ids=[prompt_template_id],
+            documents=[
+                json.dumps({name: template.to_dict() for name, template in PROMPT_TEMPLATES.items()})
+            ],
+            metadatas=[{"type": "prompt_template", "hash": PROMPT_TEMPLATE_HASH}],
+        )
+    _prompt_template_saved = True
+
+
+def save_summaries_to_database(summaries: dict[str, list[str]], metadata: Optional[dict[str, dict]] = None):
+    """
+    Save the summaries of many videos, keyed by link, in one batched upsert, and index them for search with the
+    channel id and publish time of `metadata` by link, when known.
+    """
+    video_metadata = _video_metadata(list(summaries), metadata)
     try:
-        collection.upsert(
-            ids=[video_id + "_summary"],
+        _save_prompt_template()
+        # one record per video, even when it is linked in different ways
+        links = {get_video_id(link) + "_summary": link for link in summaries}
+        _upsert_documents(
+            ids=list(links),
             metadatas=[
                 {
-                    "source": yt_vid_link,
+                    "source": link,
                     "type": "summary",
-                    "prompt_template": PROMPT_TEMPLATE,
+                    "prompt_template_hash": PROMPT_TEMPLATE_HASH,
+                    **video_metadata[get_video_id(link)],
                 }
+                for link in links.values()
             ],
-            documents=[json.dumps({"summary": summary})],
+            documents=[json.dumps({"summary": summaries[link]}) for link in links.values()],
         )
     except Exception as e:
-        logger.error(f"❌ Adding summary to database: {e}")
+        logger.error(f"❌ Adding summaries to database: {e}")
         raise e
+    links = {get_video_id(link): link for link in summaries}
+    index_passages(
+        "summary",
+        {video_id: "\n".join(summaries[link]) for video_id, link in links.items()},
+        {video_id: {"source": link, **video_metadata[video_id]} for video_id, link in links.items()},
+    )
+
+
+def save_summary_to_database(yt_vid_link: str, summary: list[str]):
+    save_summaries_to_database({yt_vid_link: summary})
 
 
-def get_summary_from_database(yt_vid_link: str) -> str:
-    video_id = yt_vid_link.split("v=")[1]
+def get_summaries_from_database(yt_vid_links: list[str]) -> dict[str, str]:
+    """Get the stored summaries of many videos in one query, keyed by link. Links without summary are left out."""
+    summary_ids = {link: get_video_id(link) + "_summary" for link in yt_vid_links}
     try:
-        summary_json = collection.get(
-            ids=[video_id + "_summary"],
-            where={"type": "summary"},
-        )
-        if video_id + "_summary" in summary_json["ids"]:
-            logger.info("✅ Got the summary of the video from the database")
-            return summary_json["documents"][0]
+        summaries = _get_documents(list(summary_ids.values()), "summary")
     except Exception as e:
-        logger.error(f"❌ Downloading the summary: {e}")
+        logger.error(f"❌ Downloading the summaries: {e}")
         raise e
+    logger.info(f"✅ Got {len(summaries)} summaries from the database")
+    return {link: summaries[summary_id] for link, summary_id in summary_ids.items() if summary_id in summaries}
+
+
+def get_summary_from_database(yt_vid_link: str) -> Optional[str]:
+    return get_summaries_from_database([yt_vid_link]).get(yt_vid_link)
@@ -0,0 +1,188 @@
+import math
+import sys
+from pathlib import Path
+from typing import Literal, Optional
+
+sys.path.insert(0, Path(__file__).parent.parent.as_posix())
+
+from common import telemetry  # noqa: E402
+from common.chunking import chunk_text  # noqa: E402
+from common.embeddings import Embeddings  # noqa: E402
+from common.search_index import SearchIndex  # noqa: E402
+
+PASSAGE_TOKENS = 200
+PASSAGE_OVERLAP_TOKENS = 20
+# metadata of the passages, all of them can be filtered on
+PASSAGE_METADATA = ("video_id", "type", "source", "part", "channel_id", "published")
+SEARCH_MODES = ("hybrid", "semantic", "keyword")
+# candidates per retriever of a hybrid search, and the constant of reciprocal rank fusion
+HYBRID_CANDIDATES = 50
+RRF_K = 60
+# a filtered semantic search compares the vectors of all passages that match when they are at most
+# EXACT_SEARCH_MAX_PASSAGES, and otherwise keeps the passages that match of OVERSAMPLE times the expected number of
+# nearest neighbours of the HNSW index to find k of them, at most MAX_NEIGHBOURS
+EXACT_SEARCH_MAX_PASSAGES = 10_000
+OVERSAMPLE = 2
+MAX_NEIGHBOURS = 5000
+CHROMA_MAX_BATCH_SIZE = 5000
+
+
+def search_filter(
+    channel_id: Optional[str] = None,
+    since: Optional[int] = None,
+    until: Optional[int] = None,
+    doc_type: Optional[str] = None,
+) -> dict:
+    """A filter of the passages by channel, publish time (unix seconds, inclusive) and type."""
+    where = {}
+    if channel_id:
+        where["channel_id"] = channel_id
+    if since is not None or until is not None:
+        where["published"] = {
+            operator: value for operator, value in (("$gte", since), ("$lte", until)) if value is not None
+        }
+    if doc_type:
+        where["type"] = doc_type
+    return where
+
+
+def _chroma_where(where: dict) -> Optional[dict]:
+    # chroma takes one operator per clause, several clauses only in an $and
+    clauses = [
+        {column: {operator: value}}
+        for column, condition in where.items()
+        for operator, value in (condition.items() if isinstance(condition, dict) else [("$eq", condition)])
+    ]
+    if len(clauses) > 1:
+        return {"$and": clauses}
+    return clauses[0] if clauses else None
+
+
+def _passage(document: dict) -> dict:
+    # a document of the search index, with its metadata in the passage
+    return {"id": document["id"], "text": document["text"], "score": document["score"], **document["metadata"]}
+
+
+class PassageIndex:
+    """
+    Passages of the transcripts and summaries of the videos, for semantic, keyword and hybrid search.
+
+    Documents are chunked into passages of `PASSAGE_TOKENS` tokens at sentence ends and added to a chroma collection
+    of their own, so that its HNSW index only holds passages and a semantic search is an approximate nearest
+    neighbour lookup, and to a search index with their text, metadata and vectors for BM25 keyword search. A hybrid
+    search merges the candidates of both by reciprocal rank fusion. The passages are embedded by `embeddings`, or by
+    the embedding function of the collection without it.
+
+    Only the ids and distances of the nearest neighbours are read from chroma, which filters on metadata by scanning
+    it, the passages and filters come from the indexed tables of the search index: a filter that few passages match
+    is searched exactly over their vectors, and one that many match on the nearest neighbours of the whole index.
+    """
+
+    def __init__(self, collection, search_index: SearchIndex, embeddings: Optional[Embeddings] = None):
+        self.collection = collection
+        self.search_index = search_index
+        self.embeddings = embeddings
+
+    def add(self, doc_type: str, documents: dict[str, str], metadatas: Optional[dict[str, dict]] = None):
+        """
+        Index the documents of a type (e.g. "transcript" or "summary") by video id, replacing their previous
+        passages. `metadatas` holds the source link, channel id and publish time of the videos when they are known.
+        """
+        if not documents:
+            return
+        metadatas = metadatas or {}
+        ids, passages, passage_metadatas = [], [], []
+        for video_id, document in documents.items():
+            metadata = metadatas.get(video_id, {})
+            # chroma takes no None values
+            metadata = {key: value for key, value in metadata.items() if key in PASSAGE_METADATA and value is not None}
+            chunks = chunk_text(document, PASSAGE_TOKENS, overlap_tokens=PASSAGE_OVERLAP_TOKENS)
+            for part, passage in enumerate(chunks):
+                ids.append(f"{video_id}_{doc_type}_{part}")
+                passages.append(passage)
+                passage_metadatas.append({**metadata, "video_id": video_id, "type": doc_type, "part": part})
+        with telemetry.span("passages.add", type=doc_type, videos=len(documents), passages=len(ids)):
+            # documents that got shorter leave no passages behind
+            where = {"video_id": {"$in": list(documents)}, "type": doc_type}
+            self.collection.delete(where=_chroma_where(where))
+            self.search_index.delete(where)
+            vectors = self.embeddings.embed(passages) if self.embeddings else None
+            for i in range(0, len(ids), CHROMA_MAX_BATCH_SIZE):
+                self.collection.add(
+                    ids=ids[i : i + CHROMA_MAX_BATCH_SIZE],
+                    documents=passages[i : i + CHROMA_MAX_BATCH_SIZE],
+                    metadatas=passage_metadatas[i : i + CHROMA_MAX_BATCH_SIZE],
+                    **({"embeddings": vectors[i : i + CHROMA_MAX_BATCH_SIZE]} if vectors is not None else {}),
+                )
+            self.search_index.upsert(ids, passages, passage_metadatas, vectors)
+
+    def _nearest(self, query_kws: dict, n: int, where: Optional[dict] = None) -> list[tuple[str, float]]:
+        # ids and cosine similarities of the nearest neighbours in chroma
+        with telemetry.span("chroma.query", n=n, filtered=bool(where)):
+            result = self.collection.query(
+                **query_kws, n_results=n, where=_chroma_where(where or {}), include=["distances"]
+            )
+        return [(id, 1 - distance) for id, distance in zip(result["ids"][0], result["distances"][0])]
+
+    def semantic_search(self, query: str, k: int = 10, where: Optional[dict] = None) -> list[dict]:
+        """The `k` passages closest in meaning to the query, best first, scored by cosine similarity."""
+        matching = self.search_index.count(where) if where else None
+        if matching == 0:
+            return []
+        if self.embeddings:
+            vector = self.embeddings.embed_query(query)
+            query_kws = {"query_embeddings": [vector]}
+        else:
+            query_kws = {"query_texts": [query]}
+        n = k
+        if where:
+            if self.embeddings and matching <= EXACT_SEARCH_MAX_PASSAGES:
+                with telemetry.span("search_index.vector_search", k=k, passages=matching):
+                    return [_passage(hit) for hit in self.search_index.vector_search(vector, k, where)]
+            n = min(math.ceil(k * len(self.search_index) / matching * OVERSAMPLE), MAX_NEIGHBOURS)
+        neighbours = self._nearest(query_kws, n)
+        passages = self.search_index.get([id for id, _ in neighbours], where)
+        hits = [{**_passage(passages[id]), "score": score} for id, score in neighbours if id in passages][:k]
+        if where and len(hits) < min(k, matching):
+            # too few of the nearest neighbours match, chroma scans the passages that do
+            neighbours = self._nearest(query_kws, k, where)
+            passages = self.search_index.get([id for id, _ in neighbours])
+            hits = [{**_passage(passages[id]), "score": score} for id, score in neighbours if id in passages]
+        return hits
+
+    def keyword_search(self, query: str, k: int = 10, where: Optional[dict] = None) -> list[dict]:
+        """The `k` passages that best match the words of the query, best first, scored by BM25."""
+        with telemetry.span("search_index.keyword_search", k=k):
+            return [_passage(hit) for hit in self.search_index.keyword_search(query, k, where)]
+
+    def hybrid_search(self, query: str, k: int = 10, where: Optional[dict] = None) -> list[dict]:
+        """
+        The `k` best passages of a semantic and a keyword search, by reciprocal rank fusion of their ranks: passages
+        found by both rank first, and the scores of the two searches need not be comparable.
+        """
+        candidates = max(k, HYBRID_CANDIDATES)
+        hits, scores = {}, {}
+        for results in (self.semantic_search(query, candidates, where), self.keyword_search(query, candidates, where)):
+            for rank, hit in enumerate(results):
+                hits.setdefault(hit["id"], hit)
+                scores[hit["id"]] = scores.get(hit["id"], 0.0) + 1 / (RRF_K + rank + 1)
+        best = sorted(scores, key=scores.__getitem__, reverse=True)[:k]
+        return [{**hits[id], "score": scores[id]} for id in best]
+
+    def search(
+        self,
+        query: str,
+        k: int = 10,
+        mode: Literal["hybrid", "semantic", "keyword"] = "hybrid",
+        where: Optional[dict] = None,
+    ) -> list[dict]:
+        """
+        The `k` passages that best match the query, best first, with their text, score, video id, type, part and
+        the source link, channel id and publish time when known. `where` is a filter from `search_filter`.
+        """
+        if mode not in SEARCH_MODES:
+            raise ValueError(f"Invalid search mode: {mode}, expected one of {', '.join(SEARCH_MODES)}")
+        with telemetry.span("search", mode=mode, k=k, filtered=bool(where)) as span:
+            hits = getattr(self, f"{mode}_search")(query, k, where)
+            span.set(hits=len(hits))
+            return hits
@@ -0,0 +1,203 @@
+import json
+import logging
+import shelve
+import sys
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Iterator, Optional, Union
+
+sys.path.insert(0, Path(__file__).parent.parent.as_posix())
+
+from common.singleflight import SingleFlight  # noqa: E402
+from functions import download_transcript  # noqa: E402
+from functions import get_video_id  # noqa: E402
+from functions import PROMPT_TEMPLATE_HASH  # noqa: E402
+from functions import summarize_transcript  # noqa: E402
+from streaming import format_sse  # noqa: E402
+from streaming import summary_sse_stream  # noqa: E402
+
+logger = logging.getLogger(__name__)
+
+
+class ResultStore:
+    """Persistent key-value store of transcripts and summaries, e.g. a modal.Dict shared by all containers."""
+
+    def get(self, key: str) -> Optional[str]:
+        raise NotImplementedError
+
+    def set(self, key: str, value: str):
+        raise NotImplementedError
+
+
+class MemoryStore(ResultStore):
+    """Local stand-in that keeps the results in a dict."""
+
+    def __init__(self):
+        self._data = {}
+
+    def get(self, key: str) -> Optional[str]:
+        return self._data.get(key)
+
+    def set(self, key: str, value: str):
+        self._data[key] = value
+
+
+class ShelfStore(ResultStore):
+    """Local stand-in that keeps the results in a file."""
+
+    def __init__(self, path: Union[str, Path]):
+        self._lock = threading.Lock()
+        self._shelf = shelve.open(str(path))
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            return self._shelf.get(key)
+
+    def set(self, key: str, value: str):
+        with self._lock:
+            self._shelf[key] = value
+            self._shelf.sync()
+
+
+class EventLog:
+    """Events of a summary stream in flight, replayed from the start to every request that streams the video."""
+
+    def __init__(self):
+        self._events: list[str] = []
+        self._closed = False
+        self._condition = threading.Condition()
+
+    def append(self, event: str):
+        with self._condition:
+            self._events.append(event)
+            self._condition.notify_all()
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    def __iter__(self) -> Iterator[str]:
+        position = 0
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: len(self._events) > position or self._closed)
+                events = self._events[position:]
+                if not events:
+                    return
+            position += len(events)
+            yield from events
+
+
+class ResultCache:
+    """
+    Warm, in-process LRU of transcripts and summaries keyed by video id, backed by a persistent `ResultStore`.
+
+    Concurrent requests for the same video share a single download and a single summarization, streamed or not.
+    """
+
+    def __init__(self, store: Optional[ResultStore] = None, max_entries: int = 256):
+        self.store = store or MemoryStore()
+        self.max_entries = max_entries
+        self._lru: OrderedDict[str, str] = OrderedDict()
+        self._lock = threading.Lock()
+        self._in_flight = SingleFlight()
+        # event logs of the summary streams in flight, by summary key
+        self._streams: dict[str, EventLog] = {}
+
+    def _get(self, key: str) -> Optional[str]:
+        with self._lock:
+            if key in self._lru:
+                self._lru.move_to_end(key)
+                return self._lru[key]
+        value = self.store.get(key)
+        if value is not None:
+            self._set_lru(key, value)
+        return value
+
+    def _set(self, key: str, value: str):
+        self.store.set(key, value)
+        self._set_lru(key, value)
+
+    def _set_lru(self, key: str, value: str):
+        with self._lock:
+            self._lru[key] = value
+            self._lru.move_to_end(key)
+            while len(self._lru) > self.max_entries:
+                self._lru.popitem(last=False)
+
+    def _get_or_create(self, key: str, create) -> str:
+        value = self._get(key)
+        if value is not None:
+            logger.info(f"✅ Got {key} from the result cache")
+            return value
+
+        def create_and_store() -> str:
+            # another request may have finished it while this one waited for the lock of the single-flight
+            value = self._get(key)
+            if value is None:
+                value = create()
+                self._set(key, value)
+            return value
+
+        return self._in_flight.do(key, create_and_store)
+
+    def get_transcript(self, yt_vid_link: str) -> str:
+        video_id = get_video_id(yt_vid_link)
+        return self._get_or_create(f"transcript:{video_id}", lambda: download_transcript(yt_vid_link))
+
+    def get_summary(self, yt_vid_link: str) -> list[str]:
+        def summarize() -> str:
+            return json.dumps(summarize_transcript(yt_vid_link, self.get_transcript(yt_vid_link)))
+
+        return json.loads(self._get_or_create(self._summary_key(yt_vid_link), summarize))
+
+    def stream_summary(self, yt_vid_link: str) -> Iterator[str]:
+        """
+        Server-sent events of summarizing a video, see `summary_sse_stream`. The summarization runs once in a
+        background thread, through the single-flight of `get_summary`, and every concurrent request for the video
+        replays its events, so that it finishes and is stored even when the first client disconnects.
+        """
+        key = self._summary_key(yt_vid_link)
+        summary = self._get(key)
+        if summary is not None:
+            return iter([format_sse({"event": "summary", "data": {"summary": json.loads(summary)}})])
+        with self._lock:
+            log = self._streams.get(key)
+            if log is None:
+                log = self._streams[key] = EventLog()
+                threading.Thread(target=self._stream_summary, args=(yt_vid_link, key, log), daemon=True).start()
+        return iter(log)
+
+    def _stream_summary(self, yt_vid_link: str, key: str, log: EventLog):
+        summaries, streamed = [], False
+
+        def summarize() -> str:
+            nonlocal streamed
+            streamed = True
+            events = summary_sse_stream(yt_vid_link, get_transcript=self.get_transcript, on_summary=summaries.append)
+            for event in events:
+                log.append(event)
+            if not summaries:
+                # the stream ended with an error event, nothing is stored
+                raise RuntimeError(f"No summary of {yt_vid_link}")
+            return json.dumps(summaries[0])
+
+        try:
+            summary = self._get_or_create(key, summarize)
+            if not streamed:
+                # summarized by a concurrent `get_summary`, which this stream waited for
+                log.append(format_sse({"event": "summary", "data": {"summary": json.loads(summary)}}))
+        except Exception as e:
+            if not streamed:
+                log.append(format_sse({"event": "error", "data": {"message": str(e)}}))
+        finally:
+            with self._lock:
+                del self._streams[key]
+            log.close()
+
+    @staticmethod
+    def _summary_key(yt_vid_link: str) -> str:
+        # summaries of other prompt templates are outdated
+        return f"summary:{PROMPT_TEMPLATE_HASH}:{get_video_id(yt_vid_link)}"
@@ -0,0 +1,100 @@
+import argparse
+import json
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Optional
+
+os.environ["CHROMA_DB_PATH"] = str(Path(__file__).parent.parent / "chroma.db")
+
+from functions import collection  # noqa: E402
+from functions import get_video_id  # noqa: E402
+from functions import get_passage_index  # noqa: E402
+from passages import search_filter  # noqa: E402
+from passages import SEARCH_MODES  # noqa: E402
+from common import telemetry  # noqa: E402
+
+REINDEX_BATCH_SIZE = 100
+
+
+def reindex(batch_size: int = REINDEX_BATCH_SIZE) -> dict[str, int]:
+    """
+    Index the passages of all stored transcripts and summaries for search, e.g. of videos stored before search was
+    added or whose indexing failed. Returns the number of videos indexed by type.
+    """
+    counts = {}
+    for doc_type in ("transcript", "summary"):
+        counts[doc_type], offset = 0, 0
+        while True:
+            with telemetry.span("chroma.get", type=doc_type, offset=offset):
+                result = collection.get(
+                    where={"type": doc_type}, limit=batch_size, offset=offset, include=["documents", "metadatas"]
+                )
+            if not result["ids"]:
+                break
+            documents, metadatas = {}, {}
+            for document, metadata in zip(result["documents"], result["metadatas"]):
+                video_id = get_video_id(metadata["source"])
+                if doc_type == "summary":
+                    document = "\n".join(json.loads(document)["summary"])
+                documents[video_id], metadatas[video_id] = document, metadata
+            get_passage_index().add(doc_type, documents, metadatas)
+            counts[doc_type] += len(documents)
+            offset += batch_size
+    return counts
+
+
+def _timestamp(date: Optional[str], end_of_day: bool = False) -> Optional[int]:
+    # ISO dates or times in UTC unless they have an offset, a date until covers the whole day
+    if not date:
+        return None
+    timestamp = datetime.fromisoformat(date)
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    if end_of_day and len(date) == 10:
+        timestamp += timedelta(days=1, seconds=-1)
+    return int(timestamp.timestamp())
+
+
+def print_hits(hits: list[dict], seconds: float):
+    print(f"===== {len(hits)} passages in {seconds * 1000:.1f} ms =====")
+    for hit in hits:
+        published = hit.get("published")
+        date = datetime.fromtimestamp(published, timezone.utc).date().isoformat() if published else "unknown date"
+        print(f"[{hit['score']:.4f}] {hit['type']} part {hit['part']} of {hit.get('source', hit['video_id'])}")
+        print(f"        channel {hit.get('channel_id', 'unknown')}, {date}")
+        print(f"        {hit['text']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Search the passages of the stored transcripts and summaries")
+    parser.add_argument("query", nargs="?", help="Words or question to search for")
+    parser.add_argument("-k", "--top-k", type=int, default=10, help="Passages to return")
+    parser.add_argument("--mode", choices=SEARCH_MODES, default="hybrid", help="BM25 + vector, vector or BM25 search")
+    parser.add_argument("--channel", default=None, help="Only videos of this channel id")
+    parser.add_argument("--since", default=None, help="Only videos published on or after this ISO date or time")
+    parser.add_argument("--until", default=None, help="Only videos published on or before this ISO date or time")
+    parser.add_argument("--type", choices=("transcript", "summary"), default=None, help="Only passages of this type")
+    parser.add_argument("--json", action="store_true", help="Print the passages as JSON")
+    parser.add_argument("--reindex", action="store_true", help="Index all stored transcripts and summaries first")
+    parser.add_argument("--telemetry", default=None, help="JSON lines file of spans and counters, see TELEMETRY_PATH")
+    args = parser.parse_args()
+    if args.telemetry:
+        telemetry.configure(path=args.telemetry)
+    if not args.query and not args.reindex:
+        parser.error("a query or --reindex is required")
+    if collection is None:
+        parser.error("search needs chromadb")
+    if args.reindex:
+        counts = reindex()
+        print(f"===== Indexed {counts['transcript']} transcripts and {counts['summary']} summaries =====")
+    if args.query:
+        where = search_filter(args.channel, _timestamp(args.since), _timestamp(args.until, end_of_day=True), args.type)
+        start_time = time.perf_counter()
+        hits = get_passage_index().search(args.query, args.top_k, args.mode, where)
+        seconds = time.perf_counter() - start_time
+        if args.json:
+            print(json.dumps(hits, indent=2, ensure_ascii=False))
+        else:
+            print_hits(hits, seconds)
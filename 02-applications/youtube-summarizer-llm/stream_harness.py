@@ -0,0 +1,98 @@
+"""
+Serve the summarise and summarise_stream endpoints locally against a fake LLM and measure time-to-first-byte.
+
+    python stream_harness.py --num-words 20000 --latency 1.0 --seconds-per-token 0.01
+"""
+import argparse
+import http.client
+import json
+import sys
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from pathlib import Path
+
+sys.path.insert(0, Path(__file__).parent.parent.as_posix())
+
+from benchmark import _fake_responder  # noqa: E402
+from benchmark import _fake_transcript  # noqa: E402
+from common.fake_llm import FakeLLM  # noqa: E402
+from functions import summarize_transcript  # noqa: E402
+from streaming import summary_sse_stream  # noqa: E402
+
+
+def _make_handler(llm: FakeLLM, transcript: str) -> type:
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            url = urllib.parse.urlparse(self.path)
+            link = urllib.parse.parse_qs(url.query)["link"][0]
+            if url.path == "/summarise":
+                # same as bot.summarise
+                body = json.dumps(summarize_transcript(link, transcript, llm=llm)).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            elif url.path == "/summarise_stream":
+                # same as bot.summarise_stream, with chunked transfer encoding like the modal web endpoint
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                for event in summary_sse_stream(link, llm=llm, get_transcript=lambda _: transcript):
+                    data = event.encode()
+                    self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+                    self.wfile.flush()
+                self.wfile.write(b"0\r\n\r\n")
+            else:
+                self.send_error(404)
+
+        def log_message(self, *a):
+            pass
+
+    return Handler
+
+
+def _measure(port: int, path: str) -> dict:
+    t0 = time.perf_counter()
+    connection = http.client.HTTPConnection("localhost", port)
+    connection.request("GET", path)
+    response = connection.getresponse()
+    first_byte = first_point = None
+    events = 0
+    while line := response.readline():
+        first_byte = first_byte or time.perf_counter() - t0
+        if line.startswith(b"event: point") and first_point is None:
+            first_point = time.perf_counter() - t0
+        events += line.startswith(b"event:")
+    connection.close()
+    return {"first_byte": first_byte, "first_point": first_point, "total": time.perf_counter() - t0, "events": events}
+
+
+def main(num_words: int, latency: float, seconds_per_token: float):
+    llm = FakeLLM(_fake_responder, latency=latency, seconds_per_token=seconds_per_token)
+    server = ThreadingHTTPServer(("localhost", 0), _make_handler(llm, _fake_transcript(num_words)))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    port = server.server_address[1]
+    print(f"Transcript of {num_words} words, fake LLM latency {latency}s + {seconds_per_token}s per token")
+    print(f"{'endpoint':<18} {'first byte':>10} {'first point':>12} {'total':>8} {'events':>7}")
+    for endpoint in ("summarise", "summarise_stream"):
+        llm.reset()
+        m = _measure(port, f"/{endpoint}?link=https://www.youtube.com/watch?v=harness")
+        first_point = f"{m['first_point']:.2f}s" if m["first_point"] is not None else "-"
+        print(f"{endpoint:<18} {m['first_byte']:>9.2f}s {first_point:>12} {m['total']:>7.2f}s {m['events']:>7}")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num-words", type=int, default=20000, help="Length of the fake transcript")
+    parser.add_argument("--latency", type=float, default=1.0, help="Seconds before the first token of a fake LLM call")
+    parser.add_argument("--seconds-per-token", type=float, default=0.01, help="Seconds per generated token")
+    args = parser.parse_args()
+    main(args.num_words, args.latency, args.seconds_per_token)
@@ -0,0 +1,34 @@
+import json
+import logging
+from typing import Callable, Iterator, Optional
+
+from functions import download_transcript
+from functions import MAX_WORKERS
+from functions import summarize_transcript_stream
+
+logger = logging.getLogger(__name__)
+
+
+def format_sse(event: dict) -> str:
+    return f"event: {event['event']}\ndata: {json.dumps(event['data'])}\n\n"
+
+
+def summary_sse_stream(
+    yt_vid_link: str,
+    max_workers: int = MAX_WORKERS,
+    llm: Optional[Callable[[str], str]] = None,
+    get_transcript: Callable[[str], str] = download_transcript,
+    on_summary: Optional[Callable[[list[str]], None]] = None,
+) -> Iterator[str]:
+    """Server-sent events of summarizing a video, see `summarize_transcript_stream`, or an "error" event."""
+    # respond right away, so that clients and proxies do not time out while the transcript is downloaded
+    yield format_sse({"event": "progress", "data": {"stage": "transcript", "done": 0, "total": 1}})
+    try:
+        transcript = get_transcript(yt_vid_link)
+        for event in summarize_transcript_stream(yt_vid_link, transcript, max_workers, llm):
+            if event["event"] == "summary" and on_summary:
+                on_summary(event["data"]["summary"])
+            yield format_sse(event)
+    except Exception as e:
+        logger.error(f"❌ Streaming the summary: {e}")
+        yield format_sse({"event": "error", "data": {"message": str(e)}})